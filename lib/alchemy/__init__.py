@@ -35,9 +35,10 @@ import ConfigParser
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy.sql import exists
+from sqlalchemy.sql import exists, select
 from collections import defaultdict
 import schema
+import upsert
 from match import *
 import uuid
 
@@ -188,10 +189,13 @@ def fetch_session(db=None, dbtype='grant'):
     return session
 
 
-def add_grant(obj, override=True, temp=False):
+def add_grant(obj, override=True, temp=False, tables=None):
     """
     PatentGrant Object converting to tables via SQLAlchemy
     Necessary to convert dates to datetime because of SQLite (OK on MySQL)
+    If [tables] is given (see lib/alchemy/rows.py:projection), only those
+    tables are filled in. The patent replaced by [obj] loses its rows in
+    the other tables too
 
     Case Sensitivity and Table Reflection
     MySQL has inconsistent support for case-sensitive identifier names,
@@ -223,7 +227,7 @@ def add_grant(obj, override=True, temp=False):
     pat = schema.Patent(**obj.pat)
     pat.application = schema.Application(**obj.app)
     # lots of abstracts seem to be missing. why?
-    add_all_fields(obj, pat)
+    add_all_fields(obj, pat, tables)
     if is_mysql():
         grantsession.execute('set foreign_key_checks = 0;')
         grantsession.execute('set unique_checks = 0;')
@@ -233,15 +237,13 @@ def add_grant(obj, override=True, temp=False):
     grantsession.merge(pat)
 
 
-def add_all_fields(obj, pat):
-    add_asg(obj, pat)
-    add_inv(obj, pat)
-    add_law(obj, pat)
-    add_usreldoc(obj, pat)
-    add_classes(obj, pat)
-    add_ipcr(obj, pat)
-    add_citations(obj, pat)
-    add_claims(obj, pat)
+def add_all_fields(obj, pat, tables=None):
+    for table, add in [('rawassignee', add_asg), ('rawinventor', add_inv), ('rawlawyer', add_law),
+                       ('usreldoc', add_usreldoc), ('uspc', add_classes), ('ipcr', add_ipcr),
+                       ('claim', add_claims)]:
+        if tables is None or table in tables:
+            add(obj, pat)
+    add_citations(obj, pat, tables)
 
 
 def add_asg(obj, pat):
@@ -300,8 +302,12 @@ def add_ipcr(obj, pat):
         pat.ipcrs.append(ipc)
 
 
-def add_citations(obj, pat):
+def add_citations(obj, pat, tables=None):
     cits, refs = obj.citation_list
+    if tables is not None:
+        cits = [cit for cit in cits if _citation_table(cit) in tables]
+        if 'otherreference' not in tables:
+            refs = []
     for cit in cits:
         if cit['country'] == 'US':
             # granted patent doc number
@@ -326,6 +332,16 @@ def add_citations(obj, pat):
         ref = schema.OtherReference(**ref)
         pat.otherreferences.append(ref)
 
+def _citation_table(cit):
+    """
+    Returns the name of the table add_citations puts the citation [cit] in
+    """
+    if cit['country'] == 'US':
+        if re.match(r'^[A-Z]*\d+$', cit['number']):
+            return 'uspatentcitation'
+        return 'usapplicationcitation'
+    return 'foreigncitation'
+
 def add_claims(obj, pat):
     claims = obj.claims
     for claim in claims:
@@ -337,14 +353,19 @@ def add_claims(obj, pat):
 def commit():
     try:
         grantsession.commit()
+        return True
     except Exception, e:
         grantsession.rollback()
         print str(e)
+        return False
 
-def add_application(obj, override=True, temp=False):
+def add_application(obj, override=True, temp=False, tables=None):
     """
     PatentApplication Object converting to tables via SQLAlchemy
     Necessary to convert dates to datetime because of SQLite (OK on MySQL)
+    If [tables] is given (see lib/alchemy/rows.py:projection), only those
+    tables are filled in. The application replaced by [obj] loses its rows
+    in the other tables too
 
     Case Sensitivity and Table Reflection
     MySQL has inconsistent support for case-sensitive identifier names,
@@ -373,16 +394,16 @@ def add_application(obj, override=True, temp=False):
 
     app = schema.App_Application(**obj.app)
     # lots of abstracts seem to be missing. why?
-    add_all_app_fields(obj, app)
+    add_all_app_fields(obj, app, tables)
 
     appsession.merge(app)
 
 
-def add_all_app_fields(obj, app):
-    add_app_asg(obj, app)
-    add_app_inv(obj, app)
-    add_app_classes(obj, app)
-    add_app_claims(obj, app)
+def add_all_app_fields(obj, app, tables=None):
+    for table, add in [('rawassignee', add_app_asg), ('rawinventor', add_app_inv),
+                       ('uspc', add_app_classes), ('claim', add_app_claims)]:
+        if tables is None or table in tables:
+            add(obj, app)
 
 
 def add_app_asg(obj, app):
@@ -437,9 +458,215 @@ def add_app_claims(obj, app):
 def commit_application():
     try:
         appsession.commit()
+        return True
     except Exception, e:
         appsession.rollback()
         print str(e)
+        return False
+
+
+def batch_writer(dbtype='grant', tables=None):
+    """
+    Returns a lib.alchemy.upsert.BatchWriter for [dbtype] that writes
+    [tables] (all of them if None), whose batches are written by write_batch
+    """
+    return upsert.BatchWriter(dbtype, is_mysql(), tables)
+
+
+def write_batch(writer, dbtype='grant'):
+    """
+    Writes the batch of the BatchWriter [writer] to the grant or application
+    database. The changes are committed by commit() or commit_application()
+    """
+    writer.flush(grantsession if dbtype == 'grant' else appsession)
+
+
+def upsert_grants(objs):
+    """
+    Writes the grant patent objects [objs] in one batch, replacing the
+    patents already in the database (see write_batch). Like add_grant, the
+    changes are committed by commit()
+    """
+    writer = batch_writer('grant')
+    for obj in objs:
+        writer.add(obj)
+    write_batch(writer, 'grant')
+
+
+def upsert_applications(objs):
+    """
+    Writes the application patent objects [objs] in one batch, replacing
+    the applications already in the database (see write_batch). Like
+    add_application, the changes are committed by commit_application()
+    """
+    writer = batch_writer('application')
+    for obj in objs:
+        writer.add(obj)
+    write_batch(writer, 'application')
+
+
+def get_parse_state(filename, dbtype='grant', session=None):
+    """
+    Returns the parse_manifest row of the input file [filename] (a base name)
+    as a dictionary, or None if it has not been parsed into the database, or
+    into that of [session] if given
+    """
+    default, table = _manifest(dbtype)
+    session = session or default
+    row = session.execute(table.select().where(table.c.filename == filename)).first()
+    return dict(row) if row else None
+
+
+def set_parse_state(state, dbtype='grant'):
+    """
+    Records [state] (see get_parse_state) as the progress through its input
+    file. It is written in the current transaction, so that it is committed
+    together with the documents it accounts for
+    """
+    session, table = _manifest(dbtype)
+    session.execute(table.delete().where(table.c.filename == state['filename']))
+    session.execute(table.insert(), [state])
+
+
+def _manifest(dbtype):
+    if dbtype == 'grant':
+        return grantsession, schema.parse_manifest
+    return appsession, schema.app_parse_manifest
+
+
+def get_fingerprints(numbers, dbtype='grant', session=None):
+    """
+    Returns the fingerprints recorded in the document_fingerprint table, of
+    the database of [session] if given, for the document [numbers] (see
+    lib/fingerprint.py) as a dictionary of number -> (hash, handler
+    version). Numbers without a fingerprint are left out
+    """
+    default, table = _fingerprints(dbtype)
+    session = session or default
+    fingerprints = {}
+    for i in range(0, len(numbers), 500):
+        query = select([table.c.number, table.c.hash, table.c.handler])\
+            .where(table.c.number.in_(numbers[i:i+500]))
+        for number, digest, handler in session.execute(query).fetchall():
+            fingerprints[number] = (digest, handler)
+    return fingerprints
+
+
+def set_fingerprints(rows, dbtype='grant'):
+    """
+    Records the fingerprint [rows] (dictionaries with the number, hash,
+    handler version and filename of a document), replacing those of the same
+    numbers. Like set_parse_state, they are written in the current
+    transaction
+    """
+    # a number given twice keeps its last fingerprint
+    rows = dict((row['number'], row) for row in rows).values()
+    if not rows:
+        return
+    session, table = _fingerprints(dbtype)
+    numbers = [row['number'] for row in rows]
+    for i in range(0, len(numbers), 500):
+        session.execute(table.delete().where(table.c.number.in_(numbers[i:i+500])))
+    session.execute(table.insert(), rows)
+
+
+def _fingerprints(dbtype):
+    if dbtype == 'grant':
+        return grantsession, schema.document_fingerprint
+    return appsession, schema.app_document_fingerprint
+
+
+def shard_session(filename, dbtype='grant'):
+    """
+    Returns a session on a private SQLite database at [filename] with the
+    grant or application schema created. Used by the parallel parse so that
+    each worker process writes to its own file instead of the shared database
+    """
+    engine = create_engine('sqlite:///{0}'.format(filename))
+    if dbtype == 'grant':
+        schema.GrantBase.metadata.create_all(engine)
+    else:
+        schema.ApplicationBase.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, _enable_transaction_accounting=False)
+    return Session()
+
+
+def bind_shard(filename, dbtype='grant'):
+    """
+    Points add_grant/add_application (and their commits) for the current
+    process at the shard database [filename]. Only meant to be called from
+    inside a worker process
+    """
+    global grantsession, appsession
+    if dbtype == 'grant':
+        grantsession = shard_session(filename, dbtype)
+    else:
+        appsession = shard_session(filename, dbtype)
+
+
+def reconnect(dbtype='grant'):
+    """
+    Points the grant or application session of the current process at a new
+    connection to the same database. Only meant to be called from inside a
+    worker process, which cannot use the connections of its parent
+    """
+    global grantsession, appsession
+    session = grantsession if dbtype == 'grant' else appsession
+    Session = sessionmaker(bind=create_engine(session.bind.url), _enable_transaction_accounting=False)
+    if dbtype == 'grant':
+        grantsession = Session()
+    else:
+        appsession = Session()
+
+
+def merge_shard(filename, dbtype='grant', chunksize=10000):
+    """
+    Folds the shard database [filename] into the configured grant or
+    application database. Patents (applications) already present in the
+    database are replaced, mirroring the override behavior of add_grant.
+    The shared dimension rows (rawlocation, mainclass, subclass) are inserted
+    with INSERT IGNORE semantics so that they are deduplicated across shards.
+    Shards should be merged in the same order as their input files.
+    """
+    if dbtype == 'grant':
+        target, metadata = grantsession, schema.GrantBase.metadata
+        root, foreign_key = schema.Patent.__table__, 'patent_id'
+    else:
+        target, metadata = appsession, schema.ApplicationBase.metadata
+        root, foreign_key = schema.App_Application.__table__, 'application_id'
+    ignore_prefix = ("IGNORE",) if is_mysql() else ("OR IGNORE",)
+    shard = create_engine('sqlite:///{0}'.format(filename))
+
+    # remove the records that this shard replaces, children first
+    ids = [row[0] for row in shard.execute(select([root.c.id]))]
+    for table in reversed(metadata.sorted_tables):
+        column = root.c.id if table is root else table.c.get(foreign_key)
+        if column is None:
+            continue
+        for i in range(0, len(ids), 500):
+            target.execute(table.delete().where(column.in_(ids[i:i+500])))
+
+    # the shard's parse_manifest rows supersede those of the same files
+    manifest = _manifest(dbtype)[1]
+    filenames = [row[0] for row in shard.execute(select([manifest.c.filename]))]
+    for i in range(0, len(filenames), 500):
+        target.execute(manifest.delete().where(manifest.c.filename.in_(filenames[i:i+500])))
+
+    # as are the fingerprints of the documents it parsed
+    fingerprints = _fingerprints(dbtype)[1]
+    numbers = [row[0] for row in shard.execute(select([fingerprints.c.number]))]
+    for i in range(0, len(numbers), 500):
+        target.execute(fingerprints.delete().where(fingerprints.c.number.in_(numbers[i:i+500])))
+
+    # copy over the rows in foreign key order
+    for table in metadata.sorted_tables:
+        result = shard.execute(table.select())
+        rows = result.fetchmany(chunksize)
+        while rows:
+            target.execute(table.insert(prefixes=ignore_prefix), [dict(row) for row in rows])
+            rows = result.fetchmany(chunksize)
+    target.commit()
+    shard.dispose()
 
 grantsession = fetch_session(dbtype='grant')
 appsession = fetch_session(dbtype='application')
@@ -0,0 +1,220 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Table rows of the patent objects built by the handlers, without going
+through the ORM. The rows are the ones add_grant and add_application
+would have the session insert: the same tables and values, with the
+foreign keys filled in. Each row is a (table name, dictionary) pair whose
+dictionary can hold keys that are not columns of the table, which are
+ignored as they are by the schema's constructors.
+
+Unlike the random ids given by add_grant and add_application, the ids of
+the rows are derived from their contents, the patent they belong to and
+their position in it, so parsing the same document twice gives the same
+rows (see lib/alchemy/upsert.py). The ids of raw locations depend on their
+contents alone, so there is one row per distinct location rather than one
+per assignee or inventor.
+
+A projection (see projection) restricts the rows to some of the tables,
+for the runs that only need part of the data.
+"""
+import re
+import hashlib
+
+# the tables filled from each attribute of the patent objects
+attribute_tables = {
+    'assignee_list': ('rawassignee', 'rawlocation'),
+    'inventor_list': ('rawinventor', 'rawlocation'),
+    'lawyer_list': ('rawlawyer',),
+    'us_relation_list': ('usreldoc',),
+    'us_classifications': ('uspc', 'mainclass', 'subclass'),
+    'ipcr_classifications': ('ipcr',),
+    'citation_list': ('uspatentcitation', 'usapplicationcitation', 'foreigncitation',
+                      'otherreference'),
+    'claims': ('claim',),
+}
+# the attributes that identify a document and the tables of its own row,
+# which every projection keeps
+key_attributes = {'grant': ('pat', 'app', 'patent'), 'application': ('app', 'application')}
+key_tables = {'grant': ('patent', 'application'), 'application': ('application',)}
+# shared tables, which are written along with the tables that refer to them
+referring_tables = {'rawlocation': ('rawassignee', 'rawinventor'),
+                    'mainclass': ('uspc',), 'subclass': ('uspc',)}
+
+
+def fixid(x, key, source, position):
+    """
+    Returns a copy of the row [x] with its id or uuid derived from its
+    contents, the id [key] of its patent, the [source] it came from (e.g. the
+    table name) and its [position] among the rows of that source. The id is
+    an MD5 digest formatted like a uuid
+    """
+    x = dict(x)
+    field = 'id' if 'id' in x else 'uuid' if 'uuid' in x else None
+    if field:
+        content = sorted(item for item in x.iteritems() if item[0] != field)
+        digest = hashlib.md5(repr((key, source, position, content))).hexdigest()
+        x[field] = '-'.join((digest[:8], digest[8:12], digest[12:16], digest[16:20], digest[20:]))
+    return x
+
+
+def _entity_rows(entities, table, foreign_key, key):
+    rows = []
+    for i, (entity, loc) in enumerate(entities):
+        # shared by all the entities at exactly the same location
+        loc = fixid(loc, None, 'rawlocation', None)
+        entity = dict(entity, rawlocation_id=loc['id'])
+        entity[foreign_key] = key
+        rows.append(('rawlocation', loc))
+        rows.append((table, fixid(entity, key, table, i)))
+    return rows
+
+
+def _class_rows(classes, foreign_key, key):
+    rows = []
+    for i, (uspc, mc, sc) in enumerate(classes):
+        uspc = dict(uspc, mainclass_id=mc['id'], subclass_id=sc['id'])
+        uspc[foreign_key] = key
+        rows.append(('mainclass', dict(mc)))
+        rows.append(('subclass', dict(sc)))
+        rows.append(('uspc', fixid(uspc, key, 'uspc', i)))
+    return rows
+
+
+def _claim_rows(claims, foreign_key, key):
+    rows = []
+    for i, claim in enumerate(claims):
+        claim = dict(claim)
+        claim[foreign_key] = key
+        rows.append(('claim', fixid(claim, key, 'claim', i)))
+    return rows
+
+
+def grant_rows(obj):
+    """
+    Returns the rows of the grant patent object [obj] as add_grant
+    inserts them, or an empty list for the documents add_grant skips
+    """
+    if len(obj.pat["number"]) < 3:
+        return []
+    key = obj.pat['id']
+    application = dict(obj.app, patent_id=key)
+    rows = [('patent', dict(obj.pat)), ('application', application)]
+    rows.extend(_entity_rows(obj.assignee_list, 'rawassignee', 'patent_id', key))
+    rows.extend(_entity_rows(obj.inventor_list, 'rawinventor', 'patent_id', key))
+    for i, law in enumerate(obj.lawyer_list):
+        rows.append(('rawlawyer', fixid(dict(law, patent_id=key), key, 'rawlawyer', i)))
+    for i, usr in enumerate(obj.us_relation_list):
+        usr = dict(usr, rel_id=usr['number'], patent_id=key)
+        rows.append(('usreldoc', fixid(usr, key, 'usreldoc', i)))
+    rows.extend(_class_rows(obj.us_classifications, 'patent_id', key))
+    for i, ipc in enumerate(obj.ipcr_classifications):
+        rows.append(('ipcr', fixid(dict(ipc, patent_id=key), key, 'ipcr', i)))
+    cits, refs = obj.citation_list
+    for i, cit in enumerate(cits):
+        cit = dict(cit, patent_id=key)
+        if cit['country'] == 'US':
+            # granted patent doc number
+            if re.match(r'^[A-Z]*\d+$', cit['number']):
+                cit['citation_id'] = cit['number']
+                rows.append(('uspatentcitation', fixid(cit, key, 'citation', i)))
+            # if not above, it's probably an application
+            else:
+                cit['application_id'] = cit['number']
+                rows.append(('usapplicationcitation', fixid(cit, key, 'citation', i)))
+        # if not US, then foreign citation
+        else:
+            rows.append(('foreigncitation', fixid(cit, key, 'citation', i)))
+    for i, ref in enumerate(refs):
+        rows.append(('otherreference', fixid(dict(ref, patent_id=key), key, 'otherreference', i)))
+    rows.extend(_claim_rows(obj.claims, 'patent_id', key))
+    return rows
+
+
+def application_rows(obj):
+    """
+    Returns the rows of the application patent object [obj] as
+    add_application inserts them, or an empty list for the documents
+    add_application skips
+    """
+    if len(obj.app["number"]) < 3:
+        return []
+    key = obj.app['id']
+    rows = [('application', dict(obj.app))]
+    rows.extend(_entity_rows(obj.assignee_list, 'rawassignee', 'application_id', key))
+    rows.extend(_entity_rows(obj.inventor_list, 'rawinventor', 'application_id', key))
+    rows.extend(_class_rows(obj.us_classifications, 'application_id', key))
+    rows.extend(_claim_rows(obj.claims, 'application_id', key))
+    return rows
+
+
+def patobj_rows(obj, doctype='grant', tables=None):
+    """
+    Returns the rows of the patent object [obj] of [doctype], only those of
+    [tables] if it is given (see projection)
+    """
+    if doctype == 'grant':
+        rows = grant_rows(obj)
+    else:
+        rows = application_rows(obj)
+    if tables is not None:
+        rows = [(table, row) for table, row in rows if table in tables]
+    return rows
+
+
+def projection(attributes=None, tables=None, doctype='grant'):
+    """
+    Returns the sets of patent object attributes to compute and of tables to
+    write for the [attributes] and [tables] named in the configuration
+    (lists of names, None for all of them), or (None, None) if neither is
+    given. An attribute is only computed if it fills one of the tables, and
+    a table only written if one of the attributes fills it. The key
+    attributes and tables of [doctype] are always kept, and the locations
+    and classes are written whenever a table that refers to them is.
+    Raises ValueError for unknown names
+    """
+    if attributes is None and tables is None:
+        return None, None
+    known = set(attribute_tables).union(*key_attributes.values())
+    unknown = set(attributes or ()) - known
+    if unknown:
+        raise ValueError('Unknown attributes {0}'.format(', '.join(sorted(unknown))))
+    known = set(key_tables[doctype]).union(*attribute_tables.values())
+    unknown = set(tables or ()) - known
+    if unknown:
+        raise ValueError('Unknown tables {0}'.format(', '.join(sorted(unknown))))
+    attributes = set(attribute_tables if attributes is None else attributes)
+    tables = known if tables is None else set(tables)
+    attributes = set(attr for attr in attributes
+                     if attr in attribute_tables and tables.intersection(attribute_tables[attr]))
+    tables = set(table for table in tables
+                 if any(table in attribute_tables[attr] for attr in attributes))
+    for table, referring in referring_tables.iteritems():
+        if tables.intersection(referring):
+            tables.add(table)
+    attributes.update(key_attributes[doctype])
+    tables.update(key_tables[doctype])
+    return frozenset(attributes), frozenset(tables)
@@ -30,7 +30,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 Contains schemas for the database
 """
 from sqlalchemy import func
-from sqlalchemy import Column, Date, Integer, Float, Boolean, VARCHAR
+from sqlalchemy import Column, Date, Integer, BigInteger, Float, Boolean, VARCHAR
 from sqlalchemy import ForeignKey, Index
 from sqlalchemy import Unicode, UnicodeText
 from sqlalchemy.orm import deferred, relationship
@@ -61,6 +61,35 @@ ApplicationBase.__init__ = init
 temporary_update = Table('temporary_update', grantmetadata, Column('pk', VARCHAR(length=36), primary_key=True), Column('update', VARCHAR(length=36), index=True))
 app_temporary_update = Table('temporary_update', appmetadata, Column('pk', VARCHAR(length=36), primary_key=True), Column('update', VARCHAR(length=36), index=True))
 
+# progress of parse.py through each input file, so interrupted parses resume
+# where they left off (see parse.get_resume_point)
+def manifest_table(metadata):
+    return Table('parse_manifest', metadata,
+                 Column('filename', Unicode(255), primary_key=True),
+                 Column('size', BigInteger),
+                 Column('mtime', Integer),
+                 Column('hash', VARCHAR(length=32)),
+                 Column('handler', Unicode(128)),
+                 Column('projection', UnicodeText),
+                 Column('documents', Integer),
+                 Column('offset', BigInteger),
+                 Column('complete', Boolean))
+parse_manifest = manifest_table(grantmetadata)
+app_parse_manifest = manifest_table(appmetadata)
+
+# fingerprint of the last parsed copy of each document and the version of
+# the handler that parsed it, so that documents republished unchanged in
+# later files are not parsed again (see lib/fingerprint.py and
+# parse._screen)
+def fingerprint_table(metadata):
+    return Table('document_fingerprint', metadata,
+                 Column('number', Unicode(20), primary_key=True),
+                 Column('hash', VARCHAR(length=32)),
+                 Column('handler', Unicode(128)),
+                 Column('filename', Unicode(255)))
+document_fingerprint = fingerprint_table(grantmetadata)
+app_document_fingerprint = fingerprint_table(appmetadata)
+
 # ASSOCIATION ----------------------
 
 patentassignee = Table(
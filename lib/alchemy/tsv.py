@@ -0,0 +1,240 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Bulk export of parsed patent objects to tab separated files, one per table,
+and the matching loader. The files have the columns of each table in the
+order of lib/alchemy/schema.py and use the escaping that LOAD DATA expects
+with the options of starcluster/load.sql (fields terminated by tab, \\N for
+NULL and backslash escapes), so a backfill can skip the database entirely
+while parsing and bulk load the files afterwards.
+"""
+import os
+import re
+import datetime
+from collections import defaultdict
+
+import schema
+from rows import patobj_rows
+
+# tables loaded with IGNORE, as in starcluster/load.sql
+ignore_tables = ('mainclass', 'subclass', 'rawlocation')
+# locations and classes are shared by many documents, so their rows are
+# written only once
+shared_tables = ('mainclass', 'subclass', 'rawlocation')
+suffix = '.txt'
+
+_escapes = [('\\', '\\\\'), ('\0', '\\0'), ('\b', '\\b'), ('\n', '\\n'),
+            ('\r', '\\r'), ('\t', '\\t'), ('\x1a', '\\Z'), ('"', '\\"')]
+_unescapes = dict((escaped[1], char) for char, escaped in _escapes)
+_escape_seq = re.compile(r'\\(.)')
+
+
+def escape(value):
+    """
+    Returns [value] as a field of a tab separated file: UTF-8 encoded, with
+    the characters that LOAD DATA treats specially escaped by a backslash
+    and \\N for None. Dates are written as YYYY-MM-DD and booleans as 1/0
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return '{0:04d}-{1:02d}-{2:02d}'.format(value.year, value.month, value.day)
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    else:
+        value = str(value)
+    for char, escaped in _escapes:
+        if char in value:
+            value = value.replace(char, escaped)
+    return value
+
+
+def unescape(field):
+    """
+    Inverse of escape: returns the unicode value of [field], or None
+    """
+    if field == '\\N':
+        return None
+    if '\\' in field:
+        field = _escape_seq.sub(lambda match: _unescapes.get(match.group(1), match.group(1)), field)
+    return field.decode('utf-8')
+
+
+def get_metadata(doctype='grant'):
+    if doctype == 'grant':
+        return schema.GrantBase.metadata
+    return schema.ApplicationBase.metadata
+
+
+class TSVWriter(object):
+    """
+    Writes the rows of the patent objects passed to add into
+    [directory]/<table>.txt for the tables of [doctype]. As with
+    add_grant/add_application, a document that was already added is
+    replaced by the later copy: the rows of the earlier copy are dropped
+    from the files by close, except for the locations and classes, which
+    are shared between documents. If [tables] is given (see
+    lib/alchemy/rows.py:projection), only those tables are written
+    """
+
+    def __init__(self, directory, doctype='grant', tables=None):
+        self.directory = directory
+        self.doctype = doctype
+        self.projection = tables
+        self.tables = get_metadata(doctype).tables
+        if doctype == 'grant':
+            self.root, self.foreign_key = 'patent', 'patent_id'
+        else:
+            self.root, self.foreign_key = 'application', 'application_id'
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.files = {}
+        self.counts = defaultdict(int)
+        # id of the root row of each document number added so far
+        self.documents = {}
+        # root id -> row counts when the document was replaced
+        self.replaced = {}
+        self.shared = set()
+
+    def filename(self, table):
+        return os.path.join(self.directory, table + suffix)
+
+    def add(self, obj):
+        """
+        Writes the rows of the patent object [obj]
+        """
+        number = obj.patent if self.doctype == 'grant' else obj.application
+        if number in self.documents:
+            self.replaced[self.documents.pop(number)] = dict(self.counts)
+        rows = patobj_rows(obj, self.doctype, self.projection)
+        if not rows:
+            return
+        self.documents[number] = rows[0][1]['id']
+        for table, row in rows:
+            self.write(table, row)
+
+    def write(self, table, row):
+        """
+        Appends [row] (a dictionary) to the file of [table]
+        """
+        if table in shared_tables:
+            if (table, row['id']) in self.shared:
+                return
+            self.shared.add((table, row['id']))
+        if table not in self.files:
+            self.files[table] = open(self.filename(table), 'wb')
+        columns = self.tables[table].columns
+        self.files[table].write('\t'.join(escape(row.get(column.name)) for column in columns) + '\n')
+        self.counts[table] += 1
+
+    def close(self):
+        """
+        Closes the files, removing the rows of replaced documents
+        """
+        for f in self.files.itervalues():
+            f.close()
+        if self.replaced:
+            for table in self.files:
+                self._drop_replaced(table)
+        return dict(self.counts)
+
+    def _drop_replaced(self, table):
+        if table == self.root:
+            key = 'id'
+        elif self.foreign_key in self.tables[table].columns:
+            key = self.foreign_key
+        else:
+            return
+        column = [c.name for c in self.tables[table].columns].index(key)
+        filename = self.filename(table)
+        with open(filename, 'rb') as old, open(filename + '.tmp', 'wb') as new:
+            for i, line in enumerate(old):
+                value = unescape(line.rstrip('\n').split('\t')[column])
+                if value in self.replaced and i < self.replaced[value].get(table, 0):
+                    self.counts[table] -= 1
+                    continue
+                new.write(line)
+        os.rename(filename + '.tmp', filename)
+
+
+def read_tsv(filename):
+    """
+    Yields the rows of the tab separated file [filename] as lists of
+    unescaped values
+    """
+    with open(filename, 'rb') as f:
+        for line in f:
+            yield [unescape(field) for field in line.rstrip('\n').split('\t')]
+
+
+def load_tsv(directory, session, doctype='grant', chunksize=10000):
+    """
+    Loads the files in [directory] written by TSVWriter into the tables of
+    [doctype] through [session], in foreign key order. MySQL loads each file
+    with LOAD DATA LOCAL INFILE as starcluster/load.sql does (the connection
+    needs local_infile enabled); other databases (SQLite) get the rows
+    inserted in bulk through the DB-API cursor. Returns a dictionary of the
+    number of rows in each file
+    """
+    mysql = session.bind.dialect.name == 'mysql'
+    counts = {}
+    if mysql:
+        session.execute('SET FOREIGN_KEY_CHECKS = 0; SET UNIQUE_CHECKS = 0;')
+    connection = session.connection().connection
+    for table in get_metadata(doctype).sorted_tables:
+        filename = os.path.join(directory, table.name + suffix)
+        if not os.path.exists(filename):
+            continue
+        columns = [column.name for column in table.columns]
+        ignore = table.name in ignore_tables
+        if mysql:
+            session.execute("LOAD DATA LOCAL INFILE '{0}' {1} INTO TABLE {2} "
+                            "CHARACTER SET utf8 FIELDS TERMINATED BY '\\t' ENCLOSED BY '\"' ({3})"\
+                            .format(os.path.abspath(filename), 'IGNORE' if ignore else '',
+                                    table.name, ', '.join('`{0}`'.format(c) for c in columns)))
+            with open(filename, 'rb') as f:
+                counts[table.name] = sum(1 for line in f)
+            continue
+        statement = 'INSERT {0} INTO {1} ({2}) VALUES ({3})'.format(
+            'OR IGNORE' if ignore else '', table.name,
+            ', '.join('"{0}"'.format(c) for c in columns), ', '.join('?' for c in columns))
+        cursor = connection.cursor()
+        counts[table.name] = 0
+        rows = []
+        for row in read_tsv(filename):
+            rows.append(row)
+            if len(rows) == chunksize:
+                cursor.executemany(statement, rows)
+                counts[table.name] += len(rows)
+                rows = []
+        cursor.executemany(statement, rows)
+        counts[table.name] += len(rows)
+    session.commit()
+    if mysql:
+        session.execute('SET FOREIGN_KEY_CHECKS = 1; SET UNIQUE_CHECKS = 1;')
+    return counts
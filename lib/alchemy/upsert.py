@@ -0,0 +1,252 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Writes batches of parsed patents to the database with set-based Core
+statements instead of the per-patent exists/delete/merge of add_grant and
+add_application.
+
+The rows of a batch come from lib/alchemy/rows.py, whose ids are derived
+from the rows' contents, so a row that is already in the database is
+recognised by its id alone. Locations and classes are keyed by their
+contents and shared between patents. For each table, one query per batch finds the
+rows the batch's patents already have; the rows that are no longer part of
+their patent are deleted, the new ones are inserted with one executemany,
+and the rest are left alone. Reloading documents that have not changed
+therefore only costs the queries.
+
+While a batch is collected, each row is kept as a tuple of the values of
+its table's columns (see BatchWriter.record), and the strings of the
+columns with few distinct values (see interned_columns) are shared between
+all the rows of a run, so that a batch of thousands of documents takes as
+little memory as possible.
+"""
+from collections import defaultdict
+from itertools import izip
+from sqlalchemy.sql import select, bindparam
+
+import schema
+from rows import patobj_rows
+
+# tables shared between patents, whose rows are inserted once and never
+# deleted
+shared_tables = ('rawlocation', 'mainclass', 'subclass')
+# tables keyed by the patent or application number rather than a derived
+# id, whose existing rows are updated in place
+natural_tables = {'grant': ('patent', 'application'), 'application': ('application',)}
+chunksize = 500
+# columns whose values repeat across the rows of a run: country, kind and
+# category codes, document and role types, states, classes
+interned_columns = frozenset([
+    'type', 'country', 'kind', 'category', 'state', 'doctype', 'status', 'relationship',
+    'residence', 'nationality', 'dependent', 'mainclass_id', 'subclass_id',
+    'classification_level', 'section', 'subclass', 'symbol_position', 'classification_value',
+    'classification_status', 'classification_data_source'])
+
+
+def get_metadata(doctype='grant'):
+    """
+    Returns the metadata, root table and foreign key column name of [doctype]
+    """
+    if doctype == 'grant':
+        return schema.GrantBase.metadata, schema.Patent.__table__, 'patent_id'
+    return schema.ApplicationBase.metadata, schema.App_Application.__table__, 'application_id'
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), chunksize):
+        yield values[i:i+chunksize]
+
+
+def _key_index(table):
+    """
+    Returns the position of the primary key of [table] in its records
+    """
+    key = table.primary_key.columns.values()[0]
+    return [column.name for column in table.columns].index(key.name)
+
+
+def _insert(session, table, rows, prefixes):
+    columns = [column.name for column in table.columns]
+    for chunk in _chunks(rows):
+        session.execute(table.insert(prefixes=prefixes),
+                        [dict(izip(columns, row)) for row in chunk])
+
+
+def _update(session, table, rows):
+    key = table.primary_key.columns.values()[0]
+    index = _key_index(table)
+    columns = [column.name for column in table.columns]
+    statement = table.update().where(key == bindparam('_key')) \
+                     .values(dict((column.name, bindparam(column.name, type_=column.type))
+                                  for column in table.columns))
+    params = []
+    for row in rows:
+        params.append(dict(izip(columns, row)))
+        params[-1]['_key'] = row[index]
+    if params:
+        session.execute(statement, params)
+
+
+class BatchWriter(object):
+    """
+    Collects the rows of the patent objects passed to add, grouped by table
+    at flush, and writes them to the database in one batch per flush. Where
+    a patent is added more than once, its last copy wins.
+
+    Locations and classes (see shared_tables) recur across thousands of
+    documents. The keys of the ones written by this writer are kept, so that
+    each is sent to the database once per run rather than once per document.
+
+    If [tables] is given (see lib/alchemy/rows.py:projection), only those
+    tables are written, and the rows the patents have in the others are
+    left as they are
+    """
+
+    def __init__(self, doctype='grant', is_mysql=False, tables=None):
+        self.doctype = doctype
+        self.is_mysql = is_mysql
+        self.tables = tables
+        self.documents = {}
+        self.written = dict((table, set()) for table in shared_tables)
+        metadata = get_metadata(doctype)[0]
+        # table name -> (column names, which of them are interned)
+        self.columns = dict((table.name, ([column.name for column in table.columns],
+                                          [column.name in interned_columns for column in table.columns]))
+                            for table in metadata.sorted_tables)
+        # the strings of the interned columns seen by this writer
+        self.strings = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, obj):
+        """
+        Adds the rows of the patent object [obj] to the batch
+        """
+        rows = patobj_rows(obj, self.doctype, self.tables)
+        if rows:
+            self.documents[rows[0][1]['id']] = [(table, self.record(table, row)) for table, row in rows]
+
+    def record(self, table, row):
+        """
+        Returns the values of the columns of [table] in the dictionary [row]
+        as a tuple in column order, with the strings of the interned columns
+        replaced by the first copy this writer has seen
+        """
+        columns, interned = self.columns[table]
+        strings = self.strings
+        values = []
+        for column, intern in izip(columns, interned):
+            value = row.get(column)
+            if intern and isinstance(value, basestring):
+                value = strings.setdefault(value, value)
+            values.append(value)
+        return tuple(values)
+
+    def flush(self, session):
+        """
+        Writes the batch through [session], replacing the patents that are
+        already in the database, and starts a new batch. The statements are
+        executed in the current transaction, which is left to the caller to
+        commit
+        """
+        tables = defaultdict(list)
+        for rows in self.documents.itervalues():
+            for table, row in rows:
+                written = self.written.get(table)
+                if written is not None:
+                    # the id comes first in the shared tables
+                    if row[0] in written:
+                        continue
+                    written.add(row[0])
+                tables[table].append(row)
+        keys = self.documents.keys()
+        self.documents = {}
+        if keys:
+            write(session, keys, tables, self.doctype, self.is_mysql, self.tables)
+
+    def reset(self):
+        """
+        Forgets the shared rows written so far, for when the transaction
+        that wrote them was rolled back
+        """
+        for written in self.written.itervalues():
+            written.clear()
+
+
+def write(session, keys, rows, doctype='grant', is_mysql=False, tables=None):
+    """
+    Writes [rows], a dictionary of table name -> list of rows (tuples of
+    column values, see BatchWriter.record), of the patents or applications
+    with the ids [keys] through [session]. Rows
+    already owned by those patents are deleted if they are not among [rows]
+    and left alone otherwise, except for the patent and application rows,
+    which are updated. The association tables filled in by the
+    disambiguation are not touched, nor are the tables left out of
+    [tables] if it is given
+    """
+    metadata, root, foreign_key = get_metadata(doctype)
+    ignore_prefix = ("IGNORE",) if is_mysql else ("OR IGNORE",)
+
+    # the ids of each table's rows that belong to the patents in the batch
+    existing, stale = {}, {}
+    for table in metadata.sorted_tables:
+        if table is root:
+            column = table.c.id
+        elif table.name in shared_tables or not table.primary_key.columns:
+            continue
+        elif tables is not None and table.name not in tables:
+            continue
+        elif table.c.get(foreign_key) is not None:
+            column = table.c[foreign_key]
+        else:
+            continue
+        key = table.primary_key.columns.values()[0]
+        found = set()
+        for chunk in _chunks(keys):
+            found.update(row[0] for row in session.execute(select([key]).where(column.in_(chunk))))
+        existing[table.name] = found
+        index = _key_index(table)
+        stale[table] = found.difference(row[index] for row in rows[table.name])
+
+    # remove the rows that are no longer part of their patent, children first
+    for table in reversed(metadata.sorted_tables):
+        if stale.get(table):
+            key = table.primary_key.columns.values()[0]
+            for chunk in _chunks(stale[table]):
+                session.execute(table.delete().where(key.in_(chunk)))
+
+    for table in metadata.sorted_tables:
+        if table.name in shared_tables:
+            _insert(session, table, rows[table.name], ignore_prefix)
+        elif table.name in existing:
+            index = _key_index(table)
+            found = existing[table.name]
+            new = [row for row in rows[table.name] if row[index] not in found]
+            _insert(session, table, new, ignore_prefix)
+            if table.name in natural_tables[doctype]:
+                _update(session, table, [row for row in rows[table.name] if row[index] in found])
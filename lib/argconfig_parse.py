@@ -66,6 +66,49 @@ class ArgHandler(object):
                 default='grant',
                 help='Set the type of patent document to be parsed: grant (default) \
                 or application')
+        self.parser.add_argument('--workers', '-w', type=int, nargs='?',
+                default=1,
+                help='Set the number of processes used to parse the files. With at \
+                least as many files as processes, each process parses its share of \
+                the files into a separate database which is merged at the end; \
+                otherwise the documents within each file are spread across the \
+                processes. Defaults to 1 (sequential parse)')
+        self.parser.add_argument('--patent', type=str, nargs='?',
+                default=None,
+                help='Parse only the document with this number (e.g. 8,123,456) \
+                from the files in PATENTROOT and add it to the database. The \
+                document is located through the per-file document indexes, which \
+                are built for any file that does not have one yet')
+        self.parser.add_argument('--emit', type=str, nargs='?',
+                default='db', choices=['db', 'tsv'],
+                help='Where the parsed documents go: db (default) adds them to the \
+                database; tsv writes one tab separated file per table into the \
+                --out directory instead, for loading with --load-tsv or \
+                starcluster/load.sql')
+        self.parser.add_argument('--out', type=str, nargs='?',
+                default='tsv',
+                help='Directory for the files written with --emit tsv. Defaults \
+                to "tsv"')
+        self.parser.add_argument('--load-tsv', type=str, nargs='?',
+                default=None,
+                help='Load the files written with --emit tsv in this directory into \
+                the database instead of parsing')
+        self.parser.add_argument('--reparse', action='store_true',
+                help='Check every file against the checksum recorded when it was \
+                parsed, and parse again those whose contents changed. Without this, \
+                files are only checksummed when their size or modification time \
+                changed. Either way, files parsed before are skipped and interrupted \
+                files are resumed after their last commit')
+        self.parser.add_argument('--cache', type=str, nargs='?',
+                default=None,
+                help='Directory in which the patent objects parsed from each file are \
+                cached (see lib/parse_cache.py). Overrides the cache option of \
+                lib/alchemy/config.ini')
+        self.parser.add_argument('--from-cache', action='store_true',
+                help='Load the database from the patent objects cached for the files \
+                matching XMLREGEX instead of parsing the XML, e.g. after a change to \
+                the schema. Cached files parsed by another version of the handlers \
+                are skipped')
 
         # parse arguments and assign values
         args = self.parser.parse_args(self.arglist)
@@ -73,6 +116,14 @@ class ArgHandler(object):
         self.patentroot = args.patentroot
         self.output_directory = args.output_directory
         self.document_type = args.document_type
+        self.workers = args.workers
+        self.patent = args.patent
+        self.emit = args.emit
+        self.out = args.out
+        self.load_tsv = args.load_tsv
+        self.reparse = args.reparse
+        self.cache = args.cache
+        self.from_cache = args.from_cache
         if self.xmlregex == None: # set defaults for xmlregex here depending on doctype
             if self.document_type == 'grant':
                 self.xmlregex = r"ipg\d{6}.xml"
@@ -101,6 +152,30 @@ class ArgHandler(object):
     def get_document_type(self):
         return self.document_type
 
+    def get_workers(self):
+        return self.workers
+
+    def get_patent(self):
+        return self.patent
+
+    def get_emit(self):
+        return self.emit
+
+    def get_out(self):
+        return self.out
+
+    def get_load_tsv(self):
+        return self.load_tsv
+
+    def get_reparse(self):
+        return self.reparse
+
+    def get_cache(self):
+        return self.cache
+
+    def get_from_cache(self):
+        return self.from_cache
+
     def get_help(self):
         self.parser.print_help()
         sys.exit(1)
@@ -29,7 +29,9 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 Parses the process.cfg file
 """
+import logging
 import importlib
+from bisect import bisect_right
 from ConfigParser import ConfigParser
 
 defaults = {'parse': 'defaultparse',
@@ -39,7 +41,13 @@ defaults = {'parse': 'defaultparse',
             'grantregex': 'ipg\d{6}.xml',
             'applicationregex': 'ipa\d{6}.xml',
             'years': None,
-            'downloaddir' : None}
+            'downloaddir' : None,
+            'workers': '1',
+            'downloadworkers': '4',
+            'stream': 'False',
+            'loglevel': 'WARNING',
+            'attributes': None,
+            'tables': None}
 
 def extract_process_options(handler, config_section):
     """
@@ -64,10 +72,25 @@ def extract_parse_options(handler, config_section):
     options['applicationregex'] = handler.get(config_section, 'applicationregex')
     options['years'] = handler.get(config_section,'years')
     options['downloaddir'] = handler.get(config_section,'downloaddir')
+    options['workers'] = int(handler.get(config_section,'workers'))
+    options['downloadworkers'] = int(handler.get(config_section,'downloadworkers'))
+    options['stream'] = handler.get(config_section,'stream') == 'True'
+    options['loglevel'] = getattr(logging, handler.get(config_section,'loglevel').upper())
+    options['attributes'] = get_names(handler.get(config_section,'attributes'))
+    options['tables'] = get_names(handler.get(config_section,'tables'))
     if options['years'] and options['downloaddir']:
         options['datadir'] = options['downloaddir']
     return options
 
+def get_names(namestring):
+    """
+    Splits the comma separated [namestring] into a list of names, or
+    returns None if it is not given
+    """
+    if namestring is None:
+        return None
+    return [name.strip() for name in namestring.split(',') if name.strip()]
+
 def get_config_options(configfile):
     """
     Takes in a filepath to a configuration file, returns
@@ -125,3 +148,54 @@ def get_xml_handlers(configfile, document_type='grant'):
                 importlib.sys.path.append('..')
                 xmlhandlers[year] = importlib.import_module(handler)
     return xmlhandlers
+
+
+class HandlerRegistry(object):
+    """
+    Maps the date of a weekly file to the handler module that parses it.
+    The date ranges from the [grant-xml-handlers] or
+    [application-xml-handlers] section of the configuration file are kept as
+    sorted, non-overlapping intervals and looked up with bisect; the modules
+    are imported once when the registry is built. Overlapping ranges raise a
+    ValueError, since either handler could parse the dates they share
+    """
+
+    def __init__(self, xmlhandlers):
+        """
+        [xmlhandlers] is a dictionary as returned by get_xml_handlers
+        """
+        self.default = xmlhandlers.get('default')
+        intervals = sorted((daterange[0], daterange[1], module)
+                           for daterange, module in xmlhandlers.iteritems()
+                           if daterange != 'default')
+        for prev, cur in zip(intervals, intervals[1:]):
+            if cur[0] <= prev[1]:
+                raise ValueError('Overlapping handler date ranges {0}-{1} and {2}-{3}'\
+                                 .format(prev[0], prev[1], cur[0], cur[1]))
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.modules = [interval[2] for interval in intervals]
+
+    def get(self, date):
+        """
+        Returns the handler module for [date] (an integer YYYYMMDD), or the
+        default handler if [date] falls outside every range
+        """
+        if isinstance(date, (int, long)):
+            i = bisect_right(self.starts, date) - 1
+            if i >= 0 and date <= self.ends[i]:
+                return self.modules[i]
+        return self.default
+
+
+_registries = {}
+
+def get_handler_registry(configfile, document_type='grant'):
+    """
+    Returns the HandlerRegistry for [document_type] described by
+    [configfile]. The registry is built on first use and shared afterwards
+    """
+    key = (configfile, document_type)
+    if key not in _registries:
+        _registries[key] = HandlerRegistry(get_xml_handlers(configfile, document_type))
+    return _registries[key]
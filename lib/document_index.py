@@ -0,0 +1,146 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Maintains a sidecar index for each weekly USPTO file that maps the number of
+every document in the file to its byte offset and length, along with the
+handler that parses it. This allows a single patent or application to be
+pulled out of a weekly file without scanning the whole file.
+
+The index for ipg120103.xml is stored next to it as ipg120103.idx. The first
+line records the size and modification time of the indexed file and the
+version of its handler (see parse_cache.handler_version), so indexes of a
+changed file or built before a change to the handlers are detected and
+rebuilt. The offsets of documents in a compressed
+file are offsets into its decompressed contents (see lib/splitter.py).
+"""
+
+import os
+import re
+import splitter
+import parse_cache
+from handlers.xml_util import normalize_document_identifier
+
+number_regex = re.compile(r'<doc-number>([^<]*)</doc-number>')
+suffix = '.idx'
+
+
+def index_filename(filename):
+    """
+    Returns the path of the sidecar index for [filename]
+    """
+    return os.path.splitext(filename)[0] + suffix
+
+
+def normalize_number(number):
+    """
+    Normalizes a document number as given on the command line or as found
+    in the XML, e.g. '8,123,456', 'US8123456' and '08123456' all become
+    '8123456'
+    """
+    number = re.sub(r'[\s,/]', '', number).upper()
+    if number.startswith('US'):
+        number = number[2:]
+    return normalize_document_identifier(number)
+
+
+def _stamp(filename):
+    stat = os.stat(filename)
+    return [str(stat.st_size), str(int(stat.st_mtime))]
+
+
+def build_index(filename, handler):
+    """
+    Scans [filename] and writes its sidecar index. [handler] is the handler
+    module for the documents in the file. Returns the index as a dictionary
+    of number -> (offset, length, handler name)
+    """
+    index = {}
+    lines = ['\t'.join(['#'] + _stamp(filename) + [parse_cache.handler_version(handler)]) + '\n']
+    for start, xml in splitter.file_documents(filename):
+        match = number_regex.search(xml)
+        if not match:
+            continue
+        number = normalize_number(match.group(1))
+        index[number] = (start, len(xml), handler.__name__)
+        lines.append('{0}\t{1}\t{2}\t{3}\n'.format(number, start, len(xml), handler.__name__))
+    tmpfile = index_filename(filename) + '.tmp'
+    with open(tmpfile, 'w') as f:
+        f.writelines(lines)
+    os.rename(tmpfile, index_filename(filename))
+    return index
+
+
+def load_index(filename, handler=None):
+    """
+    Returns the index of [filename] as a dictionary of
+    number -> (offset, length, handler name), or None if there is no index
+    or the file has changed since it was indexed. If the handler module
+    [handler] is given, None is also returned if the index was built by
+    another version of it
+    """
+    try:
+        with open(index_filename(filename)) as f:
+            stamp = f.readline().rstrip('\n').split('\t')
+            if stamp[1:3] != _stamp(filename):
+                return None
+            if handler is not None and stamp[3:] != [parse_cache.handler_version(handler)]:
+                return None
+            index = {}
+            for line in f:
+                number, offset, length, name = line.rstrip('\n').split('\t')
+                index[number] = (int(offset), int(length), name)
+            return index
+    except IOError:
+        return None
+
+
+def update_indexes(filelist, get_handler):
+    """
+    Builds the index of each file in [filelist] that does not have an up to
+    date one. [get_handler] is called with a filename and returns the
+    handler module for that file. Returns the number of indexes built
+    """
+    built = 0
+    for filename in filelist:
+        handler = get_handler(filename)
+        if load_index(filename, handler) is None:
+            build_index(filename, handler)
+            built += 1
+    return built
+
+
+def find_document(number, filelist):
+    """
+    Looks up document [number] in the indexes of [filelist], newest file
+    first so that a republished document resolves to its latest copy.
+    Returns (filename, offset, length, handler) or None if not found
+    """
+    number = normalize_number(number)
+    for filename in sorted(filelist, key=os.path.basename, reverse=True):
+        index = load_index(filename) or {}
+        if number in index:
+            return (filename,) + index[number]
+    return None
@@ -0,0 +1,281 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Downloads the weekly bulk files listed on the Google patent download pages.
+
+The listing of each page is cached in a JSON manifest in the download
+directory, along with the size and MD5 checksum of every file downloaded, so
+repeat runs neither re-scrape the pages nor re-fetch files they already
+have. Files are fetched by a bounded pool of threads into a .part file which
+is resumed with an HTTP Range request after an interrupted transfer, and is
+only renamed into place once its size and zip checksums have been verified.
+"""
+
+import os
+import zlib
+import json
+import time
+import hashlib
+import logging
+import zipfile
+import datetime
+import requests
+from multiprocessing.pool import ThreadPool
+from bs4 import BeautifulSoup as bs
+
+listing_urls = {'grant': 'https://www.google.com/googlebooks/uspto-patents-grants-text.html',
+                'application': 'https://www.google.com/googlebooks/uspto-patents-applications-text.html'}
+manifest_name = 'manifest.json'
+# seconds before a cached listing is scraped again for 'latest' or the current year
+max_age = 24 * 60 * 60
+timeout = 60
+retries = 3
+chunksize = 1 << 20
+
+
+def load_manifest(downloaddir):
+    """
+    Returns the manifest of [downloaddir], or an empty one if there is none
+    """
+    try:
+        with open(os.path.join(downloaddir, manifest_name)) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+    manifest.setdefault('listings', {})
+    manifest.setdefault('files', {})
+    return manifest
+
+
+def save_manifest(downloaddir, manifest):
+    """
+    Writes [manifest] to [downloaddir], replacing the previous one
+    """
+    filename = os.path.join(downloaddir, manifest_name)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(filename + '.tmp', filename)
+
+
+def parse_listing(html):
+    """
+    Given the [html] of a download page, returns its listing as a dictionary
+    with the url of the 'latest' file, the url of every file under each year
+    in 'years', and the time it was 'fetched'
+    """
+    soup = bs(html)
+    listing = {'latest': None, 'years': {}, 'fetched': time.time()}
+    for header in soup.find_all('h3'):
+        if not header.get('id'):
+            continue
+        urls = []
+        a = header.findNext()
+        while a is not None and a.name != 'h3':
+            if a.name == 'a' and a.get('href'):
+                urls.append(a['href'])
+            a = a.findNext()
+        listing['years'][header['id']] = urls
+    # the latest file is the last link under the first (most recent) year
+    if soup.h3:
+        second = soup.h3.findNext('h3')
+        a = second.findPrevious('a') if second else soup.find_all('a')[-1]
+        listing['latest'] = a['href'] if a else None
+    return listing
+
+
+def _stale(listing, years):
+    if not listing:
+        return True
+    if any(str(year) not in listing['years'] for year in years if year != 'latest'):
+        return True
+    current = ['latest', datetime.date.today().year]
+    if any(year in current for year in years):
+        return time.time() - listing['fetched'] > max_age
+    return False
+
+
+def get_download_list(years, doctype, manifest, url=None):
+    """
+    Returns the urls of the files for [years] (a list of years and/or
+    'latest', see start.get_year_list) from the [doctype] download page at
+    [url]. The page is only scraped if the listing cached in [manifest] does
+    not cover [years] or is out of date
+    """
+    listing = manifest['listings'].get(doctype)
+    if _stale(listing, years):
+        r = requests.get(url or listing_urls[doctype], timeout=timeout)
+        r.raise_for_status()
+        listing = manifest['listings'][doctype] = parse_listing(r.content)
+    urls = []
+    for year in years:
+        if year == 'latest':
+            urls.append(listing['latest'])
+        else:
+            urls.extend(listing['years'].get(str(year), []))
+    return urls
+
+
+def checksum(filename):
+    """
+    Returns the hex MD5 digest of [filename]
+    """
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def verify_zip(filename):
+    """
+    Raises zipfile.BadZipfile if [filename] is not a complete zip archive
+    whose members all match their CRCs
+    """
+    try:
+        bad = zipfile.ZipFile(filename).testzip()
+    except zlib.error, e:
+        raise zipfile.BadZipfile('{0} in {1}'.format(e, filename))
+    if bad:
+        raise zipfile.BadZipfile('bad CRC for {0} in {1}'.format(bad, filename))
+
+
+def download_file(url, path):
+    """
+    Downloads [url] to [path], resuming from [path].part if an earlier
+    transfer was interrupted. Retries failed transfers [retries] times.
+    Returns the manifest entry of the file, or None if it could not be
+    downloaded
+    """
+    part = path + '.part'
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(2 ** (attempt - 1))
+        try:
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+            r = requests.get(url, headers=headers, stream=True, timeout=timeout)
+            if r.status_code == 416:
+                # the partial file is no prefix of the current one
+                os.remove(part)
+                continue
+            r.raise_for_status()
+            if r.status_code == 206:
+                mode = 'ab'
+                size = int(r.headers['content-range'].rsplit('/', 1)[1])
+            else:
+                mode = 'wb'
+                size = r.headers.get('content-length')
+                size = int(size) if size is not None else None
+            with open(part, mode) as f:
+                for chunk in r.iter_content(chunksize):
+                    f.write(chunk)
+            if size is not None and os.path.getsize(part) != size:
+                raise IOError('incomplete download of {0}'.format(url))
+            if path.lower().endswith('.zip'):
+                try:
+                    verify_zip(part)
+                except zipfile.BadZipfile:
+                    os.remove(part)
+                    raise
+            entry = {'url': url, 'size': os.path.getsize(part), 'md5': checksum(part)}
+            os.rename(part, path)
+            return entry
+        except Exception, e:
+            logging.error('Downloading {0} (attempt {1}): {2}'.format(url, attempt + 1, e))
+    return None
+
+
+def local_path(filename, downloaddir):
+    """
+    Returns the path of the download [filename] in [downloaddir], or that of
+    the XML file extracted from it by earlier versions if there is one
+    """
+    path = os.path.join(downloaddir, filename)
+    extracted = os.path.splitext(path)[0] + '.xml'
+    return extracted if os.path.exists(extracted) else path
+
+
+def have_file(filename, downloaddir, manifest, verify=False):
+    """
+    Returns True if [filename] was downloaded completely to [downloaddir] as
+    recorded in [manifest], checking its checksum too if [verify] is True.
+    Files extracted by earlier versions (ipg120327.xml for ipg120327.zip)
+    also count as downloaded
+    """
+    path = os.path.join(downloaddir, filename)
+    if local_path(filename, downloaddir) != path:
+        return True
+    entry = manifest['files'].get(filename)
+    if not entry or not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+        return False
+    return not verify or checksum(path) == entry['md5']
+
+
+def _download(args):
+    url, path = args
+    return url, download_file(url, path)
+
+
+def download_files(urls, downloaddir, workers=4, verify=False, callback=None):
+    """
+    Downloads the files at [urls] that are not in [downloaddir] yet (see
+    have_file) with [workers] concurrent transfers, recording each in the
+    manifest of [downloaddir] as it completes. If given, [callback] is called
+    with the path of each file as soon as it is available: first those that
+    were downloaded before, then the others as their downloads complete.
+    Returns False if any file could not be downloaded, True otherwise
+    """
+    manifest = load_manifest(downloaddir)
+    tasks = []
+    for url in urls:
+        filename = url.split('/')[-1]
+        if have_file(filename, downloaddir, manifest, verify):
+            print 'already have', filename
+            if callback:
+                callback(local_path(filename, downloaddir))
+            continue
+        print 'downloading', url
+        tasks.append((url, os.path.join(downloaddir, filename)))
+    complete = True
+    if not tasks:
+        return complete
+    pool = ThreadPool(min(workers, len(tasks)))
+    try:
+        for url, entry in pool.imap_unordered(_download, tasks):
+            filename = url.split('/')[-1]
+            if entry is None:
+                print 'ERROR: downloading', filename
+                complete = False
+                continue
+            print 'downloaded', filename
+            manifest['files'][filename] = entry
+            save_manifest(downloaddir, manifest)
+            if callback:
+                callback(os.path.join(downloaddir, filename))
+    finally:
+        pool.close()
+        pool.join()
+    return complete
@@ -0,0 +1,75 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Fingerprints the documents of the weekly USPTO files, so that a document
+republished in a later file (a correction, or a reprint of the same grant)
+is only parsed again if it actually changed (see parse._screen).
+
+The fingerprint of a document is the MD5 hash of its body with runs of
+whitespace collapsed to a single space. The body is everything after the
+start tag of the root element, which leaves out the XML declaration, the
+DOCTYPE and the root attributes (the production file name and dates) that
+differ between publications of the same document. Fingerprints are keyed by
+the normalized number of the document (see document_index.normalize_number)
+and stored in the document_fingerprint table of the database.
+"""
+
+import re
+import hashlib
+import splitter
+from document_index import number_regex, normalize_number
+
+root_regex = re.compile(r'<[A-Za-z][^>]*>')
+
+
+def fingerprint(xml):
+    """
+    Returns the fingerprint of the document [xml] (a string or buffer)
+    """
+    match = root_regex.search(xml)
+    body = str(xml[match.end():] if match else xml)
+    return hashlib.md5(' '.join(body.split())).hexdigest()
+
+
+def document_fingerprint(xml):
+    """
+    Returns the (number, fingerprint) tuple of the document [xml], or None if
+    it has no document number
+    """
+    match = number_regex.search(xml)
+    if match:
+        return normalize_number(match.group(1)), fingerprint(xml)
+
+
+def file_fingerprints(filename, offset=0):
+    """
+    Returns a generator of (end offset, number, fingerprint) tuples, one for
+    each document in [filename] from [offset] on that has a document number
+    """
+    for start, xml in splitter.file_documents(filename, offset):
+        found = document_fingerprint(xml)
+        if found:
+            yield (start + len(xml),) + found
@@ -33,13 +33,10 @@ Uses the extended ContentHandler from xml_driver to extract the needed fields
 from patent grant documents
 """
 
-from cStringIO import StringIO
-from datetime import datetime
 from unidecode import unidecode
 from handler import Patobj, PatentHandler
 import re
 import uuid
-import xml.sax
 import xml_util
 import xml_driver
 
@@ -49,17 +46,7 @@ claim_num_regex = re.compile(r'^\d+\. *') # removes claim number from claim text
 class Patent(PatentHandler):
 
     def __init__(self, xml_string, is_string=False):
-        xh = xml_driver.XMLHandler()
-        parser = xml_driver.make_parser()
-
-        parser.setContentHandler(xh)
-        parser.setFeature(xml_driver.handler.feature_external_ges, False)
-        l = xml.sax.xmlreader.Locator()
-        xh.setDocumentLocator(l)
-        if is_string:
-            parser.parse(StringIO(xml_string))
-        else:
-            parser.parse(xml_string)
+        xh = xml_driver.parse_document(xml_string, is_string)
 
         self.attributes = ['app','application','assignee_list','inventor_list',
                           'us_classifications',
@@ -123,22 +110,9 @@ class Patent(PatentHandler):
     def _fix_date(self, datestring):
         """
         Converts a number representing YY/MM to a Date
+        (see xml_util.fix_date)
         """
-        if not datestring:
-            return None
-        elif datestring[:4] < "1900":
-            return None
-        # default to first of month in absence of day
-        if datestring[-4:-2] == '00':
-            datestring = datestring[:-4] + '01' + datestring[-2:]
-        if datestring[-2:] == '00':
-            datestring = datestring[:6] + '01'
-        try:
-            datestring = datetime.strptime(datestring, '%Y%m%d')
-            return datestring
-        except Exception as inst:
-            print inst, datestring
-            return None
+        return xml_util.fix_date(datestring)
 
     @property
     def assignee_list(self):
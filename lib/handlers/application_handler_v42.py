@@ -29,258 +29,66 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 """
-Uses the extended ContentHandler from xml_driver to extract the needed fields
-from patent grant documents
+Extracts the needed fields from patent application documents, as declared in the
+spec below (see extraction.py)
 """
 
-from cStringIO import StringIO
-from datetime import datetime
-from unidecode import unidecode
-from handler import Patobj, PatentHandler
-import re
-import uuid
-import xml.sax
 import xml_util
-import xml_driver
-
-claim_num_regex = re.compile(r'^\d+\. *') # removes claim number from claim text
-
-
-class Patent(PatentHandler):
-
-    def __init__(self, xml_string, is_string=False):
-        xh = xml_driver.XMLHandler()
-        parser = xml_driver.make_parser()
-
-        parser.setContentHandler(xh)
-        parser.setFeature(xml_driver.handler.feature_external_ges, False)
-        l = xml.sax.xmlreader.Locator()
-        xh.setDocumentLocator(l)
-        if is_string:
-            parser.parse(StringIO(xml_string))
-        else:
-            parser.parse(xml_string)
-
-        self.attributes = ['app','application','assignee_list','inventor_list',
-                      'us_classifications',
-                     'claims']
-
-        self.xml = xh.root.us_patent_application
-
-        self.country = self.xml.publication_reference.contents_of('country', upper=False)[0]
-        self.application = xml_util.normalize_document_identifier(self.xml.publication_reference.contents_of('doc_number')[0])
-        self.kind = self.xml.publication_reference.contents_of('kind')[0]
-        if self.xml.application_reference:
-            self.pat_type = self.xml.application_reference[0].get_attribute('appl-type', upper=False)
-        else:
-            self.pat_type = None
-        self.date_app = self.xml.publication_reference.contents_of('date')[0]
-        self.clm_num = len(self.xml.claims.claim)
-        self.abstract = self.xml.abstract.contents_of('p', '', as_string=True, upper=False)
-        self.invention_title = self._invention_title()
-
-        self.app = {
-            "id": self.application,
-            "type": self.pat_type,
-            "number": self.application,
-            "country": self.country,
-            "date": self._fix_date(self.date_app),
-            "abstract": self.abstract,
-            "title": self.invention_title,
-            "kind": self.kind,
-            "num_claims": self.clm_num
-        }
-        self.app["id"] = str(self.app["date"])[:4] + "/" + self.app["number"]
-
-    def _invention_title(self):
-        original = self.xml.contents_of('invention_title', upper=False)[0]
-        if isinstance(original, list):
-            original = ''.join(original)
-        return original
-
-    def _name_helper(self, tag_root):
-        """
-        Returns dictionary of firstname, lastname with prefix associated
-        with lastname
-        """
-        firstname = tag_root.contents_of('first_name', as_string=True, upper=False)
-        lastname = tag_root.contents_of('last_name', as_string=True, upper=False)
-        return xml_util.associate_prefix(firstname, lastname)
-
-    def _name_helper_dict(self, tag_root):
-        """
-        Returns dictionary of firstname, lastname with prefix associated
-        with lastname
-        """
-        firstname = tag_root.contents_of('first_name', as_string=True, upper=False)
-        lastname = tag_root.contents_of('last_name', as_string=True, upper=False)
-        return {'name_first': firstname, 'name_last': lastname}
-
-    def _fix_date(self, datestring):
-        """
-        Converts a number representing YY/MM to a Date
-        """
-        if not datestring:
-            return None
-        elif datestring[:4] < "1900":
-            return None
-        # default to first of month in absence of day
-        if datestring[-4:-2] == '00':
-            datestring = datestring[:-4] + '01' + datestring[-2:]
-        if datestring[-2:] == '00':
-            datestring = datestring[:6] + '01'
-        try:
-            datestring = datetime.strptime(datestring, '%Y%m%d')
-            return datestring
-        except Exception as inst:
-            print inst, datestring
-            return None
-
-    @property
-    def assignee_list(self):
-        """
-        Returns list of dictionaries:
-        assignee:
-          name_last
-          name_first
-          residence
-          nationality
-          organization
-          sequence
-        location:
-          id
-          city
-          state
-          country
-        """
-        assignees = self.xml.assignees.assignee
-        if not assignees:
-            return []
-        res = []
-        for i, assignee in enumerate(assignees):
-            # add assignee data
-            asg = {}
-            asg.update(self._name_helper_dict(assignee))  # add firstname, lastname
-            asg['organization'] = assignee.contents_of('orgname', as_string=True, upper=False)
-            asg['role'] = assignee.contents_of('role', as_string=True)
-            asg['nationality'] = assignee.nationality.contents_of('country')[0]
-            asg['residence'] = assignee.nationality.contents_of('country')[0]
-            # add location data for assignee
-            loc = {}
-            for tag in ['city', 'state', 'country']:
-                loc[tag] = assignee.contents_of(tag, as_string=True, upper=False)
-            #this is created because of MySQL foreign key case sensitivities
-            loc['id'] = unidecode(u"|".join([loc['city'], loc['state'], loc['country']]).lower())
-            if any(asg.values()) or any(loc.values()):
-                asg['sequence'] = i
-                asg['uuid'] = str(uuid.uuid1())
-                res.append([asg, loc])
-        return res
-
-    @property
-    def inventor_list(self):
-        """
-        Returns list of lists of applicant dictionary and location dictionary
-        applicant:
-          name_last
-          name_first
-          sequence
-        location:
-          id
-          city
-          state
-          country
-        """
-        applicants = self.xml.applicants.applicant
-        if not applicants:
-            return []
-        res = []
-        for i, applicant in enumerate(applicants):
-            # add applicant data
-            app = {}
-            app.update(self._name_helper_dict(applicant.addressbook))
-            app['nationality'] = applicant.nationality.contents_of('country', as_string=True)
-            # add location data for applicant
-            loc = {}
-            for tag in ['city', 'state', 'country']:
-                loc[tag] = applicant.addressbook.contents_of(tag, as_string=True, upper=False)
-            #this is created because of MySQL foreign key case sensitivities
-            loc['id'] = unidecode("|".join([loc['city'], loc['state'], loc['country']]).lower())
-            del app['nationality']
-            if any(app.values()) or any(loc.values()):
-                app['sequence'] = i
-                app['uuid'] = str(uuid.uuid1())
-                res.append([app, loc])
-        return res
+import extraction
+from extraction import Entities, Claims, USClassifications, string, first, attribute, count
+
+# the fields of the documents and how they are extracted, see extraction.py
+spec = {
+    'document': 'us_patent_application',
+    'attributes': ['app','application','assignee_list','inventor_list',
+                   'us_classifications','claims'],
+    # the full text is not extracted
+    'skip': ['description', 'drawings'],
+    'header': extraction.application_header,
+    'fields': {
+        'country': first('publication_reference.country', upper=False),
+        'application': first('publication_reference.doc_number',
+                             convert=xml_util.normalize_document_identifier),
+        'kind': first('publication_reference.kind'),
+        'pat_type': attribute('application_reference', 'appl-type'),
+        'date_app': first('publication_reference.date'),
+        'clm_num': count('claims.claim'),
+        'abstract': string('abstract.p'),
+        'invention_title': first('invention_title', upper=False, convert=extraction.join_list),
+    },
+    'sections': {
+        'assignee_list': Entities('assignees.assignee', {
+                'name_first': string('first_name'),
+                'name_last': string('last_name'),
+                'organization': string('orgname'),
+                'role': string('role', upper=True),
+                'nationality': first('nationality.country'),
+                'residence': first('nationality.country'),
+            }, location={
+                'city': string('city'),
+                'state': string('state'),
+                'country': string('country'),
+            }),
+        'inventor_list': Entities('applicants.applicant', {
+                'name_first': string('addressbook.first_name'),
+                'name_last': string('addressbook.last_name'),
+            }, location={
+                'city': string('addressbook.city'),
+                'state': string('addressbook.state'),
+                'country': string('addressbook.country'),
+            }),
+        'us_classifications': USClassifications('classification_national'),
+        'claims': Claims('claim', {
+                'text': string('claim_text', convert=extraction.strip_claim_number),
+                # claim_refs are 'claim N', so we extract the N
+                'dependent': string('claim_ref', upper=True, convert=lambda ref:
+                                    int(''.join(c for c in ref.split(' ')[-1] if c.isdigit()))),
+            }),
+    }
+}
 
-    def _get_doc_info(self, root):
-        """
-        Accepts an XMLElement root as an argument. Returns list of
-        [country, doc-number, kind, date] for the given root
-        """
-        res = {}
-        for tag in ['country', 'kind', 'date']:
-            data = root.contents_of(tag)
-            res[tag] = data[0] if data else ''
-        res['number'] = xml_util.normalize_document_identifier(
-            root.contents_of('doc_number')[0])
-        return res
+plan = extraction.compile_plan(spec)
 
-    @property
-    def us_classifications(self):
-        """
-        Returns list of dictionaries representing us classification
-        main:
-          class
-          subclass
-        """
-        classes = []
-        i = 0
-        main = self.xml.classification_national.contents_of('main_classification')
-        data = {'class': main[0][:3].replace(' ', ''),
-                'subclass': main[0][3:].replace(' ', '')}
-        if any(data.values()):
-            classes.append([
-                {'uuid': str(uuid.uuid1()), 'sequence': i},
-                {'id': data['class'].upper()},
-                {'id': "{class}/{subclass}".format(**data).upper()}])
-            i = i + 1
-        if self.xml.classification_national.further_classification:
-            further = self.xml.classification_national.contents_of('further_classification')
-            for classification in further:
-                data = {'class': classification[:3].replace(' ', ''),
-                        'subclass': classification[3:].replace(' ', '')}
-                if any(data.values()):
-                    classes.append([
-                        {'uuid': str(uuid.uuid1()), 'sequence': i},
-                        {'id': data['class'].upper()},
-                        {'id': "{class}/{subclass}".format(**data).upper()}])
-                    i = i + 1
-        return classes
 
-    @property
-    def claims(self):
-        """
-        Returns list of dictionaries representing claims
-        claim:
-          text
-          dependent -- -1 if an independent claim, else this is the number
-                       of the claim this one is dependent on
-          sequence
-        """
-        claims = self.xml.claim
-        res = []
-        for i, claim in enumerate(claims):
-            data = {}
-            data['text'] = claim.contents_of('claim_text', as_string=True, upper=False)
-            # remove leading claim num from text
-            data['text'] = claim_num_regex.sub('', data['text'])
-            data['sequence'] = i+1 # claims are 1-indexed
-            if claim.claim_ref:
-                # claim_refs are 'claim N', so we extract the N
-                claim_str = claim.contents_of('claim_ref',\
-                                        as_string=True).split(' ')[-1]
-                data['dependent'] = int(''.join(c for c in claim_str if c.isdigit()))
-            data['uuid'] = str(uuid.uuid1())
-            res.append(data)
-        return res
+class Patent(extraction.PlanPatent):
+    plan = plan
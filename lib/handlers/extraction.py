@@ -0,0 +1,620 @@
+#!/usr/bin/env python
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+"""
+Declarative field extraction for the XML handlers.
+
+A handler module describes how the fields of its schema version map onto the
+document tree as a spec: a dictionary of paths (dotted chains of tag names,
+as used on the tree by the handlers, e.g. 'assignees.assignee') and field
+definitions. compile_plan turns the spec into a Plan whose extract() returns
+the patobj of a document, and the handler's Patent class (see PlanPatent)
+fills its patobj from the same plan, so the spec is the only description of
+the fields. Their output is checked against that of the property-based
+Patent classes they replaced (see test/test_extraction.py). The fields are
+compiled into readers once per handler, and each record (an assignee, a citation, a
+claim...) memoises the chains its paths go through, so fields that share a
+path prefix (e.g. the header fields below 'publication_reference') look it
+up only once, and fields that a record does not need (e.g. the citation
+fields of an other reference) are never read.
+
+A spec has the keys
+    document:   tag of the document element, e.g. 'us_patent_grant'
+    attributes: attributes of the patobj, in the order they are filled
+    header:     function called with the values of [fields], returning a
+                dictionary of the attributes that describe the document
+                itself; its .attributes lists their names (see grant_header)
+    fields:     name -> Field, looked up from the document element
+    sections:   attribute -> section (Entities, Citations, Claims,
+                Relations, USClassifications) that builds it
+and optionally
+    skip:       elements that no field reads, which are left out of the
+                tree when the document is parsed (e.g. 'description')
+"""
+
+import re
+import uuid
+from unidecode import unidecode
+import xml_util
+import xml_driver
+from handler import Patobj, PatentHandler, empty, intern_values
+
+claim_num_regex = re.compile(r'^\d+\. *') # removes claim number from claim text
+
+
+class Field(object):
+    """
+    A value read from the tree: the contents of the elements at [path]
+    below a record (or the document element), as returned by contents_of.
+    [as_string] and [upper] are passed to contents_of, [index] picks one item
+    of the result and [convert] is applied to the final value. [default] is
+    the default of contents_of, if given. If [attribute] is given, the value
+    is that attribute of the first element at [path] instead (None if there
+    is no element), and if [count], it is the number of elements at [path]
+    """
+
+    def __init__(self, path, as_string=False, upper=True, index=None,
+                 default=None, convert=None, attribute=None, count=False):
+        self.steps = tuple(path.split('.'))
+        self.as_string = as_string
+        self.upper = upper
+        self.index = index
+        self.default = default
+        self.convert = convert
+        self.attribute = attribute
+        self.count = count
+        self.read = None
+        self.select = None
+
+    def compile(self, record):
+        """
+        Sets read to a function of a Values object that returns the value of
+        this field. If [record], the values are read below an XMLElement, so
+        a path of a single tag has the semantics of XMLElement.contents_of;
+        otherwise (and for longer paths) those of ChainList.contents_of. For
+        a single tag below a record, select is set too: the function of the
+        elements found for the tag that read applies to them
+        """
+        steps, last = self.steps[:-1], self.steps[-1]
+        index, convert = self.index, self.convert
+        if self.count:
+            if record and not steps:
+                self.select = len
+                self.read = lambda values: len(values.element.find(last))
+            else:
+                self.read = lambda values: len(getattr(values.chain_at(steps), last))
+            return
+        if self.attribute:
+            name = self.attribute
+            def select(elements):
+                return elements[0].get_attribute(name, upper=False) if elements else None
+            if record and not steps:
+                self.select = select
+                self.read = lambda values: select(values.element.find(last))
+            else:
+                self.read = lambda values: select(getattr(values.chain_at(steps), last))
+            return
+        as_string, upper = self.as_string, self.upper
+        if record and not steps:
+            contents = xml_driver.contents
+            default = xml_driver.ChainList('') if self.default is None else self.default
+            def select(elements):
+                value = contents(elements, default, as_string, upper)
+                if index is not None:
+                    value = value[index]
+                if convert is not None:
+                    value = convert(value)
+                return value
+            self.select = select
+            read = lambda values: select(values.element.find(last))
+        else:
+            kwargs = {'as_string': as_string, 'upper': upper}
+            if self.default is not None:
+                kwargs['default'] = self.default
+            def read(values):
+                value = values.chain_at(steps).contents_of(last, **kwargs)
+                if index is not None:
+                    value = value[index]
+                if convert is not None:
+                    value = convert(value)
+                return value
+        self.read = read
+
+
+def string(path, upper=False, convert=None):
+    """
+    Field with the contents at [path] joined into a string
+    """
+    return Field(path, as_string=True, upper=upper, convert=convert)
+
+def first(path, upper=True, default=None, convert=None):
+    """
+    Field with the first item of the contents at [path]
+    """
+    return Field(path, upper=upper, index=0, default=default, convert=convert)
+
+def attribute(path, name):
+    """
+    Field with the attribute [name] of the first element at [path]
+    """
+    return Field(path, attribute=name)
+
+def count(path):
+    """
+    Field with the number of elements at [path]
+    """
+    return Field(path, count=True)
+
+
+def join_list(value):
+    """
+    Joins [value] into a string if it is a list of strings
+    """
+    return ''.join(value) if isinstance(value, list) else value
+
+def strip_claim_number(text):
+    return claim_num_regex.sub('', text)
+
+
+class Values(object):
+    """
+    Lazily evaluated values of [fields] for one record: either an XMLElement
+    [element] or the ChainList [chain] of the document element. The chains
+    that paths are followed through are memoised, so the fields of a record
+    that share a path prefix look it up only once. A field can also be a
+    function of the Values object, which lets it derive its value from other
+    fields
+    """
+
+    def __init__(self, fields, element=None, chain=None):
+        self.fields = fields
+        self.element = element
+        self.chain = chain
+        self.values = {}
+        self.chains = {}
+
+    def __getitem__(self, name):
+        values = self.values
+        if name in values:
+            return values[name]
+        field = self.fields[name]
+        value = values[name] = field(self) if callable(field) else field.read(self)
+        return value
+
+    def chain_at(self, steps):
+        """
+        Returns the ChainList reached by following the tuple of tags [steps]
+        from the record
+        """
+        try:
+            return self.chains[steps]
+        except KeyError:
+            if not steps:
+                chain = self.chain
+            elif self.element is not None and len(steps) == 1:
+                chain = xml_driver.ChainList(self.element.find(steps[0]))
+            else:
+                chain = getattr(self.chain_at(steps[:-1]), steps[-1])
+            self.chains[steps] = chain
+            return chain
+
+    def has(self, tag):
+        """
+        True if the record has a descendant [tag]
+        """
+        return bool(self.element.find(tag))
+
+    def dict(self, names):
+        data = {}
+        for name in names:
+            data[name] = self[name]
+        return data
+
+
+class Section(object):
+    """
+    Builds one attribute of the patobj from the records at [path] below
+    the document element. [fields] maps names to the Field of each value
+    """
+    # elements read other than through [path] and [fields]
+    reads = ()
+
+    def __init__(self, path, fields):
+        self.path = path.split('.')
+        self.fields = fields
+
+    def compile(self):
+        """
+        Compiles the fields read from each record
+        """
+        for field in self.fields.itervalues():
+            if isinstance(field, Field):
+                field.compile(record=True)
+
+    def elements(self, document):
+        """
+        Returns the XMLElement of each record below the ChainList [document]
+        """
+        chain = document
+        for step in self.path:
+            chain = getattr(chain, step)
+        return chain
+
+    def records(self, document):
+        """
+        Yields a Values for each record below the ChainList [document]
+        """
+        for element in self.elements(document):
+            yield Values(self.fields, element)
+
+
+class Entities(Section):
+    """
+    People and organizations (assignees, inventors, lawyers) and other flat
+    records such as IPCR classifications. Each record becomes a dictionary of
+    [fields] with a uuid, plus its index as 'sequence' if [sequence], and is
+    dropped if all of its values are empty. With [location] (a mapping of
+    city, state and country to fields), each record is a pair of the
+    dictionary and its location, whose id is derived from the location
+    """
+
+    def __init__(self, path, fields, location=None, sequence=True):
+        location = dict(('location_' + name, field)
+                        for name, field in (location or {}).iteritems())
+        Section.__init__(self, path, dict(fields, **location))
+        self.names = fields.keys()
+        self.location = bool(location)
+        self.sequence = sequence
+
+    def extract(self, document):
+        res = []
+        for i, values in enumerate(self.records(document)):
+            data = values.dict(self.names)
+            if self.location:
+                loc = dict((tag, values['location_' + tag]) for tag in ['city', 'state', 'country'])
+                #this is created because of MySQL foreign key case sensitivities
+                loc['id'] = unidecode(u"|".join([loc['city'], loc['state'], loc['country']]).lower())
+                if not (any(data.values()) or any(loc.values())):
+                    continue
+            elif not any(data.values()):
+                continue
+            if self.sequence:
+                data['sequence'] = i
+            data['uuid'] = str(uuid.uuid1())
+            intern_values(data)
+            res.append([data, intern_values(loc)] if self.location else data)
+        return res
+
+
+class Citations(Section):
+    """
+    Patent citations and other references. [fields] has 'text' for the
+    other references; the records that have it are other references and the
+    rest are patent citations made of the remaining fields. Returns the list
+    of patent citations and the list of other references. Grants have
+    hundreds of citations, so every field must be a single tag of the
+    record: the tags of a record are all found in one walk of its subtree
+    (see XMLElement.find_tags) rather than a lookup per field
+    """
+
+    def __init__(self, path, fields):
+        for name, field in fields.iteritems():
+            if not isinstance(field, Field) or len(field.steps) != 1:
+                raise ValueError("Citation field '{0}' is not a single tag".format(name))
+        Section.__init__(self, path, fields)
+        self.other = fields['text'].steps[0]
+        self.tags = frozenset(field.steps[0] for field in fields.itervalues())
+        self.names = [name for name in fields if name != 'text']
+
+    def extract(self, document):
+        regular_cits = []
+        other_cits = []
+        other, tags, none = self.other, self.tags, ()
+        text = self.fields['text']
+        fields = [(name, self.fields[name].select, self.fields[name].steps[0]) for name in self.names]
+        for element in self.elements(document):
+            found = element.find_tags(tags)
+            if other in found:
+                data = {'text': text.select(found[other])}
+                if any(data.values()):
+                    data['sequence'] = len(other_cits)
+                    data['uuid'] = str(uuid.uuid1())
+                    other_cits.append(data)
+            else:
+                data = {}
+                for name, select, tag in fields:
+                    data[name] = select(found.get(tag, none))
+                if any(data.values()):
+                    data['sequence'] = len(regular_cits)
+                    data['uuid'] = str(uuid.uuid1())
+                    regular_cits.append(intern_values(data))
+        return [regular_cits, other_cits]
+
+
+class Claims(Section):
+    """
+    Claims, numbered from 1. [fields] has the claim 'text' and the number of
+    the claim it depends on as 'dependent', which is only filled in for
+    claims that contain the element of the 'dependent' field
+    """
+
+    def __init__(self, path, fields):
+        Section.__init__(self, path, fields)
+        self.reference = fields['dependent'].steps[0]
+
+    def extract(self, document):
+        res = []
+        for i, values in enumerate(self.records(document)):
+            data = {'text': values['text'], 'sequence': i+1}
+            if values.has(self.reference):
+                data['dependent'] = values['dependent']
+            data['uuid'] = str(uuid.uuid1())
+            res.append(data)
+        return res
+
+
+def _doc_info(root):
+    res = {}
+    for tag in ['country', 'kind', 'date']:
+        data = root.contents_of(tag)
+        res[tag] = data[0] if data else ''
+    res['number'] = xml_util.normalize_document_identifier(
+        root.contents_of('doc_number')[0])
+    res['date'] = xml_util.fix_date(res['date'])
+    return res
+
+
+class Relations(Section):
+    """
+    Related US documents below the element at [path]: the related
+    publications and provisional applications themselves, and the parent and
+    child documents of each of their relations
+    """
+    reads = ('related_publication', 'us_provisional_application', 'relation', 'parent_doc',
+             'parent_grant_document', 'parent_pct_document', 'child_doc', 'parent_status',
+             'country', 'kind', 'date', 'doc_number')
+
+    def __init__(self, path):
+        Section.__init__(self, path, {})
+
+    def extract(self, document):
+        root = getattr(document, self.path[0])
+        if not root:
+            return []
+        res = []
+        for reldoc in root[0].children:
+            if reldoc._name == 'related_publication' or \
+               reldoc._name == 'us_provisional_application':
+                data = {'doctype': reldoc._name}
+                data.update(_doc_info(reldoc))
+                if any(data.values()):
+                    data['sequence'] = len(res)
+                    data['uuid'] = str(uuid.uuid1())
+                    res.append(data)
+            for relation in reldoc.relation:
+                for relationship in ['parent_doc', 'parent_grant_document',
+                                     'parent_pct_document', 'child_doc']:
+                    doc = getattr(relation, relationship)
+                    if not doc:
+                        continue
+                    data = {'doctype': reldoc._name}
+                    data.update(_doc_info(doc[0]))
+                    data['status'] = doc[0].contents_of('parent_status', as_string=True)
+                    data['relationship'] = relationship  # parent/child
+                    if any(data.values()):
+                        data['sequence'] = len(res)
+                        data['uuid'] = str(uuid.uuid1())
+                        res.append(data)
+        return res
+
+
+class USClassifications(Section):
+    """
+    The main and further US classifications below the element at [path],
+    each as [{uuid, sequence}, {mainclass id}, {subclass id}]
+    """
+    reads = ('main_classification', 'further_classification')
+
+    def __init__(self, path):
+        Section.__init__(self, path, {})
+
+    def _classes(self, classifications, classes):
+        for classification in classifications:
+            data = {'class': classification[:3].replace(' ', ''),
+                    'subclass': classification[3:].replace(' ', '')}
+            if any(data.values()):
+                classes.append([
+                    {'uuid': str(uuid.uuid1()), 'sequence': len(classes)},
+                    {'id': data['class'].upper()},
+                    {'id': "{class}/{subclass}".format(**data).upper()}])
+
+    def extract(self, document):
+        classes = []
+        national = getattr(document, self.path[0])
+        self._classes(national.contents_of('main_classification')[:1], classes)
+        if national.further_classification:
+            self._classes(national.contents_of('further_classification'), classes)
+        return classes
+
+
+def grant_header(values):
+    """
+    Header of a grant: the 'pat', 'app' and 'patent' attributes
+    """
+    pat = {
+        "id": values['patent'],
+        "type": values['pat_type'],
+        "number": values['patent'],
+        "country": values['country'],
+        "date": xml_util.fix_date(values['date_grant']),
+        "abstract": values['abstract'],
+        "title": values['invention_title'],
+        "kind": values['kind'],
+        "num_claims": values['clm_num']
+    }
+    app = {
+        "type": values['code_app'],
+        "number": values['patent_app'],
+        "country": values['country_app'],
+        "date": xml_util.fix_date(values['date_app'])
+    }
+    app["id"] = str(app["date"])[:4] + "/" + app["number"]
+    return {'pat': pat, 'app': app, 'patent': values['patent']}
+
+grant_header.attributes = ['pat', 'app', 'patent']
+
+
+def application_header(values):
+    """
+    Header of an application: the 'app' and 'application' attributes
+    """
+    app = {
+        "id": values['application'],
+        "type": values['pat_type'],
+        "number": values['application'],
+        "country": values['country'],
+        "date": xml_util.fix_date(values['date_app']),
+        "abstract": values['abstract'],
+        "title": values['invention_title'],
+        "kind": values['kind'],
+        "num_claims": values['clm_num']
+    }
+    app["id"] = str(app["date"])[:4] + "/" + app["number"]
+    return {'app': app, 'application': values['application']}
+
+application_header.attributes = ['app', 'application']
+
+
+class Plan(object):
+    """
+    Compiled extraction plan for a spec (see compile_plan)
+    """
+
+    def __init__(self, spec):
+        self.document = spec['document']
+        self.attributes = spec['attributes']
+        self.header = spec['header']
+        self.fields = spec['fields']
+        self.sections = spec['sections']
+        self.skip = frozenset(spec.get('skip', ()))
+        # elements left out for each set of extracted attributes
+        self.skips = {}
+
+    def skip_for(self, attributes):
+        """
+        Returns the elements to leave out of the tree when only the sections
+        of [attributes] are extracted: besides [skip], the outermost element
+        of each section that is not, or the elements its records' fields
+        start with if that one is needed elsewhere (e.g. the claims of an
+        application, which are counted). Elements that a field or an
+        extracted section goes through are never left out
+        """
+        key = frozenset(attributes)
+        if key not in self.skips:
+            sections = [section for attr, section in self.sections.iteritems() if attr in key]
+            fields = self.fields.values()
+            used = set()
+            for section in sections:
+                fields.extend(section.fields.values())
+                used.update(section.path)
+                used.update(section.reads)
+            for field in fields:
+                if isinstance(field, Field):
+                    used.update(field.steps)
+            skip = set(self.skip)
+            for attr, section in self.sections.iteritems():
+                if attr in key:
+                    continue
+                if section.path[0] not in used:
+                    skip.add(section.path[0])
+                else:
+                    skip.update(field.steps[0] for field in section.fields.itervalues()
+                                if isinstance(field, Field) and field.steps[0] not in used)
+            self.skips[key] = frozenset(skip)
+        return self.skips[key]
+
+    def extract(self, xml, is_string=False, attributes=None):
+        """
+        Parses the document [xml] (see xml_driver.parse_document) and returns
+        its patobj. If [attributes] is given, only the sections of those
+        attributes are extracted and the others are left empty (see
+        handler.empty)
+        """
+        skip = self.skip if attributes is None else self.skip_for(attributes)
+        xh = xml_driver.parse_document(xml, is_string, skip=skip)
+        return self.fill(getattr(xh.root, self.document), attributes)
+
+    def fill(self, document, attributes=None):
+        """
+        Returns the patobj of the [document] element, with only the sections
+        of [attributes] extracted if it is given (see extract)
+        """
+        header = self.header(Values(self.fields, chain=document))
+        patobj = Patobj()
+        for attr in self.attributes:
+            if attr in header:
+                patobj.__dict__[attr] = header[attr]
+            elif attributes is None or attr in attributes:
+                patobj.__dict__[attr] = self.sections[attr].extract(document)
+            else:
+                patobj.__dict__[attr] = empty(attr)
+        return patobj
+
+
+class PlanPatent(PatentHandler):
+    """
+    Patent class of the handlers with a spec: the document is parsed whole,
+    as by the handlers without one, and its patobj is filled from the
+    handler's [plan]. Unlike Plan.extract, no element is left out of the tree
+    """
+    plan = None
+
+    def __init__(self, xml_string, is_string=False):
+        xh = xml_driver.parse_document(xml_string, is_string)
+        self.xml = getattr(xh.root, self.plan.document)
+        self.attributes = self.plan.attributes
+
+    def get_patobj(self, attributes=None):
+        return self.plan.fill(self.xml, attributes)
+
+
+def compile_plan(spec):
+    """
+    Checks [spec] and returns its Plan
+    """
+    for key in ['document', 'attributes', 'header', 'fields', 'sections']:
+        if key not in spec:
+            raise ValueError("Extraction spec has no '{0}'".format(key))
+    missing = [attr for attr in spec['attributes']
+               if attr not in spec['sections'] and attr not in spec['header'].attributes]
+    if missing:
+        raise ValueError('No section for attributes {0}'.format(', '.join(missing)))
+    for field in spec['fields'].itervalues():
+        field.compile(record=False)
+    for section in spec['sections'].itervalues():
+        section.compile()
+    return Plan(spec)
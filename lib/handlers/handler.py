@@ -26,12 +26,63 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 @author Gabe Fierro gt.fierro@berkeley.edu github.com/gtfierro
 """
+# fields of the records whose values repeat across patents: country, kind
+# and category codes, roles, states and classification levels. Their strings
+# are shared between all the records extracted by the process (see
+# intern_values), so that the patent objects waiting for a commit take less
+# memory
+interned_fields = frozenset([
+    'type', 'nationality', 'residence', 'state', 'country', 'kind', 'category',
+    'classification_level', 'section', 'class', 'subclass', 'symbol_position',
+    'classification_value', 'classification_status', 'classification_data_source',
+    'ipc_version_indicator', 'action_date'])
+_strings = {}
+
 class Patobj(object):
     pass
 
+def intern_values(data):
+    """
+    Replaces the strings of the interned_fields in the dictionary [data] by
+    the first copy seen by this process, and returns [data]
+    """
+    for name in interned_fields.intersection(data):
+        value = data[name]
+        if isinstance(value, basestring):
+            data[name] = _strings.setdefault(value, value)
+    return data
+
+def intern_records(value):
+    """
+    Applies intern_values to the dictionaries found in [value], a patobj
+    attribute made of nested lists of records, and returns [value]
+    """
+    if isinstance(value, dict):
+        intern_values(value)
+    elif isinstance(value, list):
+        for item in value:
+            intern_records(item)
+    return value
+
+def empty(attr):
+    """
+    Returns the value of the patobj attribute [attr] when it is not
+    computed: no citations and no other references for the citation_list,
+    an empty list for the others
+    """
+    return [[], []] if attr == 'citation_list' else []
+
 class PatentHandler(object):
-    def get_patobj(self):
+    def get_patobj(self, attributes=None):
+        """
+        If [attributes] is given, the properties that are not among them are
+        not computed and are left empty (see empty)
+        """
         patobj = Patobj()
         for attr in self.attributes:
-            patobj.__dict__[attr] = getattr(self, attr)
+            if attributes is None or attr in attributes or \
+               not isinstance(getattr(type(self), attr, None), property):
+                patobj.__dict__[attr] = intern_records(getattr(self, attr))
+            else:
+                patobj.__dict__[attr] = empty(attr)
         return patobj
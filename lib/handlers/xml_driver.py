@@ -32,12 +32,42 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 General purpose XML parsing driver for use as a content handler through
 Python's xml.sax module.  Works in conjunction with lib/xml_util.py, which
 provides useful helper methods to handle the parsed data.
+
+The tree can be built by one of several parse engines (see parse_document):
+'sax' (xml.sax, the default), 'expat' (pyexpat callbacks without the SAX
+layer) and 'lxml' (lxml's parser with a target, if lxml is installed). All of
+them produce the same XMLElement tree.
 """
 
 import functools
+from bisect import bisect_right
+from operator import attrgetter, itemgetter
 from collections import deque
+from xml.parsers import expat
 from xml.sax import make_parser, handler
+from xml.sax.expatreader import ExpatLocator
 import xml_util
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+_unbounded = float('inf')
+
+def _search(elements, key):
+    """
+    Breadth-first search through [elements] and their descendants for the
+    elements named [key]. Matches are not searched further. Used for trees
+    without a tag index (see XMLHandler)
+    """
+    res = []
+    scope = deque(elements)
+    while scope:
+        current = scope.popleft()
+        if current._name == key: res.append(current)
+        else: scope.extend(current.children)
+    return res
+
 
 class ChainList(list):
     """
@@ -56,13 +86,21 @@ class ChainList(list):
         return ChainList(res) if res else default
 
     def __getattr__(self, key):
+        if len(self) == 1:
+            item = self[0]
+            return ChainList([item] if item._name == key else item.find(key))
+        if not all(item._tags is not None for item in self):
+            return ChainList(_search(self, key))
+        # same order as the breadth-first search: by depth below the item
+        # the match was found under, then by item, then in document order
         res = []
-        scope = deque(self)
-        while scope:
-            current = scope.popleft()
-            if current._name == key: res.append(current)
-            else: scope.extend(current.children)
-        return ChainList(res)
+        for i, item in enumerate(self):
+            if item._name == key:
+                res.append((0, i, item))
+            else:
+                res.extend((elem._depth - item._depth, i, elem) for elem in item.find(key))
+        res.sort(key=lambda match: match[:2])
+        return ChainList(match[2] for match in res)
 
     def __reduce__(self): return (ChainList, (), None, iter(self), None)
     def __getstate__(self): return None
@@ -72,17 +110,34 @@ class XMLElement(object):
     Represents XML elements from a document. These will assist
     us in representing an XML document as a Python object.
     Heavily inspired from: https://github.com/stchris/untangle/blob/master/untangle.py
+
+    Elements built by XMLHandler share the handler's tag index and know
+    their position in the document, so looking up descendants by name does
+    not walk the tree (see find)
     """
 
+    __slots__ = ('_name', '_attributes', 'content', 'children', 'is_root',
+                 '_tags', '_pre', '_end', '_depth', '_cleaned')
+
     def __init__(self, name, attributes):
         self._name = name
         self._attributes = attributes
         self.content = []
         self.children = ChainList()
         self.is_root = False
+        self._tags = None
+        self._pre = 0
+        self._end = _unbounded
+        self._depth = 0
+        # cleaned content by the upper flag, see get_content
+        self._cleaned = None
 
     def __getstate__(self):
-        return self.__dict__
+        return dict((slot, getattr(self, slot)) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in state.iteritems():
+            setattr(self, slot, value)
 
     def __iter__(self):
         yield self
@@ -94,42 +149,83 @@ class XMLElement(object):
         return self.get_attribute(key)
 
     def __getattr__(self, key):
+        if key.startswith('__') or key in self.__slots__:
+            raise AttributeError(key)
+        return ChainList(self.find(key))
+
+    def find(self, key):
+        """
+        Returns the descendants named [key], in breadth-first order and
+        without the matches nested inside other matches. With a tag index
+        the descendants are the indexed elements whose preorder position
+        falls within this element's subtree
+        """
+        if self._tags is None:
+            return _search(self.children, key)
+        positions, elements = self._tags.get(key, ((), ()))
+        lo = bisect_right(positions, self._pre)
+        hi = bisect_right(positions, self._end, lo)
         res = []
-        scope = deque(self.children)
-        while scope:
-            current = scope.popleft()
-            if current._name == key: res.append(current)
-            else: scope.extend(current.children)
-        if res:
-            self.__dict__[key] = ChainList(res)
-            return ChainList(res)
-        else:
-            return ChainList('')
+        end = -1
+        for elem in elements[lo:hi]:
+            if elem._pre > end:
+                res.append(elem)
+                end = elem._end
+        if len(res) > 1:
+            res.sort(key=attrgetter('_depth'))
+        return res
+
+    def find_tags(self, keys):
+        """
+        Returns a dictionary of key -> find(key) for each of the tags in the
+        set [keys] that have matches, from a single walk of the subtree.
+        Cheaper than a find per key for small subtrees such as a citation
+        """
+        found = {}
+        stack = [(child, 1, ()) for child in reversed(self.children)]
+        pop, extend = stack.pop, stack.extend
+        while stack:
+            elem, depth, inside = pop()
+            name = elem._name
+            if name in keys and name not in inside:
+                if name in found:
+                    found[name].append((depth, elem))
+                else:
+                    found[name] = [(depth, elem)]
+                inside += (name,)
+            if elem.children:
+                depth += 1
+                extend([(child, depth, inside) for child in reversed(elem.children)])
+        for key, matches in found.iteritems():
+            if len(matches) > 1:
+                matches.sort(key=itemgetter(0))
+            found[key] = [elem for depth, elem in matches]
+        return found
 
     def contents_of(self, key, default=ChainList(''), as_string=False, upper=True):
-        candidates = self.__getattr__(key)
-        if candidates:
-            res = [x.get_content(upper=upper) for x in candidates]
-        else:
-            res = default
-        if as_string:
-            if not res:
-                return ''
-            # handle corner case of [['content', 'here']]
-            elif isinstance(res, list)\
-                 and len(res) == 1\
-                 and isinstance(res[0], list):
-                res = res[0]
-            return ' '.join(filter(lambda x: x, filter(lambda x: not isinstance(x, list), res)))
-        return res
+        return contents(self.__getattr__(key), default, as_string, upper)
 
     def get_content(self, upper=True):
+        """
+        Returns the cleaned content of this element: a string if it has a
+        single piece of content, otherwise a list of strings. The result is
+        cleaned once for each value of [upper]
+        """
+        cleaned = self._cleaned
+        if cleaned is None:
+            cleaned = self._cleaned = {}
+        elif upper in cleaned:
+            res = cleaned[upper]
+            return list(res) if isinstance(res, list) else res
         if len(self.content) == 1:
-            return xml_util.clean(self.content[0], upper=upper)
+            res = cleaned[upper] = xml_util.clean(self.content[0], upper=upper)
+            return res
         else:
-            return map(functools.partial(xml_util.clean, upper=upper), self.content)
+            res = cleaned[upper] = map(functools.partial(xml_util.clean, upper=upper), self.content)
+            return list(res)
 
     def put_content(self, content, lastlinenumber, linenumber):
+        self._cleaned = None
         if not self.content or lastlinenumber != linenumber:
             self.content.append(content)
         else:
@@ -147,21 +243,67 @@ class XMLElement(object):
                self.children
 
 
+def contents(candidates, default=ChainList(''), as_string=False, upper=True):
+    """
+    Returns the cleaned content of the elements in [candidates] as
+    XMLElement.contents_of does for the elements it finds: a list with the
+    content of each element, or [default] if there are none. If [as_string],
+    the contents are joined into a single string instead
+    """
+    if candidates:
+        res = [x.get_content(upper=upper) for x in candidates]
+    else:
+        res = default
+    if as_string:
+        if not res:
+            return ''
+        # handle corner case of [['content', 'here']]
+        elif isinstance(res, list)\
+             and len(res) == 1\
+             and isinstance(res[0], list):
+            res = res[0]
+        return ' '.join(filter(lambda x: x, filter(lambda x: not isinstance(x, list), res)))
+    return res
+
+
 class XMLHandler(handler.ContentHandler):
     """
-    SAX Handler to create the Python object while parsing
+    SAX Handler to create the Python object while parsing. The elements
+    named in [skip] are left out of the tree, with everything inside them
     """
 
-    def __init__(self):
+    def __init__(self, skip=()):
+        # tag index: element name -> (preorder positions, elements)
+        self.tags = {}
+        self.position = 0
         self.root = XMLElement(None, None)
         self.root.is_root = True
+        self.root._tags = self.tags
         self.elements = ChainList()
         handler.ContentHandler.__init__(self)
         self.lastline = -1
+        self.skip = skip
+        # depth inside a skipped element
+        self.skipping = 0
 
     def startElement(self, name, attributes):
+        self.start_element(name, dict(attributes.items()))
+
+    def start_element(self, name, attributes):
         name = name.replace('-','_').replace('.','_').replace(':','_')
-        xmlelem = XMLElement(name, dict(attributes.items()))
+        if self.skipping or name in self.skip:
+            self.skipping += 1
+            return
+        xmlelem = XMLElement(name, attributes)
+        self.position = position = self.position + 1
+        xmlelem._tags = self.tags
+        xmlelem._pre = position
+        xmlelem._depth = len(self.elements) + 1
+        indexed = self.tags.get(name)
+        if indexed is None:
+            indexed = self.tags[name] = ([], [])
+        indexed[0].append(position)
+        indexed[1].append(xmlelem)
         if self.elements:
             self.elements[-1].add_child(xmlelem)
         else:
@@ -169,12 +311,21 @@ class XMLHandler(handler.ContentHandler):
         self.elements.append(xmlelem)
 
     def endElement(self, name):
-        if self.elements:
-            self.elements.pop()
+        if self.skipping:
+            self.skipping -= 1
+        elif self.elements:
+            self.elements.pop()._end = self.position
 
     def characters(self, content):
-        currentlinenumber = self._locator.getLineNumber()
-        if content.strip():
+        self.put_characters(content, self._locator.getLineNumber())
+
+    def put_characters(self, content, currentlinenumber):
+        """
+        Adds the character data [content] found on line [currentlinenumber]
+        to the current element. Data on the same line as the previous
+        character data is appended to the same piece of content
+        """
+        if content.strip() and not self.skipping:
           if self.elements[-1]._name in ('b','i'):
             self.elements[-2].put_content(content, self.lastline, currentlinenumber)
           elif self.elements[-1]._name == 'sub':
@@ -182,4 +333,138 @@ class XMLHandler(handler.ContentHandler):
             self.elements[-2].put_content(newtxt, self.lastline, currentlinenumber)
           else:
             self.elements[-1].put_content(content, self.lastline, currentlinenumber)
-        self.lastline = self._locator.getLineNumber()
+        self.lastline = currentlinenumber
+
+    def put_text(self, text, linenumber):
+        """
+        Adds [text] starting on line [linenumber] the way expat would report
+        it: one piece of character data per line, with each newline reported
+        on the line it ends. Returns the line on which [text] ends
+        """
+        if '\n' not in text:
+            if text:
+                self.put_characters(text, linenumber)
+            return linenumber
+        lines = text.split('\n')
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            if line or i < last:
+                self.put_characters(line, linenumber + i)
+        return linenumber + last
+
+
+def _parse_sax(xml, is_string, skip):
+    xh = XMLHandler(skip)
+    parser = make_parser()
+    parser.setContentHandler(xh)
+    parser.setFeature(handler.feature_external_ges, False)
+    if is_string:
+        # parser.parse() would install the locator before feeding the parser
+        xh.setDocumentLocator(ExpatLocator(parser))
+        parser.feed(xml)
+        parser.close()
+    else:
+        parser.parse(xml)
+    return xh
+
+
+def _external_entity_ref(context, base, sysid, pubid):
+    # external entities are not loaded, as with feature_external_ges
+    return 1
+
+
+def _parse_expat(xml, is_string, skip):
+    xh = XMLHandler(skip)
+    parser = expat.ParserCreate()
+    parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_UNLESS_STANDALONE)
+    parser.ExternalEntityRefHandler = _external_entity_ref
+    parser.StartElementHandler = xh.start_element
+    parser.EndElementHandler = xh.endElement
+    put_characters = xh.put_characters
+    parser.CharacterDataHandler = \
+        lambda content: put_characters(content, parser.CurrentLineNumber)
+    if is_string:
+        parser.Parse(xml, True)
+    elif isinstance(xml, basestring):
+        with open(xml, 'rb') as f:
+            parser.ParseFile(f)
+    else:
+        parser.ParseFile(xml)
+    return xh
+
+
+_xml_namespace = '{http://www.w3.org/XML/1998/namespace}'
+
+class _LxmlTarget(object):
+    """
+    Parser target for lxml that builds the tree with an XMLHandler. lxml
+    reports the character data in the same pieces as expat (split at
+    character and entity references), but without line numbers, so the line
+    is tracked by counting the newlines in the character data, comments and
+    processing instructions
+    """
+
+    def __init__(self, xh):
+        self.xh = xh
+        self.linenumber = 1
+
+    def start(self, tag, attrib):
+        attributes = dict((key.replace(_xml_namespace, 'xml:'), value)
+                          for key, value in attrib.iteritems())
+        self.xh.start_element(tag, attributes)
+
+    def end(self, tag):
+        self.xh.endElement(tag)
+
+    def data(self, content):
+        self.linenumber = self.xh.put_text(content, self.linenumber)
+
+    def comment(self, text):
+        self.linenumber += text.count('\n')
+
+    def pi(self, target, data):
+        self.linenumber += (data or '').count('\n')
+
+    def close(self):
+        return self.xh
+
+
+def _parse_lxml(xml, is_string, skip):
+    if etree is None:
+        raise ImportError("The 'lxml' parse engine requires lxml to be installed")
+    parser = etree.XMLParser(target=_LxmlTarget(XMLHandler(skip)), load_dtd=False,
+                             no_network=True, resolve_entities=False, huge_tree=True)
+    if is_string:
+        # lxml only accepts strings, not buffers
+        parser.feed(str(xml) if isinstance(xml, buffer) else xml)
+        return parser.close()
+    return etree.parse(xml, parser)
+
+
+engines = {'sax': _parse_sax, 'expat': _parse_expat, 'lxml': _parse_lxml}
+default_engine = 'sax'
+
+def set_engine(name):
+    """
+    Selects the parse engine used by parse_document: one of the keys of
+    [engines]
+    """
+    global default_engine
+    if name not in engines:
+        raise ValueError("Unknown parse engine '{0}', expected one of {1}"\
+                         .format(name, ', '.join(sorted(engines))))
+    if name == 'lxml' and etree is None:
+        raise ImportError("The 'lxml' parse engine requires lxml to be installed")
+    default_engine = name
+
+
+def parse_document(xml, is_string=False, engine=None, skip=()):
+    """
+    Runs [xml] through a new XMLHandler and returns the handler, whose root
+    holds the parsed tree. If [is_string], [xml] is the document itself as a
+    string or buffer (e.g. a slice of a memory-mapped file) and is fed to the
+    parser directly; otherwise it is a filename or file object. [engine]
+    overrides the engine chosen with set_engine for this document. The
+    elements named in [skip] (e.g. 'description') are not added to the tree
+    """
+    return engines[engine or default_engine](xml, is_string, skip)
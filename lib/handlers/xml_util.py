@@ -33,9 +33,11 @@ Collection of useful functions and tools for working with XML documents
 """
 
 import re
+import logging
 from itertools import izip
 from unicodedata import normalize
 from cgi import escape
+from datetime import datetime
 
 
 def flatten(ls_of_ls):
@@ -89,13 +91,15 @@ def normalize_utf8(string):
     else:
         return normalize('NFC', string.decode('utf-8'))
 
+escape_seqs = re.compile(r'[\r\n\t\v\b\f\a ]+')
+non_ascii = re.compile(u'[^\x00-\x7f]')
+
 def remove_escape_sequences(string):
     """
     Replaces all contiguous instances of "\r\n\t\v\b\f\a " and replaces
     it with a single space. Preserves at most one space of surrounding whitespace
     """
-    escape_seqs = r'[\r\n\t\v\b\f\a ]+'
-    return re.sub(escape_seqs,' ', string)
+    return escape_seqs.sub(' ', string)
 
 def translate_underscore(string, lower=False):
     """
@@ -140,18 +144,64 @@ def clean(string, upper=True):
     Applies a subset of the above functions in the correct order
     and returns the string in all uppercase.
 
-    Change &amp;
-    """
-    string = normalize_utf8(string)
-    string = remove_escape_sequences(string)
-    string = translate_underscore(string)
-    string = escape_html(string)
-    string = string.replace("&nbsp;", " ").replace("&amp;", "&")
+    Same result as normalize_utf8, remove_escape_sequences,
+    translate_underscore and escape_html in turn, followed by changing
+    &amp; back to &, but in a single pass over [string] for most content:
+    NFC normalization cannot change ASCII text, so it is skipped for it,
+    and the underscore idiom and the HTML escaping only apply to text with
+    angle brackets. Escaping & and then changing &amp; back leaves each &
+    as it was, so only < and > are escaped
+    """
+    if not isinstance(string, unicode):
+        string = string.decode('utf-8')
+    if non_ascii.search(string):
+        string = normalize('NFC', string)
+    string = escape_seqs.sub(' ', string)
+    if u'<' in string or u'>' in string:
+        string = translate_underscore(string)
+        string = string.replace(u'<', u'&lt;').replace(u'>', u'&gt;')
     if upper:
         return string.upper()
     else:
         return string
 
+# datetimes by date string, see fix_date
+_dates = {}
+_max_dates = 100000
+
+def fix_date(datestring):
+    """
+    Converts a string [datestring] of form YYYYMMDD to a datetime. A month
+    or day of 00 defaults to the first; dates before 1900 and unparseable
+    dates give None. The conversions are memoised, since the same dates
+    recur across the citations of a file
+    """
+    try:
+        return _dates[datestring]
+    except KeyError:
+        pass
+    date = _convert_date(datestring)
+    if len(_dates) < _max_dates:
+        _dates[datestring] = date
+    return date
+
+def _convert_date(datestring):
+    if not datestring:
+        return None
+    elif datestring[:4] < "1900":
+        return None
+    # default to first of month in absence of day
+    if datestring[-4:-2] == '00':
+        datestring = datestring[:-4] + '01' + datestring[-2:]
+    if datestring[-2:] == '00':
+        datestring = datestring[:6] + '01'
+    try:
+        datestring = datetime.strptime(datestring, '%Y%m%d')
+        return datestring
+    except Exception as inst:
+        logging.warning("%s: %s", inst, datestring)
+        return None
+
 def augment_class(string):
     """
     Given a [string] representing the contents of a <main-classification> tag
@@ -0,0 +1,130 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Writes the log records of the parse from a background thread, so that the
+processes that parse and write the documents do not wait for the log file.
+Records are put on a queue as they are logged and the writer thread formats
+them and appends them to the log file in batches. Each process starts its
+own writer thread (and opens the file again) when it first logs, so the
+handler keeps working in the processes forked by multiprocessing.
+"""
+
+import os
+import Queue
+import logging
+import threading
+import multiprocessing
+import multiprocessing.util
+
+
+class QueueHandler(logging.Handler):
+    """
+    Logging handler that appends the records to [filename] from a writer
+    thread, up to [batch] records per write
+    """
+
+    def __init__(self, filename, batch=256):
+        logging.Handler.__init__(self)
+        self.filename = os.path.abspath(filename)
+        self.batch = batch
+        self.pid = None
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._write, name='log-writer')
+        self.thread.daemon = True
+        self.thread.start()
+        if multiprocessing.current_process().name != 'MainProcess':
+            # child processes leave through os._exit, which skips the
+            # logging.shutdown that flushes the handlers at exit
+            multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        self.queue.put(record)
+
+    def _write(self):
+        stream = open(self.filename, 'a')
+        while True:
+            records = [self.queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            lines = []
+            for record in records:
+                if record is None:
+                    continue
+                try:
+                    line = self.format(record) + '\n'
+                    lines.append(line.encode('utf-8') if isinstance(line, unicode) else line)
+                except Exception:
+                    self.handleError(record)
+            try:
+                stream.write(''.join(lines))
+                stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+            for record in records:
+                self.queue.task_done()
+            if None in records:
+                stream.close()
+                return
+
+    def flush(self):
+        """
+        Waits until the records logged by this process have been written
+        """
+        if self.pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.pid = None
+        logging.Handler.close(self)
+
+
+def configure(filename, level=logging.WARNING):
+    """
+    Sends the records of [level] and above logged through the root logger
+    to [filename] with a QueueHandler. Configuring the same file again only
+    changes the level. Returns the handler
+    """
+    root = logging.getLogger()
+    root.setLevel(level)
+    filename = os.path.abspath(filename)
+    for handler in root.handlers:
+        if isinstance(handler, QueueHandler) and handler.filename == filename:
+            return handler
+    handler = QueueHandler(filename)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.addHandler(handler)
+    return handler
@@ -0,0 +1,214 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Caches the patent objects parsed from each weekly USPTO file, so that the
+database can be reloaded after a change to the schema or the writers
+without parsing the XML again (see parse.py --from-cache).
+
+The objects parsed from ipg120327.xml (or ipg120327.zip) are stored in the
+cache directory as the segment ipg120327.xml.cache. A segment is a sequence
+of blocks, each a 4 byte big-endian length followed by a zlib compressed
+pickle. The first block is the header: the parse_manifest state of the file
+(its name, size, modification time and checksum, see
+parse.get_resume_point) and the version of the handler that parsed it
+(see handler_version). Each following block holds up to [block_size]
+(document hash, end offset, patent object) records in file order, so a
+segment is read sequentially, one block at a time. Segments are written to
+a temporary file that is renamed once the whole file has been parsed.
+"""
+
+import os
+import re
+import zlib
+import struct
+import hashlib
+import cPickle
+import splitter
+
+suffix = '.cache'
+magic = 'PCACHE1\n'
+block_size = 64
+_length = struct.Struct('>I')
+_versions = {}
+
+
+def segment_filename(directory, filename):
+    """
+    Returns the path of the segment for [filename] in the cache [directory]
+    """
+    return os.path.join(directory, splitter.xml_name(os.path.basename(filename)) + suffix)
+
+
+def list_segments(directory, xmlregex):
+    """
+    Returns the segments in the cache [directory] of the files whose XML
+    names match [xmlregex], in the order of their names
+    """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith(suffix) and re.search(xmlregex, name[:-len(suffix)], re.I)]
+
+
+def handler_version(handler):
+    """
+    Returns the version of the handler module [handler] that the cached
+    objects are keyed by: its name and a hash of the code in lib/handlers,
+    so that a change to any of the handlers invalidates the segments
+    """
+    if handler.__name__ not in _versions:
+        directory = os.path.dirname(os.path.abspath(handler.__file__))
+        md5 = hashlib.md5()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.py'):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    md5.update(f.read())
+        _versions[handler.__name__] = '{0}:{1}'.format(handler.__name__, md5.hexdigest())
+    return _versions[handler.__name__]
+
+
+def document_key(xml):
+    """
+    Returns the hash of the document [xml] (a string or buffer)
+    """
+    return hashlib.md5(xml).hexdigest()
+
+
+def _write_block(f, value):
+    data = zlib.compress(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+    f.write(_length.pack(len(data)))
+    f.write(data)
+
+
+def _read_blocks(f):
+    for position, value in _positioned_blocks(f):
+        yield value
+
+
+def _positioned_blocks(f):
+    while True:
+        position = f.tell()
+        length = f.read(_length.size)
+        if len(length) < _length.size:
+            return
+        yield position, cPickle.loads(zlib.decompress(f.read(_length.unpack(length)[0])))
+
+
+class SegmentWriter(object):
+    """
+    Writes the segment at [path] with the given [header] (see the module
+    docstring). The segment only replaces an existing one when it is closed
+    """
+
+    def __init__(self, path, header):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.file = open(path + '.part', 'wb')
+        self.file.write(magic)
+        _write_block(self.file, header)
+        self.records = []
+
+    def add(self, key, end, patobj):
+        self.records.append((key, end, patobj))
+        if len(self.records) == block_size:
+            _write_block(self.file, self.records)
+            self.records = []
+
+    def close(self):
+        if self.records:
+            _write_block(self.file, self.records)
+        self.file.close()
+        os.rename(self.path + '.part', self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path + '.part')
+
+
+def read_header(path):
+    """
+    Returns the header of the segment at [path], or None if there is none
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                return None
+            return next(_read_blocks(f), None)
+    except IOError:
+        return None
+
+
+def read_records(path):
+    """
+    Returns an iterator over the (document hash, end offset, patent object)
+    records of the segment at [path]
+    """
+    with open(path, 'rb') as f:
+        f.read(len(magic))
+        blocks = _read_blocks(f)
+        next(blocks, None)
+        for records in blocks:
+            for record in records:
+                yield record
+
+
+class SegmentIndex(object):
+    """
+    Looks up the records of the segment at [path] by document hash, wherever
+    they are in the file. Only the position of the block of each record is
+    held in memory, and the block of the last record looked up is kept, so
+    looking up documents in file order reads each block once more
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.file.read(len(magic))
+        self.positions = {}
+        blocks = _positioned_blocks(self.file)
+        next(blocks, None)
+        for position, records in blocks:
+            for key, end, patobj in records:
+                self.positions[key] = position
+        self.block = None, {}
+
+    def get(self, key):
+        """
+        Returns the (document hash, end offset, patent object) record of
+        [key], or None if the segment has no document with that hash
+        """
+        position = self.positions.get(key)
+        if position is None:
+            return None
+        if self.block[0] != position:
+            self.file.seek(position)
+            records = next(_read_blocks(self.file))
+            self.block = position, dict((record[0], record) for record in records)
+        return self.block[1][key]
+
+    def close(self):
+        self.file.close()
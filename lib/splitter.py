@@ -0,0 +1,222 @@
+"""
+Copyright (c) 2013 The Regents of the University of California, AMERICAN INSTITUTES FOR RESEARCH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""
+Locates the individual XML documents inside the weekly USPTO files, which
+are plain concatenations of complete XML documents. Each document ends on
+the line that closes the root element named by its DOCTYPE declaration.
+
+The weekly files may also be kept as downloaded, compressed with zip, gzip or
+bzip2, in which case they are decompressed as a stream while they are split
+and never written to disk. Offsets into a compressed file are offsets into
+its decompressed contents.
+"""
+
+import re
+import os
+import bz2
+import gzip
+import mmap
+import zipfile
+
+doctype_regex = re.compile(r'^<!DOCTYPE (.*) SYSTEM', re.M)
+compressed_suffixes = ('.zip', '.gz', '.bz2')
+# bytes decompressed at a time when streaming a compressed file
+chunksize = 1 << 22
+
+
+def open_mapped(filename):
+    """
+    Returns a read-only memory map of [filename]. Empty files cannot be
+    mapped, so an empty string is returned for them instead
+    """
+    with open(filename, 'rb') as f:
+        if not f.read(1):
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def document_ranges(buf, start=0):
+    """
+    Given a string or memory map [buf], returns a generator of (start, end)
+    byte offsets, one for each XML document in [buf] from offset [start] on.
+    A document starts where the previous one ended (so the <?xml ...?> prolog
+    is included) and ends after the line beginning with the closing tag of
+    its DOCTYPE root.
+    """
+    while True:
+        match = doctype_regex.search(buf, start)
+        if not match:
+            return
+        endtag = '\n</{0}>'.format(match.group(1))
+        end = buf.find(endtag, match.end())
+        if end < 0:
+            return
+        end = buf.find('\n', end + len(endtag))
+        end = len(buf) if end < 0 else end + 1
+        yield start, end
+        start = end
+
+
+def iter_documents(buf):
+    """
+    Given a string or memory map [buf], returns a generator of buffer objects,
+    one for each XML document in [buf]. The buffers reference [buf] directly
+    rather than copying the documents, and can be fed to the XML parser as-is
+    """
+    for start, end in document_ranges(buf):
+        yield buffer(buf, start, end - start)
+
+
+def is_compressed(filename):
+    """
+    Returns True if [filename] is a zip, gzip or bzip2 file
+    """
+    return filename.lower().endswith(compressed_suffixes)
+
+
+def xml_name(filename):
+    """
+    Returns the name of the XML file held in [filename], e.g. ipg120327.xml
+    for ipg120327.zip or ipg120327.xml.gz, and [filename] itself if it is not
+    compressed
+    """
+    root, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext == '.zip':
+        return root + '.xml'
+    if ext in compressed_suffixes:
+        return root
+    return filename
+
+
+def open_compressed(filename):
+    """
+    Returns a file object that reads the decompressed contents of
+    [filename]. For zip archives this is the first XML file in the archive
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.gz':
+        return gzip.open(filename, 'rb')
+    if ext == '.bz2':
+        return bz2.BZ2File(filename, 'rb')
+    archive = zipfile.ZipFile(filename)
+    names = [name for name in archive.namelist() if name.lower().endswith('.xml')]
+    return archive.open(names[0] if names else archive.namelist()[0])
+
+
+def skip(f, offset):
+    """
+    Reads and discards the first [offset] bytes of the file object [f].
+    Returns False if [f] ends first
+    """
+    while offset:
+        skipped = len(f.read(min(offset, chunksize)))
+        if not skipped:
+            return False
+        offset -= skipped
+    return True
+
+
+def stream_documents(f, offset=0):
+    """
+    Given a file object [f], returns a generator of (offset, document) tuples,
+    one for each XML document read from [f], where document is a string. Only
+    a chunk of [f] and the document being read are held in memory at a time.
+    [offset] is the position of [f] in the file it reads. The search for the
+    DOCTYPE and the closing tag of the document being read resumes where it
+    stopped in the previous chunk, so a document is scanned once however many
+    chunks it spans
+    """
+    buf = ''
+    start = 0       # where the document being read begins in buf
+    endtag = None   # its closing tag, once its DOCTYPE is found
+    scan = 0        # where the search for the DOCTYPE or closing tag resumes
+    done = False
+    while not done:
+        data = f.read(chunksize)
+        done = not data
+        buf += data
+        while True:
+            if endtag is None:
+                match = doctype_regex.search(buf, scan)
+                if not match:
+                    # the DOCTYPE line may continue into the next chunk
+                    scan = max(scan, buf.rfind('\n', scan))
+                    break
+                endtag = '\n</{0}>'.format(match.group(1))
+                scan = match.end()
+            end = buf.find(endtag, scan)
+            if end < 0:
+                scan = max(scan, len(buf) - len(endtag) + 1)
+                break
+            close = buf.find('\n', end + len(endtag))
+            if close < 0 and not done:
+                # the closing line may continue into the next chunk
+                scan = end
+                break
+            close = len(buf) if close < 0 else close + 1
+            yield offset + start, buf[start:close]
+            start = scan = close
+            endtag = None
+        buf = buf[start:]
+        offset += start
+        scan -= start
+        start = 0
+
+
+def file_documents(filename, offset=0):
+    """
+    Returns a generator of (offset, document) tuples, one for each XML
+    document in [filename] from [offset] on. Documents of plain files are
+    buffers into their memory map, those of compressed files are
+    decompressed strings
+    """
+    if is_compressed(filename):
+        f = open_compressed(filename)
+        try:
+            if skip(f, offset):
+                for item in stream_documents(f, offset):
+                    yield item
+        finally:
+            f.close()
+        return
+    buf = open_mapped(filename)
+    for start, end in document_ranges(buf, offset):
+        yield start, buffer(buf, start, end - start)
+
+
+def read_document(filename, offset, length):
+    """
+    Returns the [length] bytes at [offset] in [filename] (see file_documents)
+    as a buffer or, for compressed files, a string
+    """
+    if not is_compressed(filename):
+        return buffer(open_mapped(filename), offset, length)
+    f = open_compressed(filename)
+    try:
+        return f.read(length) if skip(f, offset) else ''
+    finally:
+        f.close()
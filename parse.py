@@ -42,24 +42,99 @@ import os
 import datetime
 import re
 import sys
+import hashlib
+import importlib
+import tempfile
+import multiprocessing
+import Queue
+import time
+import resource
 import lib.argconfig_parse as argconfig_parse
 import lib.alchemy as alchemy
+import lib.splitter as splitter
+import lib.document_index as document_index
+import lib.parse_cache as parse_cache
+import lib.fingerprint as fingerprint
+import lib.log_queue as log_queue
+import lib.alchemy.tsv as tsv
+import lib.alchemy.rows as rows
+import lib.handlers.xml_driver as xml_driver
 import shutil
-from lib.config_parser import get_xml_handlers
+from lib.config_parser import get_handler_registry
 from lib.alchemy.match import commit_inserts, commit_updates
 
 logfile = "./" + 'xml-parsing.log'
-logging.basicConfig(filename=logfile, level=logging.DEBUG)
+# the command line sets the level from --verbosity (see main), and start.py
+# from the loglevel of its parse section
+log_queue.configure(logfile)
 commit_frequency = alchemy.get_config().get('parse').get('commit_frequency')
+# also commit once the documents added since the last commit reach this many
+# megabytes of XML, however few they are; 0 for no limit
+commit_size = alchemy.get_config().get('parse').get('commit_size', 0)
+# XML parse engine used by the handlers, see lib/handlers/xml_driver.py
+xml_driver.set_engine(alchemy.get_config().get('parse').get('engine', 'sax'))
+# extract the patent objects through the handlers' compiled extraction plans,
+# which leave the elements that no field reads out of the tree (see
+# lib/handlers/extraction.py:Plan.extract)
+use_plans = alchemy.get_config().get('parse').get('extraction', 'handler') == 'plan'
+# write each commit's documents in one batch with a
+# lib.alchemy.upsert.BatchWriter instead of add_grant/add_application
+use_upsert = alchemy.get_config().get('parse').get('write', 'orm') == 'upsert'
+# number of parsed documents that may wait for the database writes when
+# parsing without workers, see pipeline; 0 parses and writes in turn
+queue_size = alchemy.get_config().get('parse').get('queue_size', 0)
+# the patent object attributes computed and the tables written for each
+# doctype, None for all of them (see set_projection)
+projections = {'grant': (None, None), 'application': (None, None)}
+# directory of the cached patent objects of each parsed file (see
+# lib/parse_cache.py and load_cache); None for no cache
+cache_directory = alchemy.get_config().get('parse').get('cache') or None
+
+
+def set_projection(attributes=None, tables=None):
+    """
+    Restricts the parse to the patent object [attributes] and the [tables]
+    given in process.cfg (lists of names, None for all of them), see
+    lib/alchemy/rows.py:projection. Raises ValueError for unknown names
+    """
+    for doctype in projections:
+        projections[doctype] = rows.projection(attributes, tables, doctype)
+
+
+def _projection_name(doctype='grant'):
+    """
+    Returns the projection of [doctype] (see set_projection) as recorded in
+    the parse_manifest table, or None if the documents are parsed in full
+    """
+    attributes, tables = projections[doctype]
+    if attributes is None:
+        return None
+    return u'attributes={0}; tables={1}'.format(','.join(sorted(attributes)), ','.join(sorted(tables)))
+
+
+def _covers(row, state):
+    """
+    Returns True if the parse_manifest [row] accounts for the parse
+    described by [state]: the same contents parsed by the same handler with
+    the same projection, or a complete parse without a projection, which
+    holds all of those of a projected one
+    """
+    return (row['hash'], row['handler']) == (state['hash'], state['handler']) and \
+        (row['projection'] == state['projection'] or (row['complete'] and row['projection'] is None))
 
 
 def list_files(patentroot, xmlregex):
     """
     Returns listing of all files within patentroot
-    whose filenames match xmlregex
+    whose filenames match xmlregex. Compressed files (see lib/splitter.py)
+    are matched by the name of the XML file they hold, so ipg120327.zip
+    matches ipg\d{6}.xml, and are skipped if that XML file is also present
     """
-    files = [patentroot+'/'+fi for fi in os.listdir(patentroot)
-             if re.search(xmlregex, fi, re.I) is not None]
+    names = [fi for fi in os.listdir(patentroot)
+             if re.search(xmlregex, splitter.xml_name(fi), re.I) is not None
+             and not fi.endswith(document_index.suffix)]
+    files = [patentroot+'/'+fi for fi in names
+             if not splitter.is_compressed(fi) or splitter.xml_name(fi) not in names]
     if not files:
         logging.error("No files matching {0} found in {1}".format(xmlregex, patentroot))
         sys.exit(1)
@@ -79,16 +154,21 @@ def _get_date(filename, dateformat='ipg%y%m%d.xml'):
     return int(dateobj.strftime('%Y%m%d'))  # returns YYYYMMDD
 
 
+def get_handlers(doctype='grant'):
+    """
+    Returns the handler registry (see lib/config_parser.py) for [doctype]
+    as configured in process.cfg. It is built once and shared by every
+    lookup in this process
+    """
+    return get_handler_registry('process.cfg', doctype)
+
+
 def _get_parser(date, doctype='grant'):
     """
     Given a [date], returns the class of parser needed
     to parse it
     """
-    xmlhandlers = get_xml_handlers('process.cfg', doctype)
-    for daterange in xmlhandlers.iterkeys():
-        if daterange[0] <= date <= daterange[1]:
-            return xmlhandlers[daterange]
-    return xmlhandlers['default']
+    return get_handlers(doctype).get(date)
 
 
 def extract_xml_strings(filename):
@@ -97,24 +177,280 @@ def extract_xml_strings(filename):
     that yields tuples. A tuple is of format (year, xmldoc string). A tuple
     is returned for every valid XML doc in [filename]
     """
-    # search for terminating XML tag
-    endtag_regex = re.compile('^<!DOCTYPE (.*) SYSTEM')
-    endtag = ''
-    with open(filename, 'r') as f:
-        doc = ''  # (re)initialize current XML doc to empty string
-        for line in f:
-            doc += line
-            endtag = endtag_regex.findall(line) if not endtag else endtag
-            if not endtag:
-                continue
-            terminate = re.compile('^</{0}>'.format(endtag[0]))
-            if terminate.findall(line):
-                yield (_get_date(filename), doc)
-                endtag = ''
-                doc = ''
+    date = _get_date(filename)
+    for offset, xml in splitter.file_documents(filename):
+        yield (date, str(xml))
+
+
+def index_files(filelist, doctype='grant'):
+    """
+    Builds the document index (see lib/document_index.py) of each file in
+    [filelist] that does not have an up to date one yet
+    """
+    get_handler = lambda filename: _get_parser(_get_date(filename), doctype)
+    return document_index.update_indexes(filelist, get_handler)
+
+
+def get_patent(number, patentroot, xmlregex, doctype='grant'):
+    """
+    Finds the document [number] in the files in [patentroot] matching
+    [xmlregex] through their document indexes (building any that are missing)
+    and returns its parsed patent object, or None if it is not found
+    """
+    files = list_files(patentroot, xmlregex)
+    index_files(files, doctype)
+    found = document_index.find_document(number, files)
+    if not found:
+        return None
+    filename, offset, length, handler = found
+    xml = splitter.read_document(filename, offset, length)
+    return extract(importlib.import_module(handler), xml)
+
+
+def load_patent(number, patentroot, xmlregex, doctype='grant'):
+    """
+    Parses the single document [number] (see get_patent) and commits it
+    to the database, replacing any existing copy
+    """
+    patobj = get_patent(number, patentroot, xmlregex, doctype)
+    if not patobj:
+        logging.error("Document {0} not found in {1}".format(number, patentroot))
+        sys.exit(1)
+    if doctype == 'grant':
+        alchemy.add_grant(patobj)
+        alchemy.commit()
+    else:
+        alchemy.add_application(patobj)
+        alchemy.commit_application()
+
+
+def _checksum(filename, chunksize=1 << 20):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_resume_point(filename, handler, doctype='grant', reparse=False):
+    """
+    Returns the parse_manifest state (see lib.alchemy.get_parse_state) from
+    which to parse [filename] with the handler module [handler], or None if
+    the file has already been parsed completely. A file whose size or
+    modification time differs from the manifest is hashed, and is only parsed
+    again from the start if its contents (or its handler) changed. A file
+    parsed under another projection (see set_projection) is parsed again,
+    unless it was parsed in full. If [reparse] is True, every file is hashed
+    instead of trusting its size and modification time
+    """
+    stat = os.stat(filename)
+    state = {'filename': unicode(os.path.basename(filename)), 'size': stat.st_size,
+             'mtime': int(stat.st_mtime), 'hash': None, 'handler': unicode(handler.__name__),
+             'projection': _projection_name(doctype), 'documents': 0, 'offset': 0, 'complete': False}
+    row = alchemy.get_parse_state(state['filename'], doctype)
+    stamped = row and (row['size'], row['mtime']) == (state['size'], state['mtime'])
+    state['hash'] = row['hash'] if stamped and not reparse else _checksum(filename)
+    if not row or not _covers(row, state):
+        return state
+    state.update(projection=row['projection'], documents=row['documents'], offset=row['offset'],
+                 complete=row['complete'])
+    if not stamped:
+        # same contents under a new modification time
+        alchemy.set_parse_state(state, doctype)
+        alchemy.commit() if doctype == 'grant' else alchemy.commit_application()
+    return None if state['complete'] else state
+
+
+def peak_memory():
+    """
+    Returns the peak resident set size of this process in megabytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _commit(commit, batch, state, doctype='grant'):
+    """
+    Writes [batch] (a lib.alchemy.upsert.BatchWriter, or None if the
+    documents were added one by one) and the parse progress [state] (see
+    get_resume_point), then commits them through [commit]. The committed
+    objects are removed from the session, so that it does not grow over
+    the run. If the commit fails, the documents and [state] are rolled back
+    together and a RuntimeError is raised, which stops the file (see
+    parse_files) with the parse_manifest still pointing at the last commit,
+    so that a later run resumes from there
+    """
+    if batch is not None:
+        alchemy.write_batch(batch, doctype)
+    alchemy.set_parse_state(state, doctype)
+    committed = commit()
+    # also after a rollback, which leaves the objects of the failed
+    # transaction in the session (see fetch_session)
+    session = alchemy.grantsession if doctype == 'grant' else alchemy.appsession
+    session.expunge_all()
+    if not committed:
+        if batch is not None:
+            # the shared rows may have been rolled back with the batch
+            batch.reset()
+        raise RuntimeError('Commit failed at document {0} of {1}'.format(state['documents'], state['filename']))
+
+
+def _produce(items, queue):
+    """
+    Body of the producer process of pipeline: puts each of [items] on
+    [queue], then the seconds it waited for room, or the exception raised
+    by [items]
+    """
+    # the items may read the database (see _screen), which this process
+    # cannot do through the connections of its parent
+    alchemy.reconnect('grant')
+    alchemy.reconnect('application')
+    stall = 0.0
+    try:
+        for item in items:
+            start = time.time()
+            queue.put(('item', item))
+            stall += time.time() - start
+    except Exception as e:
+        queue.put(('error', e))
+    else:
+        queue.put(('done', stall))
+    queue.close()
+
+
+def pipeline(items, size, metrics):
+    """
+    Iterates over [items], a generator that has not started yet, in a
+    separate process that keeps up to [size] of them queued ahead of the
+    caller, so that the documents are parsed while the caller writes and
+    commits the previous ones. An exception raised by [items] is raised
+    again in the caller once the items before it are consumed. [metrics] (a
+    dictionary) accumulates the number of items ('items'), their total and
+    maximum queue depth when taken ('depth', 'max_depth', None where the
+    platform cannot tell the size of a queue, e.g. Mac OS X), and the
+    seconds the producer waited for room in the queue ('producer_stall') and
+    the caller for items ('consumer_stall'). The producer is passed [items]
+    as is, which relies on the fork start method of Unix: a generator cannot
+    be pickled for a spawned process
+    """
+    for key in ['items', 'depth', 'max_depth', 'producer_stall', 'consumer_stall']:
+        metrics.setdefault(key, 0)
+    queue = multiprocessing.Queue(size)
+    producer = multiprocessing.Process(target=_produce, args=(items, queue))
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            start = time.time()
+            try:
+                depth = queue.qsize()
+            except NotImplementedError:
+                # sem_getvalue is not implemented on Mac OS X
+                depth = None
+            try:
+                kind, item = queue.get(timeout=1)
+            except Queue.Empty:
+                if producer.is_alive():
+                    continue
+                # the producer may have put its last message on its way out
+                try:
+                    kind, item = queue.get(timeout=1)
+                except Queue.Empty:
+                    raise RuntimeError('Parser process exited with code {0}'.format(producer.exitcode))
+            finally:
+                metrics['consumer_stall'] += time.time() - start
+            if kind == 'error':
+                raise item
+            if kind == 'done':
+                metrics['producer_stall'] += item
+                return
+            metrics['items'] += 1
+            if depth is None or metrics['depth'] is None:
+                metrics['depth'] = metrics['max_depth'] = None
+            else:
+                metrics['depth'] += depth
+                metrics['max_depth'] = max(metrics['max_depth'], depth)
+            yield item
+    finally:
+        if producer.is_alive():
+            producer.terminate()
+        producer.join()
+
+
+# session on the configured database that the documents are screened against
+# (see _screen) where it is not the one written to, in the workers of
+# parse_files_parallel
+_reference = None
+
+
+def _screen(filename, xml, handler, doctype='grant', lookup=True):
+    """
+    Fingerprints the document [xml] of [filename] (see lib/fingerprint.py).
+    Returns None for a document without a number, otherwise a tuple of its
+    status and its document_fingerprint row, which is recorded once the
+    document is committed (see _add_documents). If [lookup] is True, the
+    status tells whether the copy recorded by the same version of the
+    handler module [handler] (see parse_cache.handler_version) is
+    'unchanged', 'changed', or missing ('new'); otherwise it is None
+    """
+    found = fingerprint.document_fingerprint(xml)
+    if not found:
+        return None
+    number, digest = found
+    version = unicode(parse_cache.handler_version(handler))
+    row = {'number': unicode(number), 'hash': digest, 'handler': version,
+           'filename': unicode(os.path.basename(filename))}
+    if not lookup:
+        return None, row
+    known = alchemy.get_fingerprints([row['number']], doctype, _reference).get(row['number'])
+    if known is None:
+        return 'new', row
+    return 'unchanged' if known == (digest, version) else 'changed', row
+
+
+def _parse_document(filename, end, xml, handler, doctype='grant', lookup=None):
+    """
+    Returns the (end offset, patent object, fingerprint) tuple of the
+    document [xml] of [filename] that ends at [end], parsed with the handler
+    module [handler]. Unless [lookup] is None, the document is fingerprinted
+    (see _screen, which also describes [lookup]) and not parsed if it is
+    unchanged, in which case the object is None
+    """
+    screen = None if lookup is None else _screen(filename, xml, handler, doctype, lookup)
+    if screen and screen[0] == 'unchanged':
+        return end, None, screen
+    return end, parse_patent((_get_date(filename), xml), doctype, handler), screen
+
+
+def _log_fingerprints(filename, counts):
+    """
+    Logs the number of documents of [filename] skipped as
+    unchanged, changed and new (see _screen)
+    """
+    if not counts:
+        return
+    counts = dict({'unchanged': 0, 'changed': 0, 'new': 0}, **counts)
+    message = "{unchanged} unchanged documents skipped, {changed} changed, {new} new".format(**counts)
+    logging.info("%s - %s", filename, message)
+
+
+def _log_metrics(filename, metrics):
+    """
+    Logs the queue [metrics] of the pipeline (see pipeline) that
+    parsed [filename]
+    """
+    if not metrics.get('items'):
+        return
+    if metrics['depth'] is None:
+        depth = "queue depth unavailable"
+    else:
+        depth = "queue depth {0:.1f} (max {1})".format(metrics['depth'] / float(metrics['items']),
+                                                      metrics['max_depth'])
+    message = "{0}, parser stalled {1:.1f}s, writer stalled {2:.1f}s"\
+              .format(depth, metrics['producer_stall'], metrics['consumer_stall'])
+    logging.info("%s - %s", filename, message)
 
 
-def parse_files(filelist, doctype='grant'):
+def parse_files(filelist, doctype='grant', workers=1, writer=None, reparse=False):
     """
     Takes in a list of patent file names (from __main__() and start.py) and commits
     them to the database. This method is designed to be used sequentially to
@@ -122,45 +458,413 @@ def parse_files(filelist, doctype='grant'):
     determines the frequency with which we commit the objects to the database.
     If set to 0, it will commit after all patobjects have been added.  Setting
     `commit_frequency` to be low (but not 0) is helpful for low memory machines.
+    Since documents with many claims or citations take much more memory than
+    others, `commit_size` also bounds the megabytes of XML per commit.
+    If [workers] is greater than 1, the files are parsed by that many
+    processes instead: when there are at least as many files as workers, the
+    files are split between them (see parse_files_parallel), otherwise the
+    documents of each file are spread across the workers (see parse_documents)
+    If a [writer] (see lib/alchemy/tsv.py) is given, the objects are added to
+    it instead of the database
+    Documents published unchanged in a file parsed before (a correction or
+    reprint in a later weekly file) are not parsed or written again: each
+    one is fingerprinted and looked up in the document_fingerprint table as
+    it is parsed (see _screen). The fingerprints of the documents parsed are
+    recorded at every commit, unless the parse is restricted to some of
+    the attributes and tables (see set_projection)
+    Progress through each file is recorded in the parse_manifest table at
+    every commit, so that files parsed before are skipped and a file whose
+    parse was interrupted is resumed after its last commit (see
+    get_resume_point, which also describes [reparse])
+    With a queue_size, the documents of each file are parsed in a separate
+    process while they are written (see pipeline); with [workers], the pool
+    already parses ahead of the writes
+    With a cache_directory, the objects are read from the segment of each
+    file in the cache, or written to a new one as they are parsed (see
+    _cached_documents), except by a pool, which bypasses the cache for the
+    files not in it
     """
     if not filelist:
         return
-    commit = alchemy.commit
+    if workers > 1 and len(filelist) >= workers and not writer:
+        return parse_files_parallel(filelist, doctype, workers, reparse)
+    # the workers look the documents up in the database (see _screen)
+    pool = multiprocessing.Pool(workers, alchemy.reconnect, (doctype,)) if workers > 1 else None
+    batch = alchemy.batch_writer(doctype, projections[doctype][1]) if use_upsert else None
+    # only whole patent objects are cached
+    cached = cache_directory and projections[doctype][0] is None
     for filename in filelist:
-        print filename
-        for i, xmltuple in enumerate(extract_xml_strings(filename)):
-            patobj = parse_patent(xmltuple, doctype)
-            if doctype == 'grant':
-                alchemy.add_grant(patobj)
-                commit = alchemy.commit
+        handler = _get_parser(_get_date(filename), doctype)
+        state = None if writer else get_resume_point(filename, handler, doctype, reparse)
+        if not (writer or state):
+            print filename, "(already parsed)"
+            continue
+        offset = state['offset'] if state else 0
+        if offset:
+            print filename, "(resuming after {0} documents)".format(state['documents'])
+        else:
+            print filename
+        # no document is skipped as unchanged if the file was parsed before
+        # by another handler
+        lookup = None
+        if not writer:
+            row = alchemy.get_parse_state(unicode(os.path.basename(filename)), doctype, _reference)
+            lookup = not reparse and not (row and row['handler'] != handler.__name__)
+        filehash = None
+        if cached:
+            filehash = state['hash'] if state else _checksum(filename)
+        if cached and (not pool or _cache_hit(filename, handler, filehash)):
+            patobjs = _cached_documents(filename, doctype, handler, filehash, offset, lookup)
+        elif pool:
+            if cached:
+                # the pool does not parse the unchanged documents (see
+                # _screen), which a segment must hold
+                logging.warning("%s - cache bypassed: not written when the documents are parsed by a pool",
+                                filename)
+            patobjs = parse_documents(filename, doctype, pool, offset, lookup)
+        else:
+            patobjs = (_parse_document(filename, start + len(xml), xml, handler, doctype, lookup)
+                       for start, xml in splitter.file_documents(filename, offset))
+        metrics = {}
+        counts = {}
+        # not in the workers of parse_files_parallel, which are parallel
+        # already and cannot start processes of their own
+        piped = queue_size and not pool and not multiprocessing.current_process().daemon
+        if piped:
+            patobjs = pipeline(patobjs, queue_size, metrics)
+        try:
+            _add_documents(filename, patobjs, state, doctype, writer, batch, counts)
+        except RuntimeError as inst:
+            # a failed commit (see _commit) only stops this file, whose
+            # manifest still points at its last commit
+            logging.error("%s - %s", filename, inst)
+            continue
+        finally:
+            if piped:
+                patobjs.close()
+        _log_fingerprints(filename, counts)
+        _log_metrics(filename, metrics)
+    if pool:
+        pool.close()
+        pool.join()
+
+
+def _add_documents(filename, patobjs, state, doctype='grant', writer=None, batch=None, counts=None):
+    """
+    Adds the (end offset, patent object, fingerprint) tuples of [patobjs]
+    from [filename] to [writer], or else to the database (through [batch] if
+    given, see parse_files), recording the parse progress in [state] and the
+    fingerprints of the documents added (see _screen) at every commit.
+    [counts] (a dictionary) accumulates the number of documents of each
+    fingerprint status
+    """
+    commit = alchemy.commit if doctype == 'grant' else alchemy.commit_application
+    tables = projections[doctype][1]
+    # under a projection the documents are only written in part, so a later
+    # full parse must not take them for unchanged
+    record = projections[doctype][0] is None
+    committed = state['offset'] if state else 0
+    fingerprints = []
+    for end, patobj, screen in patobjs:
+        if screen and screen[0] and counts is not None:
+            counts[screen[0]] = counts.get(screen[0], 0) + 1
+        if writer:
+            if patobj:
+                writer.add(patobj)
+            continue
+        state['documents'] += 1
+        state['offset'] = end
+        # no object if skipped as unchanged (see _screen), or if the document
+        # failed to parse, which is then parsed again where it is republished
+        if patobj:
+            if screen and record:
+                fingerprints.append(screen[1])
+            if batch is not None:
+                batch.add(patobj)
+            elif doctype == 'grant':
+                alchemy.add_grant(patobj, tables=tables)
+            else:
+                alchemy.add_application(patobj, tables=tables)
+        if (commit_frequency and state['documents'] % commit_frequency == 0) or \
+           (commit_size and end - committed >= commit_size * 1048576):
+            alchemy.set_fingerprints(fingerprints, doctype)
+            fingerprints = []
+            _commit(commit, batch, state, doctype)
+            committed = end
+            logging.info("%s - %s - %s - peak memory %.0fMB",
+                         filename, state['documents'], datetime.datetime.now(), peak_memory())
+    if state:
+        state['complete'] = True
+        alchemy.set_fingerprints(fingerprints, doctype)
+        _commit(commit, batch, state, doctype)
+    logging.info("%s - Complete - %s - peak memory %.0fMB", filename, datetime.datetime.now(), peak_memory())
+
+
+def _cache_hit(filename, handler, filehash):
+    """
+    Returns True if the cache holds the objects parsed from [filename], whose
+    checksum is [filehash], by the current version of the handler module
+    [handler]
+    """
+    header = parse_cache.read_header(parse_cache.segment_filename(cache_directory, filename))
+    return bool(header) and header['version'] == parse_cache.handler_version(handler) \
+        and header['state']['hash'] == filehash
+
+
+def _cached_documents(filename, doctype, handler, filehash, offset=0, lookup=None):
+    """
+    Returns the (end offset, patent object, fingerprint) tuples of the
+    documents in [filename] from [offset] on, like _parse_document, through
+    the cache: from its segment for the file if there is an up to date one
+    (see _cache_hit), without reading the XML, and so without fingerprints,
+    as load_cache. Otherwise the documents are parsed and a new segment is
+    written, reusing the cached object of each document whose hash is found
+    in the previous segment (see parse_cache.SegmentIndex). The documents
+    found unchanged (see _screen, which also describes [lookup]) come out as
+    None, but are still parsed into the segment so that it holds the whole
+    file
+    """
+    path = parse_cache.segment_filename(cache_directory, filename)
+    if _cache_hit(filename, handler, filehash):
+        for key, end, patobj in parse_cache.read_records(path):
+            if end > offset:
+                yield end, patobj, None
+        return
+    version = parse_cache.handler_version(handler)
+    header = parse_cache.read_header(path)
+    previous = None
+    if header and header['version'] == version and not offset:
+        previous = parse_cache.SegmentIndex(path)
+    segment = None
+    if not offset:
+        stat = os.stat(filename)
+        state = {'filename': unicode(os.path.basename(filename)), 'size': stat.st_size,
+                 'mtime': int(stat.st_mtime), 'hash': filehash, 'handler': unicode(handler.__name__)}
+        segment = parse_cache.SegmentWriter(path, {'state': state, 'version': version})
+    date = _get_date(filename)
+    try:
+        for start, xml in splitter.file_documents(filename, offset):
+            key = parse_cache.document_key(xml)
+            record = previous.get(key) if previous else None
+            if record:
+                patobj = record[2]
             else:
-                alchemy.add_application(patobj)
-                commit = alchemy.commit_application
-            if commit_frequency and ((i+1) % commit_frequency == 0):
-                commit()
-                logging.info("{0} - {1} - {2}".format(filename, (i+1), datetime.datetime.now()))
-                print " *", (i+1), datetime.datetime.now()
-        commit()
-        print " *", "Complete", datetime.datetime.now()
+                patobj = parse_patent((date, xml), doctype, handler)
+            if segment:
+                segment.add(key, start + len(xml), patobj)
+            screen = None if lookup is None else _screen(filename, xml, handler, doctype, lookup)
+            yield start + len(xml), None if screen and screen[0] == 'unchanged' else patobj, screen
+    except:
+        if segment:
+            segment.abort()
+        raise
+    finally:
+        if previous:
+            previous.close()
+    if segment:
+        segment.close()
+
+
+def load_cache(xmlregex, doctype='grant', reparse=False):
+    """
+    Reloads the database from the segments in the cache directory of the
+    files matching [xmlregex] instead of parsing their XML, which need not be
+    present. Segments of other handler versions are skipped. As with
+    parse_files, files recorded in the parse_manifest table as parsed from
+    the same contents are skipped unless [reparse] is True, and interrupted
+    ones are resumed
+    """
+    batch = alchemy.batch_writer(doctype, projections[doctype][1]) if use_upsert else None
+    for path in parse_cache.list_segments(cache_directory, xmlregex):
+        header = parse_cache.read_header(path)
+        filename = header['state']['filename']
+        handler = _get_parser(_get_date(filename), doctype)
+        if header['version'] != parse_cache.handler_version(handler):
+            print path, "(parsed by another version of {0}, skipped)".format(handler.__name__)
+            continue
+        state = dict(header['state'], projection=_projection_name(doctype), documents=0, offset=0,
+                     complete=False)
+        row = alchemy.get_parse_state(filename, doctype)
+        if row and not reparse and _covers(row, state):
+            if row['complete']:
+                print path, "(already parsed)"
+                continue
+            state.update(documents=row['documents'], offset=row['offset'])
+        print path
+        patobjs = ((end, patobj, None) for key, end, patobj in parse_cache.read_records(path)
+                   if end > state['offset'])
+        _add_documents(filename, patobjs, state, doctype, batch=batch)
+
+
+# memory maps and handlers of the files being parsed by parse_documents,
+# per worker process
+_mapped_files = {}
+
+
+def _parse_range(args):
+    """
+    Worker for parse_documents. Parses the document found between the byte
+    offsets given in [args] (see _parse_document). The file is mapped and
+    its handler looked up once per worker process
+    """
+    filename, start, end, doctype, lookup = args
+    if filename not in _mapped_files:
+        _mapped_files.clear()
+        _mapped_files[filename] = (splitter.open_mapped(filename),
+                                   _get_parser(_get_date(filename), doctype))
+    buf, handler = _mapped_files[filename]
+    xml = buffer(buf, start, end - start)
+    return _parse_document(filename, end, xml, handler, doctype, lookup)
+
+
+def _parse_string(args):
+    """
+    Worker for parse_documents on compressed files. Parses the document
+    string given in [args] (see _parse_document)
+    """
+    filename, end, xml, doctype, lookup = args
+    return _parse_document(filename, end, xml, _get_parser(_get_date(filename), doctype), doctype, lookup)
+
+
+def _parse_stream(filename, doctype, pool, offset=0, lookup=None, batch=1024):
+    """
+    Streams the documents out of the compressed [filename] and hands them to
+    [pool] [batch] documents at a time, so that only one batch of the
+    decompressed file is held in memory
+    """
+    tasks = []
+    for start, xml in splitter.file_documents(filename, offset):
+        end = start + len(xml)
+        tasks.append((filename, end, xml, doctype, lookup))
+        if len(tasks) == batch:
+            for patobj in pool.imap(_parse_string, tasks, chunksize=16):
+                yield patobj
+            tasks = []
+    for patobj in pool.imap(_parse_string, tasks, chunksize=16):
+        yield patobj
+
+
+def parse_documents(filename, doctype='grant', pool=None, offset=0, lookup=None):
+    """
+    Maps [filename] into memory, finds the byte range of every document in it
+    from [offset] on and hands the ranges to the multiprocessing [pool], which
+    fingerprints and parses them (see _parse_document, which also describes
+    [lookup]). Returns an iterator over (end offset, parsed object,
+    fingerprint) tuples in the same order as the documents appear in the
+    file. Compressed files cannot be mapped, so their documents are sent to
+    the pool as strings instead
+    """
+    if splitter.is_compressed(filename):
+        return _parse_stream(filename, doctype, pool, offset, lookup)
+    buf = splitter.open_mapped(filename)
+    tasks = [(filename, start, end, doctype, lookup)
+             for start, end in splitter.document_ranges(buf, offset)]
+    if buf:
+        buf.close()
+    return pool.imap(_parse_range, tasks, chunksize=16)
+
+
+def _partition(filelist, n):
+    """
+    Splits [filelist] into at most [n] contiguous chunks of roughly equal
+    size in bytes. The chunks keep the order of [filelist] so that later
+    files still override earlier ones when the shards are merged
+    """
+    sizes = [os.path.getsize(filename) for filename in filelist]
+    target = sum(sizes) / float(n)
+    chunks = [[]]
+    total = 0
+    for filename, size in zip(filelist, sizes):
+        if chunks[-1] and total >= target * len(chunks) and len(chunks) < n:
+            chunks.append([])
+        chunks[-1].append(filename)
+        total += size
+    return chunks
+
+
+def _parse_shard(args):
+    """
+    Worker for parse_files_parallel. Parses the files in [args] into the
+    private shard database, screening their documents against the
+    configured database (see _screen), and returns the shard's filename
+    """
+    global _reference
+    shardfile, filelist, doctype, reparse = args
+    alchemy.reconnect(doctype)
+    _reference = alchemy.grantsession if doctype == 'grant' else alchemy.appsession
+    alchemy.bind_shard(shardfile, doctype)
+    parse_files(filelist, doctype, reparse=reparse)
+    return shardfile
 
 
-def parse_patent(xmltuple, doctype='grant'):
+def parse_files_parallel(filelist, doctype='grant', workers=2, reparse=False):
+    """
+    Parses [filelist] with [workers] processes. Each process parses a
+    contiguous subset of the files into its own SQLite shard, and the shards
+    are then merged into the configured database in file order (see
+    lib.alchemy.merge_shard), which also deduplicates the shared
+    rawlocation, mainclass and subclass rows.
+    Files that have been parsed completely before are skipped (see
+    get_resume_point); partially parsed files are parsed again from the start.
+    The workers' shards have no fingerprints, so the workers look the
+    documents up in the configured database instead
+    """
+    pending = [filename for filename in filelist
+               if get_resume_point(filename, _get_parser(_get_date(filename), doctype), doctype, reparse)]
+    for filename in sorted(set(filelist) - set(pending)):
+        print filename, "(already parsed)"
+    if not pending:
+        return
+    chunks = _partition(pending, workers)
+    sharddir = tempfile.mkdtemp(prefix='shards-', dir='.')
+    tasks = [(os.path.join(sharddir, '{0}-{1}.db'.format(doctype, i)), chunk, doctype, reparse)
+             for i, chunk in enumerate(chunks)]
+    # a process per chunk, forked from this one with its session on the
+    # configured database (see _parse_shard)
+    pool = multiprocessing.Pool(len(tasks), maxtasksperchild=1)
+    try:
+        shards = pool.map(_parse_shard, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    for shardfile in shards:
+        print " * Merging", shardfile, datetime.datetime.now()
+        alchemy.merge_shard(shardfile, doctype)
+    shutil.rmtree(sharddir)
+    print " *", "Merged", len(shards), "shards", datetime.datetime.now()
+
+
+def extract(handler, xml, attributes=None):
+    """
+    Returns the patent object for the document [xml] (a string or buffer)
+    from the handler module [handler], through its extraction plan if
+    plans are enabled and the handler has one. If [attributes] is given,
+    the others are left empty
+    """
+    if use_plans and hasattr(handler, 'plan'):
+        return handler.plan.extract(xml, True, attributes)
+    return handler.Patent(xml, True).get_patobj(attributes)
+
+
+def parse_patent(xmltuple, doctype='grant', handler=None):
     """
     Parses an xml string given as [xmltuple] with the appropriate parser (given
     by the first part of the tuple). Returns list of objects
-    to be inserted into the database using SQLAlchemy
+    to be inserted into the database using SQLAlchemy.
+    [handler] can be given to skip the lookup when the caller has already
+    resolved the parser for the file the document comes from
     """
     if not xmltuple:
         return
     try:
         date, xml = xmltuple  # extract out the parts of the tuple
-        patent = _get_parser(date, doctype).Patent(xml, True)
+        patobj = extract(handler or _get_parser(date, doctype), xml, projections[doctype][0])
     except Exception as inst:
         logging.error(inst)
-        logging.error("  - Error parsing patent: %s" % (xml[:400]))
+        logging.error("  - Error parsing patent: %s", xml[:400])
         return
     del xmltuple
-    return patent.get_patobj()
+    return patobj
 
 
 def move_tables(output_directory):
@@ -189,15 +893,47 @@ def mark_granted():
     appsession = appsessiongen()
     bulk_commit_updates('granted', granted_apps, alchemy.schema.App_Application.__table__, alchemy.is_mysql(), 20000, 'application')
 
-def main(patentroot, xmlregex, verbosity, output_directory='.', doctype='grant'):
-    logfile = "./" + 'xml-parsing.log'
-    logging.basicConfig(filename=logfile, level=verbosity)
+def emit_tsv(filelist, directory, doctype='grant', workers=1):
+    """
+    Parses [filelist] into one tab separated file per table in [directory]
+    (see lib/alchemy/tsv.py) instead of the database
+    """
+    writer = tsv.TSVWriter(directory, doctype, projections[doctype][1])
+    try:
+        parse_files(filelist, doctype, workers, writer)
+    finally:
+        counts = writer.close()
+    for table, count in sorted(counts.items()):
+        logging.info("%s: %s rows", table, count)
+    print " *", "Wrote", sum(counts.values()), "rows to", directory, datetime.datetime.now()
 
-    logging.info("Starting parse on {0} on directory {1}".format(str(datetime.datetime.today()), patentroot))
-    files = list_files(patentroot, xmlregex)
 
-    logging.info("Found all files matching {0} in directory {1}".format(xmlregex, patentroot))
-    parse_files(files, doctype)
+def load_tsv(directory, doctype='grant'):
+    """
+    Loads the files written by emit_tsv in [directory] into the database
+    """
+    session = alchemy.grantsession if doctype == 'grant' else alchemy.appsession
+    counts = tsv.load_tsv(directory, session, doctype)
+    print " *", "Loaded", sum(counts.values()), "rows from", directory, datetime.datetime.now()
+
+
+def main(patentroot, xmlregex, verbosity, output_directory='.', doctype='grant', workers=1,
+         emit='db', out='tsv', reparse=False, from_cache=False):
+    log_queue.configure(logfile, verbosity)
+
+    if from_cache:
+        logging.info("Loading {0} from {1}".format(xmlregex, cache_directory))
+        load_cache(xmlregex, doctype, reparse)
+    else:
+        logging.info("Starting parse on {0} on directory {1}".format(str(datetime.datetime.today()), patentroot))
+        files = list_files(patentroot, xmlregex)
+
+        logging.info("Found all files matching {0} in directory {1}".format(xmlregex, patentroot))
+        if emit == 'tsv':
+            emit_tsv(files, out, doctype, workers)
+            logging.info("Parse completed at {0}".format(str(datetime.datetime.today())))
+            return
+        parse_files(files, doctype, workers, reparse=reparse)
     move_tables(output_directory)
 
     logging.info("SQL tables moved to {0}".format(output_directory))
@@ -215,5 +951,25 @@ if __name__ == '__main__':
     VERBOSITY = args.get_verbosity()
     PATENTOUTPUTDIR = args.get_output_directory()
     DOCUMENTTYPE = args.get_document_type()
+    WORKERS = args.get_workers()
+    PATENT = args.get_patent()
+    EMIT = args.get_emit()
+    OUT = args.get_out()
+    LOADTSV = args.get_load_tsv()
+    REPARSE = args.get_reparse()
+    if args.get_cache():
+        cache_directory = args.get_cache()
+    FROMCACHE = args.get_from_cache()
+    if FROMCACHE and not cache_directory:
+        print 'Specify the cache directory with --cache or in lib/alchemy/config.ini'
+        sys.exit(1)
 
-    main(PATENTROOT, XMLREGEX, VERBOSITY, PATENTOUTPUTDIR, DOCUMENTTYPE)
+    # also for the paths that do not go through main
+    log_queue.configure(logfile, VERBOSITY)
+    if PATENT:
+        load_patent(PATENT, PATENTROOT, XMLREGEX, DOCUMENTTYPE)
+    elif LOADTSV:
+        load_tsv(LOADTSV, DOCUMENTTYPE)
+    else:
+        main(PATENTROOT, XMLREGEX, VERBOSITY, PATENTOUTPUTDIR, DOCUMENTTYPE, WORKERS, EMIT, OUT, REPARSE,
+             FROMCACHE)
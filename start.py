@@ -34,17 +34,18 @@ import time
 import itertools
 import datetime
 import logging
-import requests
-import zipfile
-import cStringIO as StringIO
-from bs4 import BeautifulSoup as bs
+import multiprocessing
 import lib.alchemy as alchemy
+import lib.splitter as splitter
+import lib.log_queue as log_queue
 
 sys.path.append('lib')
+import downloader
 from config_parser import get_config_options
 
 logfile = "./" + 'xml-parsing.log'
-logging.basicConfig(filename=logfile, level=logging.DEBUG)
+# the parses log at the 'loglevel' of their parse section, see run_parse
+log_queue.configure(logfile)
 
 def get_year_list(yearstring):
     """
@@ -69,72 +70,141 @@ def get_year_list(yearstring):
 def generate_download_list(years, doctype='grant'):
     """
     Given the year string from the configuration file, return
-    a list of urls to be downloaded
-    """
-    if not years: return []
-    urls = []
-    link = 'https://www.google.com/googlebooks/uspto-patents-grants-text.html'
-    if doctype == 'application':
-        link = 'https://www.google.com/googlebooks/uspto-patents-applications-text.html'
-    url = requests.get(link)
-    soup = bs(url.content)
-    years = get_year_list(years)
-
-    # latest file link
-    if 'latest' in years:
-        a = soup.h3.findNext('h3').findPrevious('a')
-        urls.append(a['href'])
-        years.remove('latest')
-    # get year links
-    for year in years:
-        header = soup.find('h3', {'id': str(year)})
-        a = header.findNext()
-        while a.name != 'h3':
-            urls.append(a['href'])
-            a = a.findNext()
+    a list of urls to be downloaded. The listing of the download page is
+    cached in the manifest in [downloaddir] (see lib/downloader.py)
+    """
+    if not (years and downloaddir): return []
+    manifest = downloader.load_manifest(downloaddir)
+    urls = downloader.get_download_list(get_year_list(years), doctype, manifest)
+    downloader.save_manifest(downloaddir, manifest)
     return urls
 
-def download_files(urls):
+def download_files(urls, workers=4, callback=None):
     """
     [downloaddir]: string representing base download directory. Will download
     files to this directory in folders named for each year
+    The zip files are kept as downloaded; parse.py reads the XML straight out
+    of them (see lib/splitter.py). [workers] files are downloaded at a time
+    and [callback] is called with the path of each file as it becomes
+    available (see lib/downloader.py)
     Returns: False if files were not downloaded or if there was some error,
     True otherwise
     """
-    import os
-    import requests
-    import zipfile
-    import cStringIO as StringIO
     if not (downloaddir and urls): return False
-    complete = True
     print 'downloading to',downloaddir
-    for url in urls:
-        filename = url.split('/')[-1].replace('zip','xml')
-        if filename in os.listdir(downloaddir):
-            print 'already have',filename
-            continue
-        print 'downloading',url
-        try:
-            r = requests.get(url)
-            z = zipfile.ZipFile(StringIO.StringIO(r.content))
-            print 'unzipping',filename
-            z.extractall(downloaddir)
-        except:
-            print 'ERROR: downloading or unzipping',filename
-            complete = False
-            continue
-    return complete
+    return downloader.download_files(urls, downloaddir, workers, callback=callback)
 
-def run_parse(files, doctype='grant'):
+def run_parse(files, doctype='grant', workers=1, attributes=None, tables=None, loglevel=logging.WARNING):
     import parse
     import time
     import sys
     import itertools
     import lib.alchemy as alchemy
-    import logging
-    logfile = "./" + 'xml-parsing.log'
-    logging.basicConfig(filename=logfile, level=logging.DEBUG)
-    parse.parse_files(files, doctype)
+    log_queue.configure(logfile, loglevel)
+    parse.set_projection(attributes, tables)
+    parse.parse_files(files, doctype, workers)
+
+def parse_doctype(doctype, parse_config):
+    """
+    Finds the files of [doctype] in the data directory of [parse_config],
+    indexes them if they were downloaded, and parses them
+    """
+    s = datetime.datetime.now()
+    regex = parse_config['{0}regex'.format(doctype)]
+    files = parse.list_files(parse_config['datadir'], regex)
+    if downloaddir:
+        print 'Indexed {0} new files'.format(parse.index_files(files, doctype))
+    print 'Running {0} parse...'.format(doctype)
+    run_parse(files, doctype, parse_config['workers'],
+              parse_config['attributes'], parse_config['tables'], parse_config['loglevel'])
+    print "Found {2} files matching {0} in directory {1}"\
+            .format(regex, parse_config['datadir'], len(files))
+    print 'Finished {0} parse in {1}'.format(doctype, str(datetime.datetime.now()-s))
+
+def stream_doctype(doctype, parse_config, queue):
+    """
+    Parses the files of [doctype] put on [queue] one at a time as their
+    downloads complete, until None is put on it, and then the rest of the
+    files in the data directory (see parse_doctype), skipping the ones parsed
+    already as recorded in the parse manifest
+    """
+    regex = parse_config['{0}regex'.format(doctype)]
+    for filename in iter(queue.get, None):
+        if re.search(regex, splitter.xml_name(os.path.basename(filename)), re.I) is None:
+            continue
+        print 'Running {0} parse of {1}'.format(doctype, filename)
+        parse.index_files([filename], doctype)
+        run_parse([filename], doctype, parse_config['workers'],
+                  parse_config['attributes'], parse_config['tables'], parse_config['loglevel'])
+    parse_doctype(doctype, parse_config)
+
+def start_parses(doctypes, parse_config, queues=None):
+    """
+    Starts a process running parse_doctype for each of [doctypes], or
+    stream_doctype on the queue for the doctype in [queues] if given. Returns
+    the (doctype, process) pairs
+    """
+    processes = []
+    for doctype in doctypes:
+        if queues:
+            target, args = stream_doctype, (doctype, parse_config, queues[doctype])
+        else:
+            target, args = parse_doctype, (doctype, parse_config)
+        process = multiprocessing.Process(target=target, args=args,
+                                          name='{0}-parse'.format(doctype))
+        process.start()
+        processes.append((doctype, process))
+    return processes
+
+def join_parses(processes):
+    """
+    Waits for the parse [processes] started by start_parses, reporting how
+    each one ended. Returns True if every parse succeeded
+    """
+    failed = []
+    for doctype, process in processes:
+        process.join()
+        if process.exitcode:
+            failed.append(doctype)
+        print '{0} parse {1} (exit code {2})'.format(
+            doctype, 'failed' if process.exitcode else 'succeeded', process.exitcode)
+    return not failed
+
+def run_parses(doctypes, parse_config):
+    """
+    Runs parse_doctype for each of [doctypes]. Grants and applications are
+    written to different databases, so when there are both they are parsed
+    at the same time by separate processes, each with the configured number
+    of workers. Returns True if every parse succeeded
+    """
+    if len(doctypes) == 1:
+        parse_doctype(doctypes[0], parse_config)
+        return True
+    return join_parses(start_parses(doctypes, parse_config))
+
+def stream_parses(doctypes, parse_config, urls):
+    """
+    Downloads [urls] (a dictionary of the urls of each of [doctypes]) while
+    a process per doctype parses each file as soon as it is available (see
+    stream_doctype). The parse processes are started before the download
+    threads. Returns True if every parse succeeded
+    """
+    queues = dict((doctype, multiprocessing.Queue()) for doctype in doctypes)
+    doctype_of = {}
+    for doctype in doctypes:
+        for url in urls[doctype]:
+            doctype_of[os.path.splitext(url.split('/')[-1])[0]] = doctype
+    processes = start_parses(doctypes, parse_config, queues)
+    def enqueue(path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        queues[doctype_of[name]].put(path)
+    try:
+        download_files([url for doctype in doctypes for url in urls[doctype]],
+                       parse_config['downloadworkers'], enqueue)
+    finally:
+        for queue in queues.values():
+            queue.put(None)
+    return join_parses(processes)
 
 def run_clean(process_config):
     if not process_config['clean']:
@@ -161,38 +231,44 @@ if __name__=='__main__':
     doctype = process_config['doctype']
 
     # download the files to be parsed
-    urls = []
+    urls = {}
     should_process_grants = doctype in ['all', 'grant']
     should_process_applications = doctype in ['all', 'application']
+    # load the xml handlers up front so that a bad handler configuration
+    # fails before anything is downloaded
     if should_process_grants:
-        urls += generate_download_list(parse_config['years'], 'grant')
+        parse.get_handlers('grant')
     if should_process_applications:
-        urls += generate_download_list(parse_config['years'], 'application')
+        parse.get_handlers('application')
     downloaddir = parse_config['downloaddir']
     if downloaddir and not os.path.exists(downloaddir):
         os.makedirs(downloaddir)
-    print 'Downloading files at {0}'.format(str(datetime.datetime.today()))
-    download_files(urls)
-    print 'Downloaded files:',parse_config['years']
-    f = datetime.datetime.now()
-    print 'Finished downloading in {0}'.format(str(f-s))
-
-    # find files
-    print "Starting parse on {0} on directory {1}".format(str(datetime.datetime.today()),parse_config['datadir'])
+    doctypes = []
     if should_process_grants:
-        files = parse.list_files(parse_config['datadir'],parse_config['grantregex'])
-        print 'Running grant parse...'
-        run_parse(files, 'grant')
-        f = datetime.datetime.now()
-        print "Found {2} files matching {0} in directory {1}"\
-                .format(parse_config['grantregex'], parse_config['datadir'], len(files))
+        doctypes.append('grant')
     if should_process_applications:
-        files = parse.list_files(parse_config['datadir'],parse_config['applicationregex'])
-        print 'Running application parse...'
-        run_parse(files, 'application')
+        doctypes.append('application')
+    for doctype in doctypes:
+        urls[doctype] = generate_download_list(parse_config['years'], doctype)
+
+    if parse_config['stream'] and any(urls.values()):
+        # parse the files as they are downloaded
+        print 'Downloading and parsing files at {0}'.format(str(datetime.datetime.today()))
+        parsed = stream_parses(doctypes, parse_config, urls)
+    else:
+        print 'Downloading files at {0}'.format(str(datetime.datetime.today()))
+        download_files([url for doctype in doctypes for url in urls[doctype]], parse_config['downloadworkers'])
+        print 'Downloaded files:',parse_config['years']
         f = datetime.datetime.now()
-        print "Found {2} files matching {0} in directory {1}"\
-                .format(parse_config['applicationregex'], parse_config['datadir'], len(files))
+        print 'Finished downloading in {0}'.format(str(f-s))
+
+        # find and parse the files
+        print "Starting parse on {0} on directory {1}".format(str(datetime.datetime.today()),parse_config['datadir'])
+        parsed = run_parses(doctypes, parse_config)
+    if not parsed:
+        print 'Parsing failed, not running the remaining steps'
+        sys.exit(1)
+    f = datetime.datetime.now()
     print 'Finished parsing in {0}'.format(str(f-s))
 
     # run extra phases if needed
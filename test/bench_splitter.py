@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of document splitting on the fixtures in fixtures/ipgxml.
+Compares the original line-by-line generator with the memory-mapped
+splitter used by parse.extract_xml_strings, with and without copying the
+documents out of the mapping.
+Usage: python bench_splitter.py [repeat]
+"""
+
+import os
+import re
+import sys
+import glob
+import timeit
+
+sys.path.append('../')
+import parse
+from lib import splitter
+
+basedir = os.path.dirname(os.path.abspath(__file__))
+files = sorted(glob.glob(os.path.join(basedir, 'fixtures/ipgxml/*.xml')))
+
+
+def extract_xml_strings_linewise(filename):
+    """
+    The line-by-line generator that parse.extract_xml_strings replaced
+    """
+    endtag_regex = re.compile('^<!DOCTYPE (.*) SYSTEM')
+    endtag = ''
+    with open(filename, 'r') as f:
+        doc = ''
+        for line in f:
+            doc += line
+            endtag = endtag_regex.findall(line) if not endtag else endtag
+            if not endtag:
+                continue
+            terminate = re.compile('^</{0}>'.format(endtag[0]))
+            if terminate.findall(line):
+                yield (parse._get_date(filename), doc)
+                endtag = ''
+                doc = ''
+
+
+def extract_xml_buffers(filename):
+    """
+    The documents of [filename] as buffers into the mapped file, as the
+    parse workers read them (see parse._parse_range)
+    """
+    date = parse._get_date(filename)
+    for offset, xml in splitter.file_documents(filename):
+        yield (date, xml)
+
+
+def consume(generator):
+    for filename in files:
+        for date, xml in generator(filename):
+            len(xml)
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    size = sum(map(os.path.getsize, files)) / 1024.0 / 1024.0
+    ndocs = sum(1 for filename in files for doc in parse.extract_xml_strings(filename))
+    print '{0} files, {1} documents, {2:.1f} MB'.format(len(files), ndocs, size)
+    for generator in [extract_xml_strings_linewise, parse.extract_xml_strings, extract_xml_buffers]:
+        best = min(timeit.repeat(lambda: consume(generator), number=1, repeat=repeat))
+        print '{0:32} {1:8.4f}s {2:8.1f} MB/s'.format(generator.__name__, best, size / best)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Benchmark of the write side of parse.py on one weekly grant file. The
+documents are parsed once, then written into a fresh SQLite database in
+commits of parse.commit_frequency documents: one at a time through
+add_grant (write = orm), per commit through alchemy.upsert_grants (a new
+BatchWriter for each commit), and through the lib.alchemy.upsert.BatchWriter
+that parse_files uses with write = upsert, which also remembers the shared
+rows written over the run.
+Only the writes and commits are timed.
+Usage: python bench_upsert.py [weekly file] [repeat]
+"""
+
+import os
+import sys
+import time
+import shutil
+import cPickle
+import tempfile
+
+sys.path.append('../')
+import parse
+import lib.alchemy as alchemy
+from lib.config_parser import get_handler_registry
+
+basedir = os.path.dirname(os.path.abspath(__file__))
+
+
+def commits(patobjs):
+    """
+    Splits [patobjs] into the documents of each commit
+    """
+    frequency = parse.commit_frequency or len(patobjs)
+    return [patobjs[i:i + frequency] for i in range(0, len(patobjs), frequency)]
+
+
+def write_orm(patobjs):
+    for chunk in commits(patobjs):
+        for patobj in chunk:
+            alchemy.add_grant(patobj)
+        alchemy.commit()
+        alchemy.grantsession.expunge_all()
+
+
+def write_upsert(patobjs):
+    for chunk in commits(patobjs):
+        alchemy.upsert_grants(chunk)
+        alchemy.commit()
+
+
+def write_batch(patobjs):
+    batch = alchemy.batch_writer('grant')
+    for chunk in commits(patobjs):
+        for patobj in chunk:
+            batch.add(patobj)
+        alchemy.write_batch(batch)
+        alchemy.commit()
+
+
+def timed(writer, data, directory):
+    """
+    Returns the seconds [writer] takes to write the pickled patent objects
+    [data] into a new database in [directory]
+    """
+    patobjs = cPickle.loads(data)
+    fd, filename = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    alchemy.bind_shard(filename)
+    start = time.time()
+    writer(patobjs)
+    seconds = time.time() - start
+    alchemy.grantsession.close()
+    os.remove(filename)
+    return seconds
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else os.path.join(basedir, 'fixtures/xml/ipg120327.18.xml')
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    date = parse._get_date(filename)
+    handler = get_handler_registry(os.path.join(basedir, '../process.cfg'), 'grant').get(date)
+    patobjs = [patobj for patobj in (parse.parse_patent((date, xml), 'grant', handler)
+                                     for start, xml in parse.splitter.file_documents(filename)) if patobj]
+    data = cPickle.dumps(patobjs, cPickle.HIGHEST_PROTOCOL)
+    print '{0}: {1} documents, commits of {2}'.format(os.path.basename(filename), len(patobjs),
+                                                      parse.commit_frequency)
+    directory = tempfile.mkdtemp()
+    try:
+        results = []
+        for writer in [write_orm, write_upsert, write_batch]:
+            best = min(timed(writer, data, directory) for i in range(repeat))
+            results.append(best)
+            print '{0:14} {1:8.2f}s {2:6.1f}x'.format(writer.__name__, best, results[0] / best)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Benchmark of the document tree built by lib/handlers/xml_driver.py on the
+fixtures in fixtures/ipgxml, split by handler (grant_handler_v42 and
+grant_handler_v44). Compares the original tree, which answers each lookup
+with a breadth-first search and caches it in the element's __dict__, with
+the indexed tree of __slots__ elements. Reports the memory held by the
+tree of each document after the handler has run, the time to parse, and
+the time spent in the handler's lookups.
+Usage: python bench_xml_driver.py [repeat]
+"""
+
+import os
+import sys
+import glob
+import time
+from collections import deque
+
+sys.path.append('../')
+import parse
+import lib.splitter as splitter
+import lib.handlers.xml_driver as xml_driver
+from lib.config_parser import get_handler_registry
+
+basedir = os.path.dirname(os.path.abspath(__file__))
+files = sorted(glob.glob(os.path.join(basedir, 'fixtures/ipgxml/*.xml')))
+
+
+class OldChainList(xml_driver.ChainList):
+    """
+    ChainList before the tag index
+    """
+
+    def __getattr__(self, key):
+        res = []
+        scope = deque(self)
+        while scope:
+            current = scope.popleft()
+            if current._name == key: res.append(current)
+            else: scope.extend(current.children)
+        return OldChainList(res)
+
+
+class OldXMLElement(object):
+    """
+    XMLElement before the tag index and __slots__
+    """
+
+    def __init__(self, name, attributes):
+        self._name = name
+        self._attributes = attributes
+        self.content = []
+        self.children = OldChainList()
+        self.is_root = False
+
+    def __getattr__(self, key):
+        res = []
+        scope = deque(self.children)
+        while scope:
+            current = scope.popleft()
+            if current._name == key: res.append(current)
+            else: scope.extend(current.children)
+        if res:
+            self.__dict__[key] = OldChainList(res)
+            return OldChainList(res)
+        else:
+            return OldChainList('')
+
+    __iter__ = xml_driver.XMLElement.__iter__.im_func
+    __nonzero__ = xml_driver.XMLElement.__nonzero__.im_func
+    __getitem__ = xml_driver.XMLElement.__getitem__.im_func
+    contents_of = xml_driver.XMLElement.contents_of.im_func
+    get_content = xml_driver.XMLElement.get_content.im_func
+    put_content = xml_driver.XMLElement.put_content.im_func
+    add_child = xml_driver.XMLElement.add_child.im_func
+    get_attribute = xml_driver.XMLElement.get_attribute.im_func
+    get_xmlelements = xml_driver.XMLElement.get_xmlelements.im_func
+
+
+class OldXMLHandler(xml_driver.XMLHandler):
+
+    def __init__(self):
+        xml_driver.XMLHandler.__init__(self)
+        self.root = OldXMLElement(None, None)
+        self.root.is_root = True
+
+    def start_element(self, name, attributes):
+        name = name.replace('-','_').replace('.','_').replace(':','_')
+        xmlelem = OldXMLElement(name, attributes)
+        if self.elements:
+            self.elements[-1].add_child(xmlelem)
+        else:
+            self.root.add_child(xmlelem)
+        self.elements.append(xmlelem)
+
+    def endElement(self, name):
+        if self.elements:
+            self.elements.pop()
+
+
+def parse_old(xml, is_string=False):
+    xh = OldXMLHandler()
+    parser = xml_driver.expat.ParserCreate()
+    parser.StartElementHandler = xh.start_element
+    parser.EndElementHandler = xh.endElement
+    parser.CharacterDataHandler = \
+        lambda content: xh.put_characters(content, parser.CurrentLineNumber)
+    parser.Parse(xml, True)
+    return xh
+
+def parse_new(xml, is_string=False):
+    return xml_driver.engines['expat'](xml, True, ())
+
+
+def tree_size(xh):
+    """
+    Bytes held by the elements of the tree of [xh], including their
+    attribute dictionaries, content and children lists, the lookups cached
+    in the old elements and the tag index of the new tree
+    """
+    size = 0
+    scope = [xh.root]
+    while scope:
+        elem = scope.pop()
+        size += sys.getsizeof(elem) + sys.getsizeof(elem.content) + sys.getsizeof(elem.children)
+        if hasattr(elem, '__dict__'):
+            size += sys.getsizeof(elem.__dict__)
+            size += sum(sys.getsizeof(value) for key, value in elem.__dict__.iteritems()
+                        if key not in ('content', 'children'))
+        scope.extend(elem.children)
+    for positions, elements in getattr(xh, 'tags', {}).itervalues():
+        size += sys.getsizeof(positions) + sys.getsizeof(elements)
+    return size
+
+
+def run(handler, docs, parser, repeat):
+    parsed = []
+    real_parse_document = xml_driver.parse_document
+    xml_driver.parse_document = lambda xml, is_string=False: parsed.append(parser(xml)) or parsed[-1]
+    try:
+        handler_time = min(timed(lambda: [handler.Patent(xml, True).get_patobj() for xml in docs])
+                           for i in range(repeat))
+    finally:
+        xml_driver.parse_document = real_parse_document
+    parse_time = min(timed(lambda: [parser(xml) for xml in docs]) for i in range(repeat))
+    size = sum(tree_size(xh) for xh in parsed[-len(docs):]) / float(len(docs))
+    return size, parse_time, handler_time - parse_time
+
+def timed(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    registry = get_handler_registry('../process.cfg', 'grant')
+    byhandler = {}
+    for filename in files:
+        handler = registry.get(parse._get_date(filename))
+        buf = splitter.open_mapped(filename)
+        byhandler.setdefault(handler, []).extend(buf[start:end] for start, end in splitter.document_ranges(buf))
+    print '{0:20} {1:6} {2:>8} {3:>12} {4:>10} {5:>10}'\
+          .format('handler', 'tree', 'docs', 'KB/doc', 'parse ms', 'lookup ms')
+    for handler, docs in sorted(byhandler.items()):
+        for label, parser in [('old', parse_old), ('new', parse_new)]:
+            size, parse_time, lookup_time = run(handler, docs, parser, repeat)
+            print '{0:20} {1:6} {2:8} {3:12.1f} {4:10.3f} {5:10.3f}'\
+                  .format(handler.__name__.split('.')[-1], label, len(docs), size / 1024,
+                          1000 * parse_time / len(docs), 1000 * lookup_time / len(docs))
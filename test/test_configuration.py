@@ -1,12 +1,22 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import time
+import shutil
+import logging
+import tempfile
 import unittest
 
 sys.path.append('..')
 sys.path.append('../lib')
 
+import start
 from start import get_year_list
+from ConfigParser import ConfigParser
+from config_parser import HandlerRegistry, get_xml_handlers, get_handler_registry
+from config_parser import defaults, extract_parse_options, get_names
+from lib.alchemy.rows import projection
 
 class Test_Configuration(unittest.TestCase):
 
@@ -48,4 +58,164 @@ class Test_Configuration(unittest.TestCase):
         self.assertTrue(expected == years, '\n{0} should be\n{1}'\
                         .format(years, expected))
 
+class Test_HandlerRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = HandlerRegistry({(20050000, 20130108): 'v42',
+                                         (20130115, float('inf')): 'v44',
+                                         'default': 'default'})
+
+    def test_lookup(self):
+        self.assertTrue(self.registry.get(20050104) == 'v42')
+        self.assertTrue(self.registry.get(20130108) == 'v42')
+        self.assertTrue(self.registry.get(20130115) == 'v44')
+        self.assertTrue(self.registry.get(20200101) == 'v44')
+
+    def test_lookup_default(self):
+        self.assertTrue(self.registry.get(20010101) == 'default')
+        self.assertTrue(self.registry.get(20130110) == 'default')
+        self.assertTrue(self.registry.get('default') == 'default')
+
+    def test_overlap(self):
+        self.assertRaises(ValueError, HandlerRegistry,
+                          {(20050000, 20130108): 'v42', (20130101, 20140000): 'v44'})
+
+    def test_overlap_in_configfile(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            configfile = os.path.join(tmpdir, 'process.cfg')
+            with open(configfile, 'w') as f:
+                f.write('[grant-xml-handlers]\n'
+                        '2005-20130115=lib.handlers.grant_handler_v42\n'
+                        '20130115=lib.handlers.grant_handler_v44\n'
+                        'default=lib.handlers.grant_handler_v42\n')
+            self.assertRaises(ValueError, get_handler_registry, configfile, 'grant')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_matches_process_cfg(self):
+        for doctype in ['grant', 'application']:
+            xmlhandlers = get_xml_handlers('../process.cfg', doctype)
+            registry = get_handler_registry('../process.cfg', doctype)
+            self.assertTrue(registry is get_handler_registry('../process.cfg', doctype))
+            for date in [20010315, 20050104, 20060822, 20060823, 20130108,
+                         20130115, 20130116, 20130117, 20140101, 'default']:
+                expected = xmlhandlers['default']
+                for daterange in xmlhandlers.iterkeys():
+                    if daterange != 'default' and daterange[0] <= date <= daterange[1]:
+                        expected = xmlhandlers[daterange]
+                self.assertTrue(registry.get(date) is expected, date)
+
+class Test_Projection(unittest.TestCase):
+
+    def test_get_names(self):
+        self.assertTrue(get_names(None) is None)
+        self.assertTrue(get_names('claims, citation_list,') == ['claims', 'citation_list'])
+
+    def test_bibliographic(self):
+        handler = ConfigParser(defaults)
+        handler.read('../process.cfg')
+        options = extract_parse_options(handler, 'bibliographic')
+        self.assertTrue(options['tables'] is None)
+        attributes, tables = projection(options['attributes'], options['tables'])
+        self.assertFalse(attributes & set(['claims', 'citation_list']))
+        self.assertTrue(set(['pat', 'app', 'patent', 'assignee_list']) <= attributes)
+        self.assertFalse(tables & set(['claim', 'otherreference', 'uspatentcitation']))
+        self.assertTrue(set(['patent', 'application', 'rawlocation', 'mainclass', 'uspc']) <= tables)
+        self.assertTrue(options['loglevel'] == logging.WARNING)
+        options = extract_parse_options(handler, 'test')
+        self.assertTrue(projection(options['attributes'], options['tables']) == (None, None))
+        handler.set('test', 'loglevel', 'info')
+        self.assertTrue(extract_parse_options(handler, 'test')['loglevel'] == logging.INFO)
+
+    def test_projection(self):
+        attributes, tables = projection(None, ['claim'])
+        self.assertTrue(attributes == set(['pat', 'app', 'patent', 'claims']))
+        self.assertTrue(tables == set(['patent', 'application', 'claim']))
+        attributes, tables = projection(['inventor_list'], None, 'application')
+        self.assertTrue(attributes == set(['app', 'application', 'inventor_list']))
+        self.assertTrue(tables == set(['application', 'rawinventor', 'rawlocation']))
+        # the locations are written with the inventors that refer to them
+        attributes, tables = projection(None, ['rawinventor', 'otherreference'])
+        self.assertTrue(tables == set(['patent', 'application', 'rawinventor', 'rawlocation',
+                                       'otherreference']))
+        self.assertRaises(ValueError, projection, ['claim'], None)
+        self.assertRaises(ValueError, projection, None, ['claims'])
+
+class Test_RunParses(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.parse_doctype = start.parse_doctype
+        self.failing = None
+        self.expected = 2
+        def parse_doctype(doctype, parse_config):
+            open(os.path.join(self.tmpdir, doctype), 'w').close()
+            # each parse waits for the other one to start
+            deadline = time.time() + 10
+            while len(os.listdir(self.tmpdir)) < self.expected and time.time() < deadline:
+                time.sleep(0.01)
+            if len(os.listdir(self.tmpdir)) < self.expected or doctype == self.failing:
+                sys.exit(2)
+        start.parse_doctype = parse_doctype
+
+    def tearDown(self):
+        start.parse_doctype = self.parse_doctype
+        shutil.rmtree(self.tmpdir)
+
+    def test_concurrent(self):
+        self.assertTrue(start.run_parses(['grant', 'application'], {}))
+        self.assertTrue(sorted(os.listdir(self.tmpdir)) == ['application', 'grant'])
+
+    def test_failure(self):
+        self.failing = 'application'
+        self.assertFalse(start.run_parses(['grant', 'application'], {}))
+
+    def test_single(self):
+        self.expected = 1
+        self.assertTrue(start.run_parses(['grant'], {}))
+        self.assertTrue(os.listdir(self.tmpdir) == ['grant'])
+
+class Test_StreamParses(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = start.run_parse, start.parse_doctype, start.download_files, start.parse.index_files
+        log = os.path.join(self.tmpdir, 'log')
+        def record(line):
+            with open(log, 'a') as f:
+                f.write(line + '\n')
+        start.run_parse = lambda files, doctype, *args: record('parse ' + os.path.basename(files[0]))
+        start.parse_doctype = lambda doctype, parse_config: record('rest ' + doctype)
+        start.parse.index_files = lambda files, doctype: 0
+        def download_files(urls, workers, callback):
+            for url in urls:
+                callback(os.path.join(self.tmpdir, url.split('/')[-1]))
+                # the parse of a file starts before the next one is downloaded
+                deadline = time.time() + 10
+                while url.split('/')[-1] not in open(log).read() and time.time() < deadline:
+                    time.sleep(0.01)
+                record('downloaded ' + url.split('/')[-1])
+        start.download_files = download_files
+        open(log, 'w').close()
+        self.log = log
+
+    def tearDown(self):
+        start.run_parse, start.parse_doctype, start.download_files, start.parse.index_files = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_stream(self):
+        config = {'grantregex': 'ipg\d{6}.xml', 'applicationregex': 'ipa\d{6}.xml',
+                  'workers': 1, 'downloadworkers': 1, 'attributes': None, 'tables': None,
+                  'loglevel': logging.WARNING}
+        urls = {'grant': ['http://x/ipg120327.zip', 'http://x/ipg120320.zip'],
+                'application': ['http://x/ipa120329.zip']}
+        self.assertTrue(start.stream_parses(['grant', 'application'], config, urls))
+        lines = open(self.log).read().splitlines()
+        for name in ['ipg120327.zip', 'ipg120320.zip', 'ipa120329.zip']:
+            self.assertTrue(lines.index('parse ' + name) < lines.index('downloaded ' + name))
+        self.assertTrue(lines.index('parse ipg120327.zip') < lines.index('parse ipg120320.zip'))
+        for doctype in ['grant', 'application']:
+            self.assertTrue(lines[-2:].count('rest ' + doctype) == 1)
+
 unittest.main()
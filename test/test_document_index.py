@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+sys.path.append('../')
+import parse
+import lib.splitter as splitter
+import lib.document_index as document_index
+import lib.parse_cache as parse_cache
+import lib.handlers.grant_handler_v44 as handler
+
+basedir = os.path.dirname(__file__)
+testdir = os.path.join(basedir, './fixtures/xml/')
+
+class TestDocumentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'ipg120327.18.xml')
+        shutil.copy(testdir + 'ipg120327.18.xml', self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_normalize_number(self):
+        for number in ['8,142,281', 'US8142281', '08142281', ' 8142281\n']:
+            self.assertTrue(document_index.normalize_number(number) == '8142281')
+        self.assertTrue(document_index.normalize_number('D0656296') == 'D656296')
+
+    def test_build_index(self):
+        index = document_index.build_index(self.filename, handler)
+        self.assertTrue(len(index) == 18)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'ipg120327.18.idx')))
+        self.assertTrue(document_index.load_index(self.filename) == index)
+        buf = splitter.open_mapped(self.filename)
+        docs = [doc for date, doc in parse.extract_xml_strings(self.filename)]
+        for number, (offset, length, name) in index.items():
+            self.assertTrue(buf[offset:offset+length] in docs)
+            self.assertTrue(name == handler.__name__)
+
+    def test_stale_index(self):
+        self.assertTrue(document_index.load_index(self.filename) is None)
+        document_index.build_index(self.filename, handler)
+        with open(self.filename, 'a') as f:
+            f.write('\n')
+        self.assertTrue(document_index.load_index(self.filename) is None)
+        self.assertTrue(document_index.update_indexes([self.filename], lambda f: handler) == 1)
+        self.assertTrue(document_index.update_indexes([self.filename], lambda f: handler) == 0)
+
+    def test_handler_version(self):
+        document_index.build_index(self.filename, handler)
+        self.assertTrue(document_index.load_index(self.filename, handler) is not None)
+        version = parse_cache.handler_version(handler)
+        try:
+            # an edit to the handlers changes their version
+            parse_cache._versions[handler.__name__] = version + '-edited'
+            self.assertTrue(document_index.load_index(self.filename, handler) is None)
+            self.assertTrue(document_index.load_index(self.filename) is not None)
+            self.assertTrue(document_index.update_indexes([self.filename], lambda f: handler) == 1)
+            self.assertTrue(document_index.update_indexes([self.filename], lambda f: handler) == 0)
+        finally:
+            parse_cache._versions[handler.__name__] = version
+
+    def test_find_document(self):
+        document_index.update_indexes([self.filename], lambda f: handler)
+        index = document_index.load_index(self.filename)
+        number = sorted(index.keys())[0]
+        found = document_index.find_document('US' + number, [self.filename])
+        self.assertTrue(found == (self.filename,) + index[number])
+        self.assertTrue(document_index.find_document('1', [self.filename]) is None)
+
+    def test_compressed_index(self):
+        zipname = os.path.join(self.tmpdir, 'ipg120327.zip')
+        with zipfile.ZipFile(zipname, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.write(self.filename, 'ipg120327.xml')
+        expected = document_index.build_index(self.filename, handler)
+        index = document_index.build_index(zipname, handler)
+        self.assertTrue(index == expected)
+        buf = splitter.open_mapped(self.filename)
+        for number, (offset, length, name) in index.items():
+            self.assertTrue(splitter.read_document(zipname, offset, length) == buf[offset:offset+length])
+
+if __name__ == '__main__':
+    unittest.main()
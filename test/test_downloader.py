@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+
+sys.path.append('../')
+sys.path.append('../lib')
+import downloader
+
+basedir = os.path.dirname(__file__)
+testdir = os.path.join(basedir, './fixtures/xml/')
+
+listing = """<html><body>
+<h3 id="2012">2012</h3>
+<a href="{0}/ipg120327.zip">ipg120327.zip</a>
+<a href="{0}/ipg120320.zip">ipg120320.zip</a>
+<h3 id="2011">2011</h3>
+<a href="{0}/ipg111227.zip">ipg111227.zip</a>
+</body></html>"""
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the files in server.files with support for Range requests. The
+    first response for each path in server.truncate is cut short
+    """
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+        data = self.server.files[self.path]
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        if self.path in self.server.truncate:
+            self.server.truncate.remove(self.path)
+            self.wfile.write(data[start:start + (len(data) - start) / 2])
+            return
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.server.truncate = set()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.server.files = {'/listing.html': listing.format(self.url)}
+        for name in ['ipg120327', 'ipg120320', 'ipg111227']:
+            path = os.path.join(self.tmpdir, name + '.zip')
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+                z.write(testdir + 'ipg120327.18.xml', name + '.xml')
+            with open(path, 'rb') as f:
+                self.server.files['/' + name + '.zip'] = f.read()
+            os.remove(path)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.retries = downloader.retries
+        downloader.retries = 1
+
+    def tearDown(self):
+        downloader.retries = self.retries
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_listing_manifest(self):
+        manifest = downloader.load_manifest(self.tmpdir)
+        urls = downloader.get_download_list([2011, 2012], 'grant', manifest, self.url + '/listing.html')
+        self.assertTrue(urls == [self.url + '/ipg111227.zip', self.url + '/ipg120327.zip',
+                                 self.url + '/ipg120320.zip'])
+        downloader.save_manifest(self.tmpdir, manifest)
+        manifest = downloader.load_manifest(self.tmpdir)
+        urls = downloader.get_download_list(['latest'], 'grant', manifest, self.url + '/listing.html')
+        self.assertTrue(urls == [self.url + '/ipg120320.zip'])
+        self.assertTrue(len(self.server.requests) == 1)
+        downloader.get_download_list([2010], 'grant', manifest, self.url + '/listing.html')
+        self.assertTrue(len(self.server.requests) == 2)
+
+    def test_download_files(self):
+        urls = [self.url + '/ipg120327.zip', self.url + '/ipg120320.zip', self.url + '/ipg111227.zip']
+        self.assertTrue(downloader.download_files(urls, self.tmpdir, workers=2))
+        manifest = downloader.load_manifest(self.tmpdir)
+        for url in urls:
+            name = url.split('/')[-1]
+            with open(os.path.join(self.tmpdir, name), 'rb') as f:
+                self.assertTrue(f.read() == self.server.files['/' + name])
+            self.assertTrue(manifest['files'][name]['size'] == len(self.server.files['/' + name]))
+            self.assertTrue(downloader.have_file(name, self.tmpdir, manifest, verify=True))
+        self.assertFalse([f for f in os.listdir(self.tmpdir) if f.endswith('.part')])
+        requests = len(self.server.requests)
+        self.assertTrue(downloader.download_files(urls, self.tmpdir))
+        self.assertTrue(len(self.server.requests) == requests)
+
+    def test_callback(self):
+        urls = [self.url + '/ipg120327.zip', self.url + '/ipg120320.zip', self.url + '/ipg111227.zip']
+        self.assertTrue(downloader.download_files(urls[1:2], self.tmpdir))
+        available = []
+        def callback(path):
+            with open(path, 'rb') as f:
+                available.append((os.path.basename(path), f.read()))
+        self.assertFalse(downloader.download_files(urls + [self.url + '/missing.zip'], self.tmpdir,
+                                                   workers=2, callback=callback))
+        # the file downloaded before comes first, each file once it is complete
+        self.assertTrue(available[0][0] == 'ipg120320.zip')
+        self.assertTrue(sorted(name for name, data in available) == ['ipg111227.zip', 'ipg120320.zip', 'ipg120327.zip'])
+        for name, data in available:
+            self.assertTrue(data == self.server.files['/' + name])
+
+    def test_resume(self):
+        self.server.truncate.add('/ipg120327.zip')
+        path = os.path.join(self.tmpdir, 'ipg120327.zip')
+        entry = downloader.download_file(self.url + '/ipg120327.zip', path)
+        data = self.server.files['/ipg120327.zip']
+        self.assertTrue(entry['size'] == len(data))
+        self.assertTrue(self.server.requests[-1] == ('/ipg120327.zip', 'bytes={0}-'.format(len(data) / 2)))
+        with open(path, 'rb') as f:
+            self.assertTrue(f.read() == data)
+
+    def test_corrupt(self):
+        data = self.server.files['/ipg120327.zip']
+        self.server.files['/ipg120327.zip'] = data[:100] + '\0' * 10 + data[110:]
+        path = os.path.join(self.tmpdir, 'ipg120327.zip')
+        self.assertTrue(downloader.download_file(self.url + '/ipg120327.zip', path) is None)
+        self.assertFalse(os.path.exists(path) or os.path.exists(path + '.part'))
+        self.assertFalse(downloader.download_files([self.url + '/missing.zip'], self.tmpdir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import gzip
+import time
+import uuid
+import cPickle
+import itertools
+import unittest
+import collections
+
+sys.path.append('../')
+import lib.handlers.extraction as extraction
+from lib.handlers.handler import empty
+from lib.handlers import grant_handler_v42, application_handler_v42
+from lib.handlers.extraction import Values, string, first, count
+from lib.handlers.xml_driver import parse_document
+from test_xml_engines import documents
+
+basedir = os.path.dirname(__file__)
+# the get_patobj() output of the property-based Patent classes that the
+# plans replaced, for the documents of the handlers that have a plan, keyed
+# by (file name, position of the document in the file) and with the uuids
+# replaced as in run
+golden = os.path.join(basedir, 'fixtures/patobj/get_patobj.pickle.gz')
+
+def run(function):
+    """
+    Returns the patobj from [function] as a dictionary, with the random uuids
+    replaced by a counter so that runs compare equal
+    """
+    counter = itertools.count()
+    uuid1 = uuid.uuid1
+    uuid.uuid1 = lambda: 'uuid-{0}'.format(next(counter))
+    try:
+        return function().__dict__
+    finally:
+        uuid.uuid1 = uuid1
+
+class TestExtraction(unittest.TestCase):
+
+    def test_values(self):
+        document = parse_document('fixtures/xml/ipg120327.one.xml').root.us_patent_grant
+        fields = {'patent': first('publication_reference.doc_number'),
+                  'kind': first('publication_reference.kind'),
+                  'text': string('claim_text'),
+                  'refs': count('claim_ref')}
+        for name, field in fields.items():
+            field.compile(record=name in ('text', 'refs'))
+        values = Values(fields, chain=document)
+        self.assertEqual(values['patent'], document.publication_reference.contents_of('doc_number')[0])
+        self.assertEqual(values['kind'], document.publication_reference.contents_of('kind')[0])
+        self.assertTrue(('publication_reference',) in values.chains)
+        claim = document.claims.claim[0]
+        values = Values(fields, claim)
+        self.assertEqual(values['text'], claim.contents_of('claim_text', as_string=True, upper=False))
+        self.assertEqual(values['refs'], len(claim.claim_ref))
+        self.assertEqual(values.has('claim_ref'), bool(claim.claim_ref))
+
+    def test_compile_plan(self):
+        spec = {'document': 'doc', 'attributes': ['app', 'claims'], 'fields': {},
+                'header': extraction.application_header, 'sections': {}}
+        self.assertRaises(ValueError, extraction.compile_plan, spec)
+        del spec['sections']
+        self.assertRaises(ValueError, extraction.compile_plan, spec)
+        self.assertRaises(ValueError, extraction.Citations, 'citation',
+                          {'text': extraction.string('othercit'), 'date': extraction.string('patcit.date')})
+
+    def test_plans_match_handlers(self):
+        with gzip.open(golden, 'rb') as f:
+            expected = cPickle.load(f)
+        timings = {'plan': 0.0, 'handler': 0.0}
+        positions = collections.Counter()
+        keys = set()
+        for filename, handler, xml in documents():
+            key = os.path.basename(filename), positions[os.path.basename(filename)]
+            positions[key[0]] += 1
+            if not hasattr(handler, 'plan'):
+                continue
+            keys.add(key)
+            start = time.time()
+            result = run(lambda: handler.Patent(xml, True).get_patobj())
+            timings['handler'] += time.time() - start
+            self.assertTrue(result == expected[key], '{0} differs for {1}'.format(handler.__name__, key))
+            start = time.time()
+            result = run(lambda: handler.plan.extract(xml, True))
+            timings['plan'] += time.time() - start
+            self.assertTrue(result == expected[key], '{0} plan differs for {1}'.format(handler.__name__, key))
+        self.assertTrue(keys == set(expected))
+        ndocs = len(keys)
+        for name, seconds in sorted(timings.items()):
+            print >> sys.stderr, '{0}: {1:.1f} docs/sec'.format(name, ndocs / seconds)
+
+    def test_projection(self):
+        attributes = ['pat', 'app', 'patent', 'application', 'assignee_list', 'inventor_list',
+                      'us_classifications']
+        uuid1 = uuid.uuid1
+        uuid.uuid1 = lambda: 'uuid'
+        try:
+            ndocs = 0
+            for filename, handler, xml in documents():
+                if not hasattr(handler, 'plan'):
+                    continue
+                try:
+                    expected = handler.plan.extract(xml, True).__dict__
+                except Exception:
+                    continue
+                ndocs += 1
+                for patobj in [handler.plan.extract(xml, True, attributes),
+                               handler.Patent(xml, True).get_patobj(attributes)]:
+                    for attr, value in expected.items():
+                        if attr not in attributes:
+                            value = empty(attr)
+                        self.assertTrue(patobj.__dict__[attr] == value,
+                                        '{0} differs for {1}'.format(attr, filename))
+            self.assertTrue(ndocs > 100)
+        finally:
+            uuid.uuid1 = uuid1
+        skip = grant_handler_v42.plan.skip_for(attributes)
+        self.assertTrue(set(['claim', 'references_cited']) <= skip)
+        self.assertFalse(set(['parties', 'assignees', 'classification_national']) & skip)
+        # the claims of applications are counted, so only their contents are left out
+        skip = application_handler_v42.plan.skip_for(attributes)
+        self.assertTrue('claim_text' in skip and 'claim' not in skip)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import collections
+
+sys.path.append('../')
+import parse
+import lib.alchemy as alchemy
+import lib.parse_cache as parse_cache
+import lib.fingerprint as fingerprint
+import lib.document_index as document_index
+from lib.config_parser import get_handler_registry
+
+basedir = os.path.dirname(__file__)
+testdir = os.path.join(basedir, './fixtures/xml/')
+
+def dump(filename):
+    """
+    Returns the sorted rows of each table in the SQLite database [filename]
+    other than the parse_manifest and document_fingerprint
+    """
+    db = sqlite3.connect(filename)
+    tables = {}
+    for (table,) in db.execute("select name from sqlite_master where type='table'"):
+        if table not in ('parse_manifest', 'document_fingerprint'):
+            tables[table] = sorted(db.execute('select * from {0}'.format(table)))
+    db.close()
+    return tables
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.first = os.path.join(self.tmpdir, 'ipg120327.xml')
+        shutil.copy(testdir + 'ipg120327.18.xml', self.first)
+        self.documents = [str(xml) for start, xml in parse.splitter.file_documents(self.first)]
+        # republished a week later with new production dates, one document
+        # reformatted and one changed
+        self.republished = [re.sub(r'date-produced="\d+"', 'date-produced="20120320"', xml)
+                            for xml in self.documents]
+        self.republished[2] = self.republished[2].replace('\n', '\r\n')
+        title = self.republished[5].index('>', self.republished[5].index('<invention-title')) + 1
+        self.republished[5] = self.republished[5][:title] + 'Changed ' + self.republished[5][title:]
+        self.second = os.path.join(self.tmpdir, 'ipg120403.xml')
+        with open(self.second, 'w') as f:
+            f.write(''.join(self.republished))
+        self.session = alchemy.grantsession
+        self.saved = parse.queue_size, parse.parse_patent, parse._get_parser, parse.use_upsert
+        parse.queue_size = 0
+        # the databases are compared row for row, so their ids must not vary
+        parse.use_upsert = True
+        registry = get_handler_registry('../process.cfg', 'grant')
+        parse._get_parser = lambda date, doctype='grant': registry.get(date)
+        self.parsed = []
+        def parse_patent(xmltuple, doctype='grant', handler=None):
+            self.parsed.append(str(xmltuple[1]))
+            return self.saved[1](xmltuple, doctype, handler)
+        parse.parse_patent = parse_patent
+
+    def tearDown(self):
+        parse.queue_size, parse.parse_patent, parse._get_parser, parse.use_upsert = self.saved
+        alchemy.grantsession = self.session
+        shutil.rmtree(self.tmpdir)
+
+    def bind(self, name):
+        filename = os.path.join(self.tmpdir, name)
+        alchemy.bind_shard(filename)
+        return filename
+
+    def handler(self):
+        return parse._get_parser(parse._get_date(self.first))
+
+    def screen(self, xmls):
+        """
+        Returns the number of the documents [xmls] of the second file of
+        each fingerprint status (see parse._screen)
+        """
+        return dict(collections.Counter(parse._screen(self.second, xml, self.handler())[0] for xml in xmls))
+
+    def number(self, xml):
+        return document_index.normalize_number(document_index.number_regex.search(xml).group(1))
+
+    def expected(self):
+        """
+        Returns the rows of both files parsed in full
+        """
+        filename = self.bind('expected.db')
+        parse.parse_files([self.first, self.second], reparse=True)
+        return dump(filename)
+
+    def test_fingerprint(self):
+        prints = [fingerprint.fingerprint(xml) for xml in self.documents]
+        self.assertTrue(len(set(prints)) == 18)
+        republished = [fingerprint.fingerprint(xml) for xml in self.republished]
+        self.assertTrue(republished[:5] + republished[6:] == prints[:5] + prints[6:])
+        self.assertTrue(republished[5] != prints[5])
+        rows = list(fingerprint.file_fingerprints(self.second))
+        self.assertTrue([number for end, number, digest in rows] == map(self.number, self.documents))
+        self.assertTrue([digest for end, number, digest in rows] == republished)
+
+    def test_republished(self):
+        expected = self.expected()
+        self.parsed = []
+        filename = self.bind('grant.db')
+        parse.parse_files([self.first])
+        self.assertTrue(len(self.parsed) == 18)
+        self.assertTrue(self.screen(self.republished) == {'unchanged': 17, 'changed': 1})
+        self.assertTrue(parse._screen(self.second, self.republished[5], self.handler())[0] == 'changed')
+        # only the changed document is parsed again
+        self.parsed = []
+        parse.parse_files([self.second])
+        self.assertTrue(len(self.parsed) == 1 and 'Changed' in self.parsed[0])
+        self.assertTrue(dump(filename) == expected)
+        self.assertTrue(alchemy.get_parse_state('ipg120403.xml')['documents'] == 18)
+        numbers = map(self.number, self.documents)
+        stored = alchemy.get_fingerprints(numbers)
+        self.assertTrue(sorted(digest for digest, version in stored.values()) ==
+                        sorted(map(fingerprint.fingerprint, self.republished)))
+        self.assertTrue(set(version for digest, version in stored.values()) ==
+                        set([parse_cache.handler_version(self.handler())]))
+        sources = dict(alchemy.grantsession.execute('select number, filename from document_fingerprint').fetchall())
+        self.assertTrue(sources.pop(numbers[5]) == 'ipg120403.xml')
+        self.assertTrue(set(sources.values()) == set(['ipg120327.xml']))
+        self.assertTrue(self.screen(self.republished) == {'unchanged': 18})
+
+    def test_failed_document(self):
+        expected = self.expected()
+        filename = self.bind('grant.db')
+        failed = self.number(self.documents[3])
+        recording = parse.parse_patent
+        def failing(xmltuple, doctype='grant', handler=None):
+            if self.number(str(xmltuple[1])) == failed:
+                return None
+            return recording(xmltuple, doctype, handler)
+        parse.parse_patent = failing
+        parse.parse_files([self.first])
+        parse.parse_patent = recording
+        self.assertFalse(failed in alchemy.get_fingerprints([unicode(failed)]))
+        # the document is parsed again where it is republished
+        self.assertTrue(self.screen(self.republished) == {'unchanged': 16, 'changed': 1, 'new': 1})
+        self.parsed = []
+        parse.parse_files([self.second])
+        self.assertTrue(map(self.number, self.parsed) == [failed, self.number(self.documents[5])])
+        self.assertTrue(dump(filename) == expected)
+
+    def test_handler_change(self):
+        expected = self.expected()
+        filename = self.bind('grant.db')
+        parse.parse_files([self.first])
+        # the file is parsed again in full by another handler
+        state = alchemy.get_parse_state('ipg120327.xml')
+        state['handler'] = u'grant_handler_v41'
+        alchemy.set_parse_state(state)
+        alchemy.commit()
+        self.parsed = []
+        parse.parse_files([self.first])
+        self.assertTrue(len(self.parsed) == 18)
+        # as are the documents republished after a change to the handler
+        handler = self.handler()
+        parse_cache._versions[handler.__name__] = 'changed'
+        try:
+            self.parsed = []
+            parse.parse_files([self.second])
+            self.assertTrue(len(self.parsed) == 18)
+            self.assertTrue(self.screen(self.republished) == {'unchanged': 18})
+        finally:
+            del parse_cache._versions[handler.__name__]
+        self.assertTrue(dump(filename) == expected)
+
+    def test_workers(self):
+        expected = self.expected()
+        # the documents of one file spread across a pool
+        filename = self.bind('pool.db')
+        parse.parse_files([self.first])
+        parse.parse_files([self.second], workers=2)
+        self.assertTrue(dump(filename) == expected)
+        # files split between workers, fingerprinted against this database
+        third = os.path.join(self.tmpdir, 'ipg120410.xml')
+        shutil.copy(self.second, third)
+        filename = self.bind('parallel.db')
+        parse.parse_files([self.first])
+        parse.parse_files([self.second, third], workers=2)
+        self.assertTrue(dump(filename) == expected)
+        sources = dict(alchemy.grantsession.execute('select number, filename from document_fingerprint').fetchall())
+        self.assertTrue(sources.pop(self.number(self.documents[5])) == 'ipg120410.xml')
+        self.assertTrue(set(sources.values()) == set(['ipg120327.xml']))
+
+if __name__ == '__main__':
+    unittest.main()
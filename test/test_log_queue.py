@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+import multiprocessing
+
+sys.path.append('../')
+import lib.log_queue as log_queue
+
+class Formatted(object):
+    """
+    Log argument that counts how often it is formatted
+    """
+    count = 0
+
+    def __str__(self):
+        Formatted.count += 1
+        return 'formatted'
+
+class TestLogQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.log')
+        self.root = logging.getLogger()
+        self.handlers, self.level = self.root.handlers[:], self.root.level
+        self.root.handlers = []
+
+    def tearDown(self):
+        for handler in self.root.handlers:
+            handler.close()
+        self.root.handlers, self.root.level = self.handlers, self.level
+        shutil.rmtree(self.tmpdir)
+
+    def lines(self):
+        with open(self.filename) as f:
+            return f.read().splitlines()
+
+    def test_levels(self):
+        handler = log_queue.configure(self.filename, logging.INFO)
+        Formatted.count = 0
+        for i in range(1000):
+            logging.info('record %s', i)
+            logging.debug('skipped %s', Formatted())
+        logging.error(u'unicode \xe9')
+        handler.flush()
+        lines = self.lines()
+        self.assertTrue(lines[:1000] == ['INFO:root:record {0}'.format(i) for i in range(1000)])
+        self.assertTrue(lines[1000:] == ['ERROR:root:unicode \xc3\xa9'])
+        self.assertTrue(Formatted.count == 0)
+        # configuring the file again changes the level only
+        self.assertTrue(log_queue.configure(self.filename, logging.DEBUG) is handler)
+        self.assertTrue(len(self.root.handlers) == 1)
+        logging.debug('shown %s', Formatted())
+        handler.close()
+        self.assertTrue(self.lines()[-1] == 'DEBUG:root:shown formatted')
+        self.assertFalse(handler.thread.is_alive())
+
+    def test_processes(self):
+        handler = log_queue.configure(self.filename)
+        logging.warning('parent')
+        handler.flush()
+        process = multiprocessing.Process(target=logging.warning, args=('child',))
+        process.start()
+        process.join()
+        pool = multiprocessing.Pool(2)
+        pool.map(logging.warning, ['worker'] * 4)
+        pool.close()
+        pool.join()
+        handler.close()
+        lines = self.lines()
+        self.assertTrue(lines[:2] == ['WARNING:root:parent', 'WARNING:root:child'])
+        self.assertTrue(sorted(lines[2:]) == ['WARNING:root:worker'] * 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.append('../')
+import parse
+import lib.alchemy as alchemy
+import lib.parse_cache as parse_cache
+from lib.config_parser import get_handler_registry
+
+basedir = os.path.dirname(__file__)
+testdir = os.path.join(basedir, './fixtures/xml/')
+
+def dump(filename):
+    """
+    Returns the sorted rows of each table in the SQLite database [filename]
+    other than the parse_manifest and document_fingerprint, which the cache
+    does not hold
+    """
+    db = sqlite3.connect(filename)
+    tables = {}
+    for (table,) in db.execute("select name from sqlite_master where type='table'"):
+        if table not in ('parse_manifest', 'document_fingerprint'):
+            tables[table] = sorted(db.execute('select * from {0}'.format(table)))
+    db.close()
+    return tables
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'ipg120327.xml')
+        shutil.copy(testdir + 'ipg120327.18.xml', self.filename)
+        self.session = alchemy.grantsession
+        self.saved = parse.cache_directory, parse.queue_size, parse.parse_patent, parse._get_parser, \
+            parse.use_upsert
+        parse.cache_directory = os.path.join(self.tmpdir, 'cache')
+        parse.queue_size = 0
+        # the databases are compared row for row, so their ids must not vary
+        parse.use_upsert = True
+        registry = get_handler_registry('../process.cfg', 'grant')
+        parse._get_parser = lambda date, doctype='grant': registry.get(date)
+        self.parsed = []
+        def parse_patent(xmltuple, doctype='grant', handler=None):
+            self.parsed.append(xmltuple[1])
+            return self.saved[2](xmltuple, doctype, handler)
+        parse.parse_patent = parse_patent
+
+    def tearDown(self):
+        parse.cache_directory, parse.queue_size, parse.parse_patent, parse._get_parser, \
+            parse.use_upsert = self.saved
+        alchemy.grantsession = self.session
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self, name, load=False):
+        """
+        Parses the file, or loads it from the cache if [load], into the
+        database [name] and returns its rows
+        """
+        filename = os.path.join(self.tmpdir, name)
+        alchemy.bind_shard(filename)
+        if load:
+            parse.load_cache('ipg\d{6}.xml')
+        else:
+            parse.parse_files([self.filename])
+        return dump(filename)
+
+    def test_segment(self):
+        expected = self.parse('expected.db')
+        path = os.path.join(self.tmpdir, 'cache', 'ipg120327.xml.cache')
+        self.assertTrue(len(self.parsed) == 18)
+        self.assertTrue(os.listdir(os.path.dirname(path)) == ['ipg120327.xml.cache'])
+        header = parse_cache.read_header(path)
+        self.assertTrue(header['state']['hash'] == parse._checksum(self.filename))
+        records = list(parse_cache.read_records(path))
+        self.assertTrue([end for key, end, patobj in records] ==
+                        [start + len(xml) for start, xml in parse.splitter.file_documents(self.filename)])
+
+        # the cached objects are used instead of parsing the file again
+        self.assertTrue(self.parse('cached.db') == expected)
+        self.assertTrue(len(self.parsed) == 18)
+
+        # and the database is reloaded without the XML
+        os.remove(self.filename)
+        self.assertTrue(self.parse('loaded.db', load=True) == expected)
+        self.assertTrue(alchemy.get_parse_state('ipg120327.xml')['complete'])
+        self.assertTrue(self.parse('loaded.db', load=True) == expected)
+
+    def test_changed_document(self):
+        self.parse('first.db')
+        with open(self.filename) as f:
+            xml = f.read()
+        title = xml.index('>', xml.index('<invention-title')) + 1
+        with open(self.filename, 'w') as f:
+            f.write(xml[:title] + 'Changed ' + xml[title:])
+        self.parsed = []
+        expected = dump(os.path.join(self.tmpdir, 'first.db'))
+        changed = self.parse('changed.db')
+        # only the changed document is parsed again
+        self.assertTrue(len(self.parsed) == 1 and 'Changed' in str(self.parsed[0]))
+        self.assertTrue(changed != expected)
+        self.assertTrue(changed == self.parse('loaded.db', load=True))
+
+    def test_moved_documents(self):
+        self.parse('first.db')
+        documents = [str(xml) for start, xml in parse.splitter.file_documents(self.filename)]
+        title = documents[3].index('>', documents[3].index('<invention-title')) + 1
+        inserted = documents[3][:title] + 'Inserted ' + documents[3][title:]
+        # the positions of all the documents after the first one shift
+        with open(self.filename, 'w') as f:
+            f.write(''.join([documents[0], inserted] + documents[1:8] + documents[9:]))
+        self.parsed = []
+        changed = self.parse('changed.db')
+        self.assertTrue(len(self.parsed) == 1 and 'Inserted' in str(self.parsed[0]))
+        records = list(parse_cache.read_records(parse_cache.segment_filename(parse.cache_directory, self.filename)))
+        self.assertTrue(len(records) == 18)
+        parse.cache_directory = None
+        self.assertTrue(changed == self.parse('uncached.db'))
+
+    def test_handler_version(self):
+        self.parse('expected.db')
+        handler = parse._get_parser(parse._get_date(self.filename))
+        parse_cache._versions[handler.__name__] = 'changed'
+        try:
+            self.assertTrue(self.parse('loaded.db', load=True)['patent'] == [])
+            self.parsed = []
+            self.parse('parsed.db')
+            self.assertTrue(len(self.parsed) == 18)
+        finally:
+            del parse_cache._versions[handler.__name__]
+
+    def test_pool(self):
+        filename = os.path.join(self.tmpdir, 'pool.db')
+        alchemy.bind_shard(filename)
+        parse.parse_files([self.filename], workers=2)
+        # a pool bypasses the cache for the files not in it
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'cache', 'ipg120327.xml.cache')))
+        expected = dump(filename)
+        # and reads those in it
+        self.assertTrue(self.parse('cached.db') == expected)
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'loaded.db'))
+        parse.parse_files([self.filename], workers=2)
+        self.assertTrue(dump(os.path.join(self.tmpdir, 'loaded.db')) == expected)
+
+    def test_interrupted(self):
+        def failing(xmltuple, doctype='grant', handler=None):
+            raise KeyboardInterrupt()
+        parse.parse_patent = failing
+        self.assertRaises(KeyboardInterrupt, self.parse, 'failed.db')
+        self.assertFalse(os.listdir(os.path.join(self.tmpdir, 'cache')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -90,5 +90,14 @@ class TestParseFile(unittest.TestCase):
         self.assertTrue(all(filter(lambda x: isinstance(x, str), files)))
         self.assertTrue(all(map(lambda x: os.path.exists(x), files)))
 
+    def test_partition(self):
+        testdir = os.path.join(basedir, './fixtures/ipgxml')
+        files = sorted(parse.list_files(testdir, r'ipg\d{6}.small.xml'))
+        chunks = parse._partition(files, 4)
+        self.assertTrue(len(chunks) == 4)
+        self.assertTrue(all(chunks))
+        self.assertTrue(sum(chunks, []) == files)
+        self.assertTrue(parse._partition(files[:2], 4) == [[files[0]], [files[1]]])
+
 if __name__ == '__main__':
     unittest.main()
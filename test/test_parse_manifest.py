@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+
+sys.path.append('../')
+import parse
+import lib.alchemy as alchemy
+from lib.config_parser import get_handler_registry
+
+basedir = os.path.dirname(__file__)
+testdir = os.path.join(basedir, './fixtures/xml/')
+
+class Crash(Exception):
+    pass
+
+class TestParseManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'ipg120327.xml')
+        shutil.copy(testdir + 'ipg120327.18.xml', self.filename)
+        self.session = alchemy.grantsession
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'grant.db'))
+        self.commit_frequency = parse.commit_frequency
+        parse.commit_frequency = 5
+        self.queue_size = parse.queue_size
+        self.commit_size = parse.commit_size
+        self.use_upsert = parse.use_upsert
+        parse.commit_size = 0
+        # parse in this process, so that self.parse sees the documents parsed
+        parse.queue_size = 0
+        self.parse_patent = parse.parse_patent
+        self.get_parser = parse._get_parser
+        registry = get_handler_registry('../process.cfg', 'grant')
+        parse._get_parser = lambda date, doctype='grant': registry.get(date)
+
+    def tearDown(self):
+        parse.parse_patent = self.parse_patent
+        parse._get_parser = self.get_parser
+        parse.commit_frequency = self.commit_frequency
+        parse.queue_size = self.queue_size
+        parse.commit_size = self.commit_size
+        parse.use_upsert = self.use_upsert
+        alchemy.grantsession = self.session
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self, filename, crash=None, reparse=False):
+        """
+        Parses [filename], raising Crash instead of parsing document number
+        [crash] of the run. Returns the numbers of the documents parsed
+        """
+        parsed = []
+        def parse_patent(xmltuple, doctype='grant', handler=None):
+            if len(parsed) == crash:
+                raise Crash()
+            patobj = self.parse_patent(xmltuple, doctype, handler)
+            parsed.append(patobj.patent)
+            return patobj
+        parse.parse_patent = parse_patent
+        try:
+            parse.parse_files([filename], reparse=reparse)
+        except Crash:
+            # as if the process had died
+            alchemy.grantsession.rollback()
+            alchemy.grantsession.expunge_all()
+        return parsed
+
+    def patents(self):
+        return sorted(row[0] for row in alchemy.grantsession.query(alchemy.schema.Patent.number))
+
+    def test_resume(self):
+        expected = self.parse(self.filename)
+        self.assertTrue(len(expected) == 18)
+        patents = self.patents()
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'resume.db'))
+        self.assertTrue(self.parse(self.filename, crash=12) == expected[:12])
+        state = alchemy.get_parse_state('ipg120327.xml')
+        self.assertTrue(state['documents'] == 10 and not state['complete'])
+        self.assertTrue(self.parse(self.filename) == expected[10:])
+        self.assertTrue(self.patents() == patents)
+        state = alchemy.get_parse_state('ipg120327.xml')
+        self.assertTrue(state['documents'] == 18 and state['complete'])
+        self.assertTrue(state['offset'] == os.path.getsize(self.filename))
+        self.assertTrue(self.parse(self.filename) == [])
+
+    def test_resume_pipeline(self):
+        self.parse(self.filename)
+        patents = self.patents()
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'resume.db'))
+        # the documents are parsed in another process, which raises the crash
+        # after the ones before it are written
+        parse.queue_size = 3
+        self.parse(self.filename, crash=12)
+        state = alchemy.get_parse_state('ipg120327.xml')
+        self.assertTrue(state['documents'] == 10 and not state['complete'])
+        self.assertTrue(len(self.patents()) == 10)
+        self.parse(self.filename)
+        self.assertTrue(self.patents() == patents)
+        self.assertTrue(alchemy.get_parse_state('ipg120327.xml')['complete'])
+
+    def test_commit_size(self):
+        expected = self.parse(self.filename)
+        patents = self.patents()
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'resume.db'))
+        parse.commit_frequency = 0
+        parse.commit_size = os.path.getsize(self.filename) / 4.0 / 1048576
+        parse.use_upsert = False
+        self.parse(self.filename, crash=12)
+        state = alchemy.get_parse_state('ipg120327.xml')
+        self.assertTrue(0 < state['documents'] < 12)
+        self.assertTrue(self.parse(self.filename) == expected[state['documents']:])
+        self.assertTrue(self.patents() == patents)
+        # the committed objects are not kept in the session
+        self.assertTrue(len(alchemy.grantsession.identity_map) == 0)
+
+    def test_failed_commit(self):
+        later = os.path.join(self.tmpdir, 'ipg130416.xml')
+        shutil.copy(os.path.join(basedir, './fixtures/ipgxml/ipg130416.small.xml'), later)
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'later.db'))
+        self.parse(later)
+        patents = self.patents()
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'expected.db'))
+        expected = self.parse(self.filename)
+        patents = sorted(patents + self.patents())
+        commit = alchemy.commit
+        def failing():
+            commits.append(1)
+            if len(commits) == 2:
+                alchemy.grantsession.rollback()
+                return False
+            return commit()
+        for use_upsert in [False, True]:
+            parse.use_upsert = use_upsert
+            alchemy.bind_shard(os.path.join(self.tmpdir, 'resume-{0}.db'.format(use_upsert)))
+            commits = []
+            alchemy.commit = failing
+            parse.parse_patent = self.parse_patent
+            try:
+                parse.parse_files([self.filename, later])
+            finally:
+                alchemy.commit = commit
+            # the manifest still points at the last commit that went through
+            state = alchemy.get_parse_state('ipg120327.xml')
+            self.assertTrue(state['documents'] == 5 and not state['complete'])
+            # and the files after it are parsed
+            self.assertTrue(alchemy.get_parse_state('ipg130416.xml')['complete'])
+            self.assertTrue(self.parse(self.filename) == expected[5:])
+            self.assertTrue(self.patents() == patents)
+
+    def test_projection(self):
+        parse.set_projection(['assignee_list'], None)
+        try:
+            self.assertTrue(len(self.parse(self.filename)) == 18)
+            state = alchemy.get_parse_state('ipg120327.xml')
+            self.assertTrue(state['complete'] and 'assignee_list' in state['projection'])
+            self.assertTrue(alchemy.grantsession.query(alchemy.schema.Claim).count() == 0)
+            # the documents are not recorded as parsed in full
+            self.assertFalse(alchemy.grantsession.execute('select * from document_fingerprint').fetchall())
+            self.assertTrue(self.parse(self.filename) == [])
+        finally:
+            parse.set_projection()
+        # so the full parse that follows loads them again
+        self.assertTrue(len(self.parse(self.filename)) == 18)
+        self.assertTrue(alchemy.get_parse_state('ipg120327.xml')['projection'] is None)
+        self.assertTrue(alchemy.grantsession.query(alchemy.schema.Claim).count() > 0)
+        # which also holds what another projection would parse
+        parse.set_projection(['inventor_list'], None)
+        try:
+            self.assertTrue(self.parse(self.filename) == [])
+        finally:
+            parse.set_projection()
+
+    def test_resume_compressed(self):
+        expected = self.parse(self.filename)
+        alchemy.bind_shard(os.path.join(self.tmpdir, 'resume.db'))
+        with open(self.filename, 'rb') as f:
+            with gzip.open(self.filename + '.gz', 'wb') as z:
+                z.write(f.read())
+        self.assertTrue(self.parse(self.filename + '.gz', crash=7) == expected[:7])
+        self.assertTrue(self.parse(self.filename + '.gz') == expected[5:])
+
+    def test_changed_files(self):
+        self.parse(self.filename)
+        mtime = os.path.getmtime(self.filename) + 10
+        os.utime(self.filename, (mtime, mtime))
+        self.assertTrue(self.parse(self.filename) == [])
+        self.assertTrue(alchemy.get_parse_state('ipg120327.xml')['mtime'] == int(mtime))
+        self.assertTrue(self.parse(self.filename, reparse=True) == [])
+        # same size and modification time, different contents
+        with open(self.filename, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(' ')
+        os.utime(self.filename, (mtime, mtime))
+        self.assertTrue(self.parse(self.filename) == [])
+        self.assertTrue(len(self.parse(self.filename, reparse=True)) == 18)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import unittest
+import multiprocessing
+import multiprocessing.queues
+
+sys.path.append('../')
+import parse
+
+class Failure(Exception):
+    pass
+
+class TestPipeline(unittest.TestCase):
+
+    def test_order_and_metrics(self):
+        metrics = {}
+        self.assertTrue(list(parse.pipeline(iter(range(100)), 8, metrics)) == range(100))
+        self.assertTrue(metrics['items'] == 100)
+        self.assertTrue(0 <= metrics['max_depth'] <= 8)
+        self.assertTrue(metrics['depth'] <= 800)
+
+    def test_unavailable_depth(self):
+        def qsize(queue):
+            raise NotImplementedError()
+        saved = multiprocessing.queues.Queue.qsize
+        multiprocessing.queues.Queue.qsize = qsize
+        try:
+            metrics = {}
+            self.assertTrue(list(parse.pipeline(iter(range(10)), 4, metrics)) == range(10))
+        finally:
+            multiprocessing.queues.Queue.qsize = saved
+        self.assertTrue(metrics['items'] == 10)
+        self.assertTrue(metrics['depth'] is None and metrics['max_depth'] is None)
+        parse._log_metrics('ipg120327.xml', metrics)
+
+    def test_stalls(self):
+        def slow():
+            for i in range(5):
+                time.sleep(0.05)
+                yield i
+        metrics = {}
+        self.assertTrue(list(parse.pipeline(slow(), 2, metrics)) == range(5))
+        self.assertTrue(metrics['consumer_stall'] >= 0.2)
+        metrics = {}
+        for i in parse.pipeline(iter(range(5)), 1, metrics):
+            time.sleep(0.05)
+        self.assertTrue(metrics['producer_stall'] >= 0.1)
+
+    def test_exception(self):
+        def failing():
+            yield 1
+            yield 2
+            raise Failure()
+        consumed = []
+        try:
+            for i in parse.pipeline(failing(), 4, {}):
+                consumed.append(i)
+        except Failure:
+            pass
+        self.assertTrue(consumed == [1, 2])
+
+    def test_close(self):
+        def endless():
+            i = 0
+            while True:
+                i += 1
+                yield i
+        items = parse.pipeline(endless(), 4, {})
+        self.assertTrue(items.next() == 1)
+        items.close()
+        self.assertFalse(multiprocessing.active_children())
+
+    def test_producer_exit(self):
+        def exiting():
+            os._exit(3)
+            yield
+        self.assertRaises(RuntimeError, list, parse.pipeline(exiting(), 4, {}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import os
+import bz2
+import sys
+import gzip
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+sys.path.append('../')
+import parse
+import lib.splitter as splitter
+
+basedir = os.path.dirname(__file__)
+testdir = os.path.join(basedir, './fixtures/')
+testfiles = ['xml/ipg120327.one.xml', 'xml/ipg120327.two.xml', 'xml/ipg120327.18.xml',
+             'xml/pa040101.two.xml', 'ipgxml/ipg050104.small.xml', 'ipgxml/ipg130416.small.xml']
+
+class TestSplitter(unittest.TestCase):
+
+    def test_document_ranges_match_extract_xml_strings(self):
+        for filename in testfiles:
+            filename = testdir + filename
+            expected = [doc for date, doc in parse.extract_xml_strings(filename)]
+            buf = splitter.open_mapped(filename)
+            docs = [buf[start:end] for start, end in splitter.document_ranges(buf)]
+            self.assertTrue(docs == expected, filename)
+
+    def test_document_ranges_are_contiguous(self):
+        buf = splitter.open_mapped(testdir + 'xml/ipg120327.18.xml')
+        ranges = list(splitter.document_ranges(buf))
+        self.assertTrue(len(ranges) == 18)
+        self.assertTrue(ranges[0][0] == 0)
+        for (start, end), (nextstart, nextend) in zip(ranges, ranges[1:]):
+            self.assertTrue(end == nextstart)
+
+    def test_document_ranges_incomplete(self):
+        doc = '<?xml version="1.0"?>\n<!DOCTYPE a SYSTEM "a.dtd" [ ]>\n<a>\n</a>\n'
+        self.assertTrue(list(splitter.document_ranges(doc)) == [(0, len(doc))])
+        self.assertTrue(list(splitter.document_ranges(doc + doc[:-6])) == [(0, len(doc))])
+        self.assertTrue(list(splitter.document_ranges('')) == [])
+
+class TestCompressed(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.plain = testdir + 'xml/ipg120327.18.xml'
+        with open(self.plain, 'rb') as f:
+            self.xml = f.read()
+        self.files = [os.path.join(self.tmpdir, name) for name in
+                      ['ipg120327.zip', 'ipg120328.xml.gz', 'ipg120329.xml.bz2']]
+        with zipfile.ZipFile(self.files[0], 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('ipg120327.xml', self.xml)
+        with gzip.open(self.files[1], 'wb') as f:
+            f.write(self.xml)
+        f = bz2.BZ2File(self.files[2], 'wb')
+        f.write(self.xml)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_xml_name(self):
+        self.assertTrue(splitter.xml_name('ipg120327.zip') == 'ipg120327.xml')
+        self.assertTrue(splitter.xml_name('ipg120327.xml.gz') == 'ipg120327.xml')
+        self.assertTrue(splitter.xml_name('ipg120327.xml') == 'ipg120327.xml')
+        self.assertFalse(splitter.is_compressed('ipg120327.xml'))
+
+    def test_compressed_documents(self):
+        expected = [doc for date, doc in parse.extract_xml_strings(self.plain)]
+        ranges = list(splitter.document_ranges(self.xml))
+        for filename in self.files:
+            self.assertTrue([doc for date, doc in parse.extract_xml_strings(filename)] == expected, filename)
+            offsets = [(offset, offset + len(doc)) for offset, doc in splitter.file_documents(filename)]
+            self.assertTrue(offsets == ranges, filename)
+            start, end = ranges[5]
+            self.assertTrue(splitter.read_document(filename, start, end - start) == expected[5])
+
+    def test_stream_chunks(self):
+        expected = [(start, self.xml[start:end]) for start, end in splitter.document_ranges(self.xml)]
+        chunksize = splitter.chunksize
+        try:
+            for size in [1, 7, 13, 64, 4096]:
+                splitter.chunksize = size
+                f = splitter.open_compressed(self.files[1])
+                self.assertTrue(list(splitter.stream_documents(f)) == expected, size)
+                f.close()
+        finally:
+            splitter.chunksize = chunksize
+
+    def test_list_files(self):
+        shutil.copy(self.plain, os.path.join(self.tmpdir, 'ipg120329.xml'))
+        files = sorted(os.path.basename(f) for f in parse.list_files(self.tmpdir, r'ipg\d{6}.xml'))
+        self.assertTrue(files == ['ipg120327.zip', 'ipg120328.xml.gz', 'ipg120329.xml'])
+
+if __name__ == '__main__':
+    unittest.main()
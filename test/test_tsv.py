@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.append('../')
+import parse
+import lib.alchemy as alchemy
+import lib.alchemy.tsv as tsv
+from test_xml_engines import documents
+
+uuid_regex = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+def dump(filename):
+    """
+    Returns the sorted rows of each table in the SQLite database [filename],
+    with the random uuids replaced by a placeholder
+    """
+    db = sqlite3.connect(filename)
+    tables = {}
+    for (table,) in db.execute("select name from sqlite_master where type='table'"):
+        rows = [tuple('<uuid>' if isinstance(value, basestring) and uuid_regex.match(value) else value
+                      for value in row)
+                for row in db.execute('select * from {0}'.format(table))]
+        tables[table] = sorted(rows)
+    db.close()
+    return tables
+
+class TestTSV(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir='.')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_escape(self):
+        for value in [u'plain', u'tab\tnew\nline\r', u'back\\slash \\N', u'"quoted" \0 \x1a \b',
+                      u'\xe9\u2014', u'', u'\\']:
+            field = tsv.escape(value)
+            self.assertFalse('\t' in field or '\n' in field)
+            self.assertEqual(tsv.unescape(field), value)
+        self.assertEqual(tsv.escape(None), '\\N')
+        self.assertEqual(tsv.unescape('\\N'), None)
+        self.assertEqual(tsv.escape(3), '3')
+
+    def test_matches_orm(self):
+        patobjs = {'grant': [], 'application': []}
+        for filename, handler, xml in documents():
+            doctype = 'application' if 'application' in handler.__name__ else 'grant'
+            patobj = parse.parse_patent((None, xml), doctype, handler)
+            if patobj:
+                patobjs[doctype].append(patobj)
+        sessions = alchemy.grantsession, alchemy.appsession
+        try:
+            for doctype, objs in patobjs.items():
+                directory = os.path.join(self.directory, doctype)
+                writer = tsv.TSVWriter(directory, doctype)
+                for obj in objs:
+                    writer.add(obj)
+                writer.close()
+                loaded = os.path.join(self.directory, doctype + '-tsv.db')
+                tsv.load_tsv(directory, alchemy.shard_session(loaded, doctype), doctype)
+
+                expected = os.path.join(self.directory, doctype + '-orm.db')
+                alchemy.bind_shard(expected, doctype)
+                for obj in objs:
+                    if doctype == 'grant':
+                        alchemy.add_grant(obj)
+                    else:
+                        alchemy.add_application(obj)
+                alchemy.commit()
+                alchemy.commit_application()
+
+                upserted = os.path.join(self.directory, doctype + '-upsert.db')
+                alchemy.bind_shard(upserted, doctype)
+                if doctype == 'grant':
+                    alchemy.upsert_grants(objs)
+                else:
+                    alchemy.upsert_applications(objs)
+                alchemy.commit()
+                alchemy.commit_application()
+
+                expected, loaded = dump(expected), dump(loaded)
+                self.assertEqual(sorted(expected), sorted(loaded))
+                for table in expected:
+                    # the ORM writes a raw location per inventor, assignee and
+                    # lawyer, the writers share one row per distinct location
+                    if table == 'rawlocation':
+                        self.assertTrue(set(expected[table]) == set(loaded[table]))
+                        continue
+                    self.assertTrue(expected[table] == loaded[table], '{0} {1}'.format(doctype, table))
+                self.assertTrue(len(loaded['claim']) > 0)
+                self.assertTrue(dump(upserted) == loaded)
+        finally:
+            alchemy.grantsession, alchemy.appsession = sessions
+
+if __name__ == '__main__':
+    unittest.main()
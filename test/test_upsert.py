@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import copy
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.append('../')
+import parse
+import lib.alchemy as alchemy
+import lib.alchemy.upsert as upsert
+import lib.alchemy.rows as rows
+from test_xml_engines import documents
+
+def dump(filename):
+    """
+    Returns the sorted rows of each table in the SQLite database [filename]
+    """
+    db = sqlite3.connect(filename)
+    tables = {}
+    for (table,) in db.execute("select name from sqlite_master where type='table'"):
+        tables[table] = sorted(db.execute('select * from {0}'.format(table)))
+    db.close()
+    return tables
+
+class TestUpsert(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.objs = []
+        for filename, handler, xml in documents():
+            if 'grant' in handler.__name__:
+                patobj = parse.parse_patent((None, xml), 'grant', handler)
+                if patobj:
+                    cls.objs.append(patobj)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir='.')
+        self.session = alchemy.grantsession
+
+    def tearDown(self):
+        alchemy.grantsession = self.session
+        shutil.rmtree(self.directory)
+
+    def upsert(self, name, *batches):
+        filename = os.path.join(self.directory, name)
+        alchemy.bind_shard(filename)
+        for batch in batches:
+            alchemy.upsert_grants(batch)
+            alchemy.commit()
+        return dump(filename)
+
+    def test_reload(self):
+        once = self.upsert('once.db', self.objs)
+        self.assertTrue(len(once['patent']) > 100)
+        twice = self.upsert('twice.db', self.objs[:50], self.objs, self.objs[20:80])
+        self.assertTrue(once == twice)
+
+    def test_changed_document(self):
+        changed = copy.deepcopy(self.objs[0])
+        changed.claims = changed.claims[1:]
+        changed.pat = dict(changed.pat, title=u'Changed')
+        cits, refs = changed.citation_list
+        changed.citation_list = (cits[:-1], refs)
+        changed.inventor_list = changed.inventor_list[::-1]
+        expected = self.upsert('expected.db', [changed] + self.objs[1:])
+        replaced = self.upsert('replaced.db', self.objs, [changed])
+        for table in expected:
+            if table != 'rawlocation':
+                self.assertTrue(expected[table] == replaced[table], table)
+        self.assertTrue(set(expected['rawlocation']) <= set(replaced['rawlocation']))
+
+    def test_duplicates_in_batch(self):
+        first = copy.deepcopy(self.objs[0])
+        first.pat = dict(first.pat, title=u'First')
+        self.assertTrue(self.upsert('batch.db', [first, self.objs[0]]) == self.upsert('single.db', self.objs[:1]))
+
+    def test_batch_writer(self):
+        expected = self.upsert('expected.db', self.objs)
+        filename = os.path.join(self.directory, 'writer.db')
+        alchemy.bind_shard(filename)
+        writer = upsert.BatchWriter()
+        for i, obj in enumerate(self.objs):
+            writer.add(obj)
+            if i % 100 == 99:
+                alchemy.write_batch(writer)
+                self.assertTrue(len(writer) == 0)
+                alchemy.commit()
+        alchemy.write_batch(writer)
+        alchemy.commit()
+        self.assertTrue(dump(filename) == expected)
+        self.assertTrue(len(writer.written['mainclass']) == len(expected['mainclass']))
+        self.assertTrue(len(writer.written['rawlocation']) == len(expected['rawlocation']))
+        self.assertTrue(len(expected['rawlocation']) < len(expected['rawinventor']) + len(expected['rawassignee']))
+
+        # shared rows written in a rolled back transaction are written again after reset
+        alchemy.bind_shard(os.path.join(self.directory, 'rollback.db'))
+        writer = upsert.BatchWriter()
+        writer.add(self.objs[0])
+        alchemy.write_batch(writer)
+        alchemy.grantsession.rollback()
+        writer.reset()
+        writer.add(self.objs[0])
+        alchemy.write_batch(writer)
+        alchemy.commit()
+        self.assertTrue(dump(os.path.join(self.directory, 'rollback.db')) == self.upsert('single.db', self.objs[:1]))
+
+    def test_records(self):
+        writer = upsert.BatchWriter()
+        for obj in self.objs:
+            writer.add(obj)
+        columns = [column.name for column in alchemy.schema.USPatentCitation.__table__.columns]
+        countries = {}
+        for rows in writer.documents.values():
+            for table, row in rows:
+                self.assertTrue(type(row) == tuple)
+                if table == 'uspatentcitation':
+                    country = row[columns.index('country')]
+                    self.assertTrue(countries.setdefault(country, country) is country)
+        self.assertTrue(countries.keys() == [u'US'])
+        # the values of the other columns are not shared
+        self.assertFalse('uuid' in upsert.interned_columns or 'number' in upsert.interned_columns)
+
+    def test_projection(self):
+        full = self.upsert('full.db', self.objs)
+        attributes, tables = rows.projection(['assignee_list', 'inventor_list', 'us_classifications'])
+        for name in ['projected.db', 'full.db']:
+            alchemy.bind_shard(os.path.join(self.directory, name))
+            writer = alchemy.batch_writer('grant', tables)
+            for obj in self.objs:
+                writer.add(obj)
+            alchemy.write_batch(writer)
+            alchemy.commit()
+        projected = dump(os.path.join(self.directory, 'projected.db'))
+        for table in full:
+            self.assertTrue(projected[table] == (full[table] if table in tables else []), table)
+        self.assertTrue(len(projected['rawinventor']) > 0 and len(full['claim']) > 0)
+        # reloading with the projection leaves the other tables alone
+        self.assertTrue(dump(os.path.join(self.directory, 'full.db')) == full)
+
+if __name__ == '__main__':
+    unittest.main()
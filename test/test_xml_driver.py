@@ -8,7 +8,7 @@ from xml.sax import make_parser, handler
 from cgi import escape as html_escape
 
 sys.path.append('../lib/handlers/')
-from xml_driver import XMLElement, XMLHandler
+from xml_driver import XMLElement, XMLHandler, ChainList, parse_document, _search
 
 # Directory of test files
 basedir = os.curdir
@@ -49,4 +49,84 @@ class Test_XMLElement_Basic(unittest.TestCase):
         self.assertTrue(self.root.a.b.contents_of('c') == ['HELLO','WORLD','3'])
         self.assertTrue(self.root.a.b[0].contents_of('c') == ['HELLO','WORLD'])
 
+class Test_parse_document(unittest.TestCase):
+
+    def setUp(self):
+        with open(testdir+'basic.xml') as f:
+            self.xml = f.read()
+
+    def test_parse_document_sources(self):
+        fromfile = parse_document(testdir+'basic.xml').root
+        fromstring = parse_document(self.xml, True).root
+        frombuffer = parse_document(buffer(self.xml), True).root
+        for root in [fromstring, frombuffer]:
+            self.assertTrue(root.a.b.contents_of('c') == fromfile.a.b.contents_of('c'))
+            self.assertTrue(root.a.contents_of('d') == fromfile.a.contents_of('d'))
+
+    def test_parse_document_skip(self):
+        full = parse_document(testdir+'ipg120327.one.xml').root.us_patent_grant
+        skipped = parse_document(testdir+'ipg120327.one.xml', skip=('description',)).root.us_patent_grant
+        self.assertTrue(full.description)
+        self.assertTrue(skipped.description == [])
+        self.assertTrue(skipped.claims.contents_of('claim_text') == full.claims.contents_of('claim_text'))
+        self.assertTrue(skipped.contents_of('invention_title') == full.contents_of('invention_title'))
+
+class Test_tag_index(unittest.TestCase):
+
+    def setUp(self):
+        self.root = parse_document(testdir+'ipg120327.one.xml').root
+
+    def walk(self, element, depth):
+        yield element
+        if depth:
+            for child in element.children:
+                for elem in self.walk(child, depth-1):
+                    yield elem
+
+    def test_find_matches_search(self):
+        names = self.root.children[0]._tags.keys()
+        for element in self.walk(self.root, 4):
+            for name in names:
+                self.assertTrue(element.find(name) == _search(element.children, name),
+                                '{0}.{1}'.format(element._name, name))
+
+    def test_chainlist_matches_search(self):
+        names = self.root.children[0]._tags.keys()
+        for chain in [self.root.us_patent_grant.us_bibliographic_data_grant.children,
+                      self.root.us_patent_grant.claims.claim,
+                      ChainList([self.root.us_patent_grant.claims[0],
+                                 self.root.us_patent_grant.us_bibliographic_data_grant[0]])]:
+            for name in names:
+                self.assertTrue(getattr(chain, name) == _search(chain, name), name)
+
+    def test_find_tags(self):
+        names = set(self.root.children[0]._tags.keys())
+        for element in self.walk(self.root, 6):
+            expected = dict((name, element.find(name)) for name in names if element.find(name))
+            self.assertTrue(element.find_tags(names) == expected, element._name)
+        citation = self.root.us_patent_grant.references_cited.citation[0]
+        found = citation.find_tags(set(['country', 'date', 'othercit']))
+        # the country of the classification comes before that of the document
+        self.assertTrue(found['country'] == citation.find('country') and len(found['country']) == 2)
+        self.assertFalse('othercit' in found)
+
+    def test_no_index(self):
+        element = XMLElement('a', {})
+        child = XMLElement('b', {})
+        element.add_child(child)
+        self.assertTrue(element.b == [child])
+        self.assertTrue(element.c == [])
+
+    def test_get_content_cache(self):
+        element = XMLElement('a', {})
+        element.put_content(u'one & <b>', -1, 1)
+        self.assertTrue(element.get_content() == u'ONE & &LT;B&GT;')
+        self.assertTrue(element.get_content(upper=False) == u'one & &lt;b&gt;')
+        self.assertTrue(element.get_content() == u'ONE & &LT;B&GT;')
+        element.put_content(u'two', 1, 2)
+        content = element.get_content(upper=False)
+        self.assertTrue(content == [u'one & &lt;b&gt;', u'two'])
+        content.append(u'three')
+        self.assertTrue(element.get_content(upper=False) == [u'one & &lt;b&gt;', u'two'])
+
 unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Differential test of the parse engines in lib/handlers/xml_driver.py: every
+document in the fixtures must give the same XMLElement tree and the same
+get_patobj() output under each engine. Prints the docs/sec of each engine
+"""
+
+import os
+import re
+import sys
+import time
+import uuid
+import glob
+import itertools
+import unittest
+
+sys.path.append('../')
+import parse
+import lib.splitter as splitter
+import lib.handlers.xml_driver as xml_driver
+from lib.config_parser import get_handler_registry
+
+basedir = os.path.dirname(__file__)
+testfiles = sorted(glob.glob(os.path.join(basedir, 'fixtures/ipgxml/*.xml')) +
+                   glob.glob(os.path.join(basedir, 'fixtures/xml/*.xml')))
+application_regex = re.compile(r'<!DOCTYPE (us-patent-application|patent-application-publication)')
+
+def documents():
+    for filename in testfiles:
+        buf = splitter.open_mapped(filename)
+        for start, end in splitter.document_ranges(buf):
+            xml = buffer(buf, start, end - start)
+            doctype = 'application' if application_regex.search(xml) else 'grant'
+            handler = get_handler_registry('../process.cfg', doctype).get(parse._get_date(filename))
+            yield filename, handler, xml
+
+def tree(element):
+    return (element._name, element._attributes, element.content,
+            [tree(child) for child in element.children])
+
+def patobj(handler, xml, engine):
+    """
+    Returns the get_patobj() output of [handler] for [xml] as a dictionary,
+    with the random uuids replaced by a counter so that runs compare equal
+    """
+    counter = itertools.count()
+    uuid1 = uuid.uuid1
+    uuid.uuid1 = lambda: 'uuid-{0}'.format(next(counter))
+    try:
+        xml_driver.set_engine(engine)
+        return handler.Patent(xml, True).get_patobj().__dict__
+    finally:
+        uuid.uuid1 = uuid1
+        xml_driver.set_engine('sax')
+
+class TestXMLEngines(unittest.TestCase):
+
+    timings = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        for engine, (docs, seconds) in sorted(cls.timings.items()):
+            print >> sys.stderr, '{0}: {1:.1f} docs/sec'.format(engine, docs / seconds)
+
+    def setUp(self):
+        self.engines = ['expat']
+        if xml_driver.etree is not None:
+            self.engines.append('lxml')
+
+    def test_set_engine(self):
+        self.assertRaises(ValueError, xml_driver.set_engine, 'unknown')
+        for engine in self.engines:
+            xml_driver.set_engine(engine)
+            self.assertTrue(xml_driver.default_engine == engine)
+        xml_driver.set_engine('sax')
+
+    def test_trees(self):
+        docs = list(documents())
+        self.assertTrue(len(docs) > 100)
+        for engine in ['sax'] + self.engines:
+            start = time.time()
+            for filename, handler, xml in docs:
+                xml_driver.parse_document(xml, True, engine)
+            self.timings[engine] = (len(docs), time.time() - start)
+        for filename, handler, xml in docs:
+            expected = tree(xml_driver.parse_document(xml, True, 'sax').root)
+            for engine in self.engines:
+                result = tree(xml_driver.parse_document(xml, True, engine).root)
+                self.assertTrue(result == expected, '{0} differs for {1}'.format(engine, filename))
+
+    def test_patobjs(self):
+        for filename, handler, xml in documents():
+            expected = patobj(handler, xml, 'sax')
+            for engine in self.engines:
+                result = patobj(handler, xml, engine)
+                self.assertTrue(result == expected, '{0} differs for {1}'.format(engine, filename))
+
+if __name__ == '__main__':
+    unittest.main()
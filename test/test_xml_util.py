@@ -3,16 +3,49 @@
 import os
 import sys
 import re
+import glob
 import unittest
+from datetime import datetime
 from cgi import escape as html_escape
 
 sys.path.append('../lib/handlers/')
+sys.path.append('../')
 import xml_util
+import xml_driver
+import lib.splitter as splitter
 
 text_fixtures = os.path.join(os.curdir, 'fixtures/text/')
 with open(text_fixtures+'accented_characters.txt') as f:
     accent_file = f.read()
 
+def composed_clean(string, upper=True):
+    """
+    clean as the composition of the separate cleaning steps
+    """
+    string = xml_util.normalize_utf8(string)
+    string = xml_util.remove_escape_sequences(string)
+    string = xml_util.translate_underscore(string)
+    string = xml_util.escape_html(string)
+    string = string.replace("&nbsp;", " ").replace("&amp;", "&")
+    return string.upper() if upper else string
+
+def fixture_strings():
+    """
+    Yields the content and attribute values of every element of the
+    documents in the XML fixtures
+    """
+    for filename in sorted(glob.glob('fixtures/ipgxml/*.xml') + glob.glob('fixtures/xml/*.xml')):
+        buf = splitter.open_mapped(filename)
+        for start, end in splitter.document_ranges(buf):
+            scope = [xml_driver.parse_document(buffer(buf, start, end - start), True).root]
+            while scope:
+                element = scope.pop()
+                for string in element.content:
+                    yield string
+                for string in (element._attributes or {}).itervalues():
+                    yield string
+                scope.extend(element.children)
+
 class Test_xml_util(unittest.TestCase):
 
     def setUp(self):
@@ -162,6 +195,28 @@ class Test_xml_util(unittest.TestCase):
         resstring = xml_util.normalize_document_identifier(teststring)
         self.assertTrue(resstring == "D123456",resstring)
 
+    def test_clean(self):
+        for string in ["&amp; &nbsp; & &lt;b&gt;", "<b>x</b> <sub>-</sub>",
+                       u"<sub>\u2014</sub> <sub>&#x2014;</sub>", "a\r\n\t\v\b\f\a  b",
+                       accent_file, u"e\u0301 \u212b", "", " "]:
+            for upper in [True, False]:
+                res = xml_util.clean(string, upper)
+                goal = composed_clean(string, upper)
+                self.assertTrue(res == goal and type(res) == type(goal), \
+                    u"{0}\nshould be\n{1}".format(res, goal))
+        self.assertRaises(AttributeError, xml_util.clean, None)
+
+    def test_clean_fixtures(self):
+        count = 0
+        for string in fixture_strings():
+            count += 1
+            for upper in [True, False]:
+                res = xml_util.clean(string, upper)
+                goal = composed_clean(string, upper)
+                self.assertTrue(res == goal and type(res) == type(goal), \
+                    u"{0}\nshould be\n{1}".format(res, goal))
+        self.assertTrue(count > 100000)
+
     def test_associate_prefix_1(self):
         firstname = "Troy Van Der"
         lastname = "Whol"
@@ -170,6 +225,15 @@ class Test_xml_util(unittest.TestCase):
             "{0}\nshould be\n{1}\nand\n{2}\nshould be\n{3}".format\
             (newfirst, "Troy", newlast, "Van Der Whol"))
 
+    def test_fix_date(self):
+        self.assertTrue(xml_util.fix_date('20120327') == datetime(2012, 3, 27))
+        self.assertTrue(xml_util.fix_date('19290200') == datetime(1929, 2, 1))
+        self.assertTrue(xml_util.fix_date('19940000') == datetime(1994, 1, 1))
+        for datestring in ['', None, '18991231', '2012']:
+            self.assertTrue(xml_util.fix_date(datestring) is None)
+        # repeated dates are converted once
+        self.assertTrue(xml_util.fix_date('20120327') is xml_util.fix_date('20120327'))
+
     def test_associate_prefix_2(self):
         firstname = "Troy"
         lastname = "Van Der Whol"